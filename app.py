@@ -4,8 +4,7 @@ PR-Agent 可视化管理平台
 提供 Web 界面来管理和审查 GitLab Merge Requests
 """
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
-import requests
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 import subprocess
 import os
 import json
@@ -13,6 +12,32 @@ from datetime import datetime, timezone, timedelta
 from pathlib import Path
 import threading
 import sqlite3
+import time
+import atexit
+import tempfile
+import hmac
+import argparse
+import signal
+import sys
+import uuid
+from types import MappingProxyType
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, as_completed, wait
+from review_pool import (
+    ReviewPool, PRIORITY_INTERACTIVE, PRIORITY_MR_WEBHOOK, PRIORITY_PUSH_WEBHOOK, PRIORITY_BACKFILL
+)
+from job_queue import JobQueue
+from status_store import ReviewStatusStore, SQLiteReviewStatusStore, CancelFlag, ChildCancelFlag, FINAL_STATUSES
+from container_pool import ContainerPool, CommandCancelled, run_command
+from webhook_inventory import WebhookInventory
+from ttl_cache import TTLCache
+from webhook_spool import WebhookSpool
+import diff_packer
+from review_cache import ReviewCache, review_cache_key
+from metrics import registry
+import gitlab_client
+import dashscope_client
+from dashscope_client import GenerationCancelled
+from gitlab_client import encode_project, project_path_from_url, is_timeout_error, paginate
 
 # 中国时区 (UTC+8)
 CHINA_TZ = timezone(timedelta(hours=8))
@@ -29,8 +54,27 @@ HISTORY_FILE = os.path.expanduser("~/pr-agent-dashboard/history.json")
 PROMPT_FILE = os.path.expanduser("~/pr-agent-dashboard/prompts.json")
 DB_FILE = os.path.expanduser("~/pr-agent-dashboard/reviews.db")
 
-# 全局变量存储审查状态
-review_status = {}
+# 全局变量存储审查状态（状态变化会推送给 SSE 订阅者）
+# 多进程部署（wsgi.py）时替换为 SQLite 存储，见 use_shared_review_status()
+review_status = ReviewStatusStore()
+
+# 可取消的审查：review_id -> threading.Event
+review_cancel_events = {}
+
+# 持久化的 Webhook 审查任务队列
+review_jobs = JobQueue(DB_FILE)
+
+# Webhook 落盘文件：接收请求时只追加记录，由后台线程写入任务队列
+WEBHOOK_SPOOL_FILE = os.path.join(os.path.dirname(DB_FILE), 'webhook-spool.jsonl')
+
+# 项目 Webhook 配置索引（后台线程刷新）
+webhook_inventory = WebhookInventory(DB_FILE)
+
+# AI 审查结果缓存（相同补丁复用审查结果）
+review_cache = ReviewCache(DB_FILE)
+
+# 多进程部署时各进程的指标文件目录，/metrics 合并输出
+METRICS_DIR = os.path.join(os.path.dirname(DB_FILE), 'metrics')
 
 # 初始化数据库
 def init_database():
@@ -48,43 +92,364 @@ def init_database():
             author TEXT NOT NULL,
             branch TEXT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            details TEXT
+            details TEXT,
+            commit_sha TEXT,
+            mr_iid INTEGER,
+            event TEXT,
+            status TEXT NOT NULL DEFAULT 'done',
+            claimed_at REAL
         )
     ''')
+    
+    # 旧版本数据库没有去重字段，需要迁移
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(review_records)')}
+    if 'commit_sha' not in columns:
+        migrate_review_records(cursor)
+    # 旧版本的记录没有审查状态，都视为已完成
+    if 'status' not in columns:
+        cursor.execute("ALTER TABLE review_records ADD COLUMN status TEXT NOT NULL DEFAULT 'done'")
+        cursor.execute('ALTER TABLE review_records ADD COLUMN claimed_at REAL')
+    
+    # 去重索引：同一项目的同一个 commit 只记录一次；
+    # 同一 MR 的同一事件、同一 head commit 只记录一次
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_review_records_commit
+        ON review_records (project_id, commit_sha) WHERE type = 'commit'
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_review_records_mr
+        ON review_records (project_id, mr_iid, event, commit_sha) WHERE type = 'mr'
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_review_records_timestamp ON review_records (timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_review_records_url ON review_records (url)')
     conn.commit()
     conn.close()
+    review_jobs.init_schema()
+    webhook_inventory.init_schema()
+    review_cache.init_schema()
     print(f"数据库已初始化: {DB_FILE}")
 
+def migrate_review_records(cursor):
+    """增加 commit_sha / mr_iid / event 字段，并从 details JSON 回填"""
+    print("🔧 迁移审查记录表：增加去重字段...")
+    cursor.execute('ALTER TABLE review_records ADD COLUMN commit_sha TEXT')
+    cursor.execute('ALTER TABLE review_records ADD COLUMN mr_iid INTEGER')
+    cursor.execute('ALTER TABLE review_records ADD COLUMN event TEXT')
+    
+    seen_commits = set()
+    rows = cursor.execute('SELECT id, type, project_id, details FROM review_records ORDER BY id').fetchall()
+    for record_id, review_type, project_id, details in rows:
+        try:
+            info = json.loads(details) if details else {}
+        except ValueError:
+            info = {}
+        
+        if review_type == 'commit' and info.get('sha'):
+            key = (project_id, info['sha'])
+            # 历史上的重复记录只保留最早一条的去重字段，避免唯一索引冲突
+            commit_sha = info['sha'] if key not in seen_commits else None
+            seen_commits.add(key)
+            cursor.execute(
+                'UPDATE review_records SET commit_sha = ?, event = ? WHERE id = ?',
+                (commit_sha, 'push', record_id)
+            )
+        elif review_type == 'mr' and info.get('iid') is not None:
+            cursor.execute(
+                'UPDATE review_records SET mr_iid = ?, event = ? WHERE id = ?',
+                (info['iid'], info.get('action'), record_id)
+            )
+    print(f"✅ 已回填 {len(rows)} 条审查记录")
+
+# 审查记录状态：pending（审查中）、done（已完成）、failed（失败，可以重新审查）
+RECORD_PENDING = 'pending'
+RECORD_DONE = 'done'
+RECORD_FAILED = 'failed'
+
+def review_record_key(review_type, project_id, commit_sha=None, mr_iid=None, event=None):
+    """审查记录去重键对应的 WHERE 条件和参数（与唯一索引一致）"""
+    if review_type == 'commit':
+        return 'type = ? AND project_id = ? AND commit_sha = ?', (review_type, project_id, commit_sha)
+    return (
+        'type = ? AND project_id = ? AND mr_iid = ? AND event IS ? AND commit_sha IS ?',
+        (review_type, project_id, mr_iid, event, commit_sha)
+    )
+
 # 记录审查
-def record_review(review_type, project_id, project_name, title, url, author, branch='', details=''):
-    """记录审查到数据库"""
+def record_review(review_type, project_id, project_name, title, url, author, branch='', details='',
+                  commit_sha=None, mr_iid=None, event=None):
+    """占用审查记录（状态为 pending），审查结束后由 finish_review_record 更新状态
+
+    使用 INSERT OR IGNORE 原子去重；已有记录但审查失败，或停留在 pending 超过任务租约时间
+    （执行审查的进程已崩溃）时重新占用。返回 True 表示占用成功，
+    False 表示已有相同记录（其他 Webhook 已处理或正在处理），写入出错时返回 None。
+    """
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(DB_FILE, timeout=30)
         cursor = conn.cursor()
+        now = time.time()
         # 使用中国时区的当前时间
         china_time = get_china_time().strftime('%Y-%m-%d %H:%M:%S')
         cursor.execute('''
-            INSERT INTO review_records 
-            (type, project_id, project_name, title, url, author, branch, timestamp, details)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (review_type, project_id, project_name, title, url, author, branch, china_time, details))
+            INSERT OR IGNORE INTO review_records 
+            (type, project_id, project_name, title, url, author, branch, timestamp, details, commit_sha, mr_iid, event,
+             status, claimed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (review_type, project_id, project_name, title, url, author, branch, china_time, details,
+              commit_sha, mr_iid, event, RECORD_PENDING, now))
+        inserted = cursor.rowcount == 1
+        if not inserted:
+            where, params = review_record_key(review_type, project_id, commit_sha, mr_iid, event)
+            cursor.execute(f'''
+                UPDATE review_records SET status = ?, claimed_at = ?, timestamp = ?
+                WHERE {where} AND (status = ? OR (status = ? AND claimed_at < ?))
+            ''', (RECORD_PENDING, now, china_time, *params,
+                  RECORD_FAILED, RECORD_PENDING, now - review_jobs.lease_seconds))
+            inserted = cursor.rowcount > 0
         conn.commit()
         conn.close()
-        print(f"✅ 已记录审查: {review_type} - {project_name} - {title}")
+        if inserted:
+            print(f"✅ 已记录审查: {review_type} - {project_name} - {title}")
+        return inserted
     except Exception as e:
         print(f"❌ 记录审查失败: {e}")
+        return None
+
+def finish_review_record(review_type, project_id, status, commit_sha=None, mr_iid=None, event=None):
+    """审查结束后更新记录状态（done 或 failed），failed 的记录可以被重新占用"""
+    try:
+        where, params = review_record_key(review_type, project_id, commit_sha, mr_iid, event)
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        conn.execute(f'UPDATE review_records SET status = ? WHERE {where}', (status, *params))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"❌ 更新审查记录失败: {e}")
+
+# .env 配置快照缓存：文件未变化时直接返回上次解析的结果
+_env_cache = {'key': None, 'config': None}
+_env_cache_lock = threading.Lock()
+# 串行化 .env 的读-改-写，避免两个保存请求互相覆盖
+_env_write_lock = threading.Lock()
 
 def load_env_config():
-    """加载 .env 配置"""
-    config = {}
-    if os.path.exists(ENV_FILE):
-        with open(ENV_FILE, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    config[key] = value
-    return config
+    """加载 .env 配置
+
+    返回只读的配置快照，只有文件的 inode / 修改时间 / 大小变化时才重新解析。
+    """
+    try:
+        stat = os.stat(ENV_FILE)
+        cache_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        cache_key = None
+    
+    with _env_cache_lock:
+        if _env_cache['config'] is not None and _env_cache['key'] == cache_key:
+            return _env_cache['config']
+        
+        config = {}
+        if cache_key is not None:
+            with open(ENV_FILE, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#') and '=' in line:
+                        key, value = line.split('=', 1)
+                        config[key] = value
+        
+        _env_cache['key'] = cache_key
+        _env_cache['config'] = MappingProxyType(config)
+        return _env_cache['config']
+
+def write_env_file(lines):
+    """原子写入 .env：先写临时文件再重命名，读取方不会看到写了一半的文件"""
+    env_dir = os.path.dirname(ENV_FILE)
+    os.makedirs(env_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=env_dir, prefix='.env.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        # 保留原文件权限（.env 中包含 Token）
+        if os.path.exists(ENV_FILE):
+            os.chmod(tmp_path, os.stat(ENV_FILE).st_mode & 0o777)
+        os.replace(tmp_path, ENV_FILE)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def get_config_int(config, key, default):
+    """读取整数配置，无效时使用默认值"""
+    try:
+        return int(config.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+# 审查线程池：MR 审查运行 Docker（耗时长），Commit 审查调用 AI HTTP 接口，分开限制并发
+_pool_config = load_env_config()
+mr_review_pool = ReviewPool('mr', get_config_int(_pool_config, 'REVIEW_MR_WORKERS', 2))
+commit_review_pool = ReviewPool('commit', get_config_int(_pool_config, 'REVIEW_COMMIT_WORKERS', 4))
+
+# PR-Agent 常驻容器池，默认每个 MR 审查线程对应一个容器
+PR_AGENT_IMAGE = 'codiumai/pr-agent:latest'
+pr_agent_pool = ContainerPool(
+    PR_AGENT_IMAGE,
+    ENV_FILE,
+    size=get_config_int(_pool_config, 'PR_AGENT_POOL_SIZE', mr_review_pool.max_workers),
+    max_jobs=get_config_int(_pool_config, 'PR_AGENT_CONTAINER_MAX_JOBS', 20),
+    acquire_timeout=get_config_int(_pool_config, 'PR_AGENT_ACQUIRE_TIMEOUT', 30)
+)
+atexit.register(pr_agent_pool.shutdown)
+
+# 并发访问 GitLab 的共享线程池（如批量检查 MR 是否已审查），限制同时发出的请求数
+gitlab_executor = ThreadPoolExecutor(
+    max_workers=get_config_int(_pool_config, 'GITLAB_FANOUT_WORKERS', 16),
+    thread_name_prefix='gitlab'
+)
+
+# 大 Commit 分片审查时并行调用 AI 的线程池（独立于审查线程池，避免嵌套提交造成死锁）
+ai_chunk_executor = ThreadPoolExecutor(
+    max_workers=get_config_int(_pool_config, 'AI_REVIEW_PARALLEL', 4),
+    thread_name_prefix='ai-chunk'
+)
+
+webhook_spool = WebhookSpool(
+    WEBHOOK_SPOOL_FILE,
+    fsync=_pool_config.get('WEBHOOK_SPOOL_FSYNC', 'false').lower() == 'true'
+)
+
+# GitLab 列表接口的响应缓存条数（ETag 条件请求）
+gitlab_client.response_cache.maxsize = get_config_int(_pool_config, 'GITLAB_CACHE_SIZE', 256)
+
+# 审查任务表的日志模式；多台机器通过共享卷使用同一个 reviews.db 时设置为 DELETE
+review_jobs.journal_mode = _pool_config.get('SQLITE_JOURNAL_MODE', 'WAL')
+
+# 外部接口限流：令牌桶（每秒请求数、突发数）+ AIMD 并发控制（初始并发、最大并发）
+dashscope_client.limiters.defaults.update(
+    rate=get_config_int(_pool_config, 'DASHSCOPE_RATE_LIMIT', 2),
+    burst=get_config_int(_pool_config, 'DASHSCOPE_RATE_BURST', 5),
+    concurrency=get_config_int(_pool_config, 'DASHSCOPE_CONCURRENCY', 4),
+    max_concurrency=get_config_int(_pool_config, 'DASHSCOPE_MAX_CONCURRENCY', 16)
+)
+gitlab_client.limiters.defaults.update(
+    rate=get_config_int(_pool_config, 'GITLAB_RATE_LIMIT', 20),
+    burst=get_config_int(_pool_config, 'GITLAB_RATE_BURST', 40),
+    concurrency=get_config_int(_pool_config, 'GITLAB_CONCURRENCY', 16),
+    max_concurrency=get_config_int(_pool_config, 'GITLAB_MAX_CONCURRENCY', 32)
+)
+
+# 组的项目数量缓存：(GitLab 地址, Token, 组 ID) -> 项目数
+group_project_counts = TTLCache(ttl=get_config_int(_pool_config, 'GROUP_PROJECT_COUNT_TTL', 600), maxsize=4096)
+
+# MR 包含的 commit 缓存：(GitLab 地址, 项目路径, MR iid, MR head sha) -> commit SHA 集合
+# head sha 不变时 MR 的 commit 不会变化，过期时间只用于限制内存占用
+mr_commit_shas_cache = TTLCache(ttl=24 * 3600, maxsize=4096)
+
+# Prometheus 指标（GitLab、DashScope 的请求耗时在各自的客户端模块中记录）
+PR_AGENT_RUN_DURATION = registry.histogram(
+    'pr_agent_run_duration_seconds', 'PR-Agent 审查 MR 的耗时（秒）', ('mode', 'outcome')
+)
+WEBHOOKS_RECEIVED = registry.counter('webhook_received_total', '收到的 GitLab Webhook 数', ('event', 'outcome'))
+REVIEWS = registry.counter('reviews_total', '审查次数（按类型、触发方式和结果）', ('type', 'trigger', 'outcome'))
+PUSH_COMMITS = registry.counter('push_webhook_commits_total', 'Push Webhook 中 commit 的处理结果', ('outcome',))
+
+def collect_review_jobs():
+    return [({'status': status}, count) for status, count in review_jobs.stats().items()]
+
+def collect_pools(field):
+    return lambda: [({'pool': pool.name}, pool.stats()[field]) for pool in (mr_review_pool, commit_review_pool)]
+
+def collect_cache_lookups():
+    samples = []
+    for endpoint, counters in gitlab_client.response_cache.stats()['endpoints'].items():
+        for outcome, count in counters.items():
+            samples.append(({'cache': f'gitlab_{endpoint}', 'outcome': outcome}, count))
+    for name, cache in (('group_project_counts', group_project_counts), ('mr_commits', mr_commit_shas_cache),
+                        ('ai_review', review_cache)):
+        stats = cache.stats()
+        samples.append(({'cache': name, 'outcome': 'hit'}, stats['hits']))
+        samples.append(({'cache': name, 'outcome': 'miss'}, stats['misses']))
+    return samples
+
+def collect_rate_limits(field):
+    def collect():
+        samples = []
+        for provider, limiters in (('dashscope', dashscope_client.limiters), ('gitlab', gitlab_client.limiters)):
+            for stats in limiters.stats():
+                value = stats['concurrency']['limit'] if field == 'limit' else stats[field]
+                samples.append(({'provider': provider, 'limiter': stats['name']}, value))
+        return samples
+    return collect
+
+# 任务表和 spool 是所有进程共享的，各进程采集到的是同一个值，合并时取最大值
+registry.collector('review_jobs', '审查任务表中各状态的任务数', 'gauge', ('status',), collect_review_jobs, merge='max')
+registry.collector('webhook_spool_backlog_bytes', 'Webhook spool 中未导入任务表的字节数', 'gauge', (),
+                   lambda: [({}, webhook_spool.backlog_bytes())], merge='max')
+registry.collector('review_pool_queued', '审查线程池中排队的任务数', 'gauge', ('pool',), collect_pools('queued'))
+registry.collector('review_pool_active', '审查线程池中正在执行的任务数', 'gauge', ('pool',), collect_pools('active'))
+registry.collector('review_pool_workers', '审查线程池的工作线程上限', 'gauge', ('pool',), collect_pools('max_workers'))
+registry.collector('cache_lookups_total', '缓存查询次数（GitLab 响应缓存、项目数缓存、MR commit 缓存、AI 审查缓存）',
+                   'counter', ('cache', 'outcome'), collect_cache_lookups)
+registry.collector('rate_limit_throttled_total', '外部接口返回限流响应（429/503）的次数', 'counter',
+                   ('provider', 'limiter'), collect_rate_limits('throttled'))
+registry.collector('rate_limit_concurrency', '外部接口当前的并发上限（AIMD）', 'gauge',
+                   ('provider', 'limiter'), collect_rate_limits('limit'))
+
+def enable_shared_metrics():
+    """多进程部署（gunicorn、独立 worker）时各进程定期把指标写入 METRICS_DIR，/metrics 合并所有进程的数据"""
+    registry.enable_multiprocess(METRICS_DIR)
+
+def observe_pr_agent_run(mode, fn, *args, **kwargs):
+    """执行 PR-Agent 并记录耗时和结果"""
+    start = time.time()
+    outcome = 'error'
+    try:
+        result = fn(*args, **kwargs)
+        outcome = 'success' if result.returncode == 0 else 'failed'
+        return result
+    except subprocess.TimeoutExpired:
+        outcome = 'timeout'
+        raise
+    except CommandCancelled:
+        outcome = 'cancelled'
+        raise
+    except RuntimeError:
+        # 常驻容器不可用（启动失败或都在使用中），调用方会改用 docker run
+        outcome = 'unavailable'
+        raise
+    finally:
+        PR_AGENT_RUN_DURATION.observe(time.time() - start, mode=mode, outcome=outcome)
+
+def run_pr_agent(mr_url, gitlab_token=None, timeout=600, cancel_event=None):
+    """运行 PR-Agent 审查 MR，优先使用常驻容器，不可用时退回 docker run
+
+    cancel_event 被设置时结束审查容器并抛出 CommandCancelled。
+    """
+    args = ['--pr_url', mr_url, 'review']
+    
+    # 如果提供了用户的 Token，覆盖环境变量
+    extra_env = {'GITLAB__PERSONAL_ACCESS_TOKEN': gitlab_token} if gitlab_token else None
+    
+    if pr_agent_pool.enabled:
+        try:
+            return observe_pr_agent_run(
+                'warm', pr_agent_pool.run, args, extra_env, timeout=timeout, cancel_event=cancel_event
+            )
+        except RuntimeError as e:
+            print(f"⚠️ 常驻容器不可用，改用 docker run: {e}")
+    
+    # 指定容器名，取消时可以删除容器（结束 docker run 客户端不会停止容器）
+    container_name = f"pr-agent-run-{uuid.uuid4().hex[:12]}"
+    cmd = ['docker', 'run', '--rm', '--name', container_name, '--env-file', ENV_FILE]
+    if gitlab_token:
+        cmd.extend(['-e', f'GITLAB__PERSONAL_ACCESS_TOKEN={gitlab_token}'])
+    cmd.append(PR_AGENT_IMAGE)
+    cmd.extend(args)
+    try:
+        return observe_pr_agent_run('docker_run', run_command, cmd, timeout, cancel_event)
+    except CommandCancelled:
+        subprocess.run(['docker', 'rm', '-f', container_name], capture_output=True, timeout=60)
+        raise
 
 def get_gitlab_token():
     """获取 GitLab Token - 优先从请求头获取，否则从配置文件"""
@@ -102,24 +467,159 @@ def get_gitlab_url():
     config = load_env_config()
     return config.get('GITLAB__URL', 'http://gitlab.it.ikang.com')
 
-def get_project_mrs(project_url, state='opened', target_branch=''):
+def is_ai_stream_enabled(config):
+    """是否使用 DashScope 流式输出（AI_STREAM，默认开启）"""
+    return config.get('AI_STREAM', 'true').lower() == 'true'
+
+def make_partial_output_callback(review_id, interval=0.5):
+    """返回流式回调：把已生成的内容写入审查状态，限制更新频率避免刷屏"""
+    last_update = {'time': 0}
+    
+    def on_delta(content):
+        now = time.time()
+        if now - last_update['time'] >= interval:
+            last_update['time'] = now
+            review_status.update(review_id, partial_output=content)
+    
+    return on_delta
+
+# 修改审查 prompt 时递增，使已缓存的审查结果失效
+REVIEW_PROMPT_VERSION = 1
+
+REVIEW_REQUIREMENTS = """请提供：
+1. ✅ 代码质量评估
+2. ⚠️ 潜在问题和建议
+3. 💡 优化建议
+4. 📝 其他注意事项
+
+请使用中文回复，并使用 ✅ ⚠️ ❌ 💡 等图标标注不同类型的反馈。"""
+
+def build_review_prompt(diff_text, subject="以下 Git Commit 的代码变更", commit_list=""):
+    """构建单次审查的 prompt"""
+    return f"""请对{subject}进行审查：
+
+{commit_list}代码变更：
+{diff_text}
+
+{REVIEW_REQUIREMENTS}"""
+
+def build_chunk_prompt(chunk_text, index, total, subject, commit_list):
+    """构建分片审查的 prompt：只要求列出本部分的问题，最后统一合并"""
+    return f"""请对{subject}进行审查。变更较大，已拆分为 {total} 部分分别审查，这是第 {index} 部分。
+
+{commit_list}代码变更：
+{chunk_text}
+
+只需列出本部分中发现的问题和建议，注明文件名，使用中文简明回复。"""
+
+def build_merge_prompt(chunk_reviews, subject, commit_list, skipped_note):
+    """构建合并各分片审查意见的 prompt"""
+    parts = ""
+    for i, review in enumerate(chunk_reviews, 1):
+        parts += f"\n\n### 第 {i} 部分\n{review}"
+    return f"""以下是对{subject}分 {len(chunk_reviews)} 部分审查得到的意见，请合并为一份完整的审查报告：去掉重复内容，保留所有具体问题及对应的文件。
+
+{commit_list}{skipped_note}各部分审查意见：{parts}
+
+{REVIEW_REQUIREMENTS}"""
+
+def generate_diff_review(config, api_key, model, diffs, subject="以下 Git Commit 的代码变更", commit_list="",
+                         on_delta=None, cancel_event=None, on_progress=None):
+    """按 Token 预算审查文件变更
+
+    变更在预算内时只调用一次 AI；超出时按文件和 hunk 拆分为多个部分并行审查，
+    再调用一次 AI 合并为一份审查结果（流式输出作用于合并调用）。
+    任一部分失败时中止其余部分的生成，不再为已失败的审查消耗额度。
+
+    Returns:
+        {'content': 审查内容, 'ttft': 首字延迟（秒）, 'elapsed': 总耗时（秒）, 'chunks': 分片数}
+    """
+    packed = diff_packer.pack_diffs(
+        diffs,
+        budget_tokens=get_config_int(config, 'AI_REVIEW_CHUNK_TOKENS', 6000),
+        max_chunks=get_config_int(config, 'AI_REVIEW_MAX_CHUNKS', 8)
+    )
+    chunks = packed['chunks'] or ["\n\n（没有可审查的文本变更）"]
+    skipped_note = ""
+    if packed['skipped']:
+        skipped_note = "未送审的文件（生成文件或二进制文件）：\n" + "".join(f"- {item}\n" for item in packed['skipped']) + "\n"
+    stream = is_ai_stream_enabled(config)
+    start = time.time()
+
+    if len(chunks) == 1:
+        result = dashscope_client.generate(
+            api_key, model,
+            build_review_prompt(chunks[0], subject, commit_list + skipped_note),
+            stream=stream, on_delta=on_delta, cancel_event=cancel_event
+        )
+        result['chunks'] = 1
+    else:
+        print(f"📦 变更较大，拆分为 {len(chunks)} 部分并行审查")
+        if on_progress:
+            on_progress(f'AI 正在分 {len(chunks)} 部分并行审查...')
+        chunk_cancel = ChildCancelFlag(cancel_event)
+        futures = [
+            ai_chunk_executor.submit(
+                dashscope_client.generate, api_key, model,
+                build_chunk_prompt(chunk, i, len(chunks), subject, commit_list),
+                stream=stream, cancel_event=chunk_cancel
+            )
+            for i, chunk in enumerate(chunks, 1)
+        ]
+        wait(futures, return_when=FIRST_EXCEPTION)
+        failed = next((future for future in futures if future.done() and future.exception()), None)
+        if failed is not None:
+            # 未开始的部分直接取消，正在生成的部分通过 chunk_cancel 中止
+            chunk_cancel.set()
+            for future in futures:
+                future.cancel()
+            raise failed.exception()
+        chunk_reviews = [future.result()['content'] for future in futures]
+
+        if on_progress:
+            on_progress('AI 正在合并各部分审查结果...')
+        merge_start = time.time()
+        result = dashscope_client.generate(
+            api_key, model,
+            build_merge_prompt(chunk_reviews, subject, commit_list, skipped_note),
+            stream=stream, on_delta=on_delta, cancel_event=cancel_event
+        )
+        result = {
+            'content': result['content'],
+            'ttft': merge_start - start + result['ttft'],
+            'elapsed': time.time() - start,
+            'chunks': len(chunks)
+        }
+
+    if packed['omitted']:
+        result['content'] += (
+            f"\n\n> ⚠️ 变更超出审查上限（{len(chunks)} 部分），以下文件未完整审查：" +
+            "、".join(packed['omitted'])
+        )
+    return result
+
+def get_gitlab(token=None):
+    """获取 GitLab 客户端，默认使用当前请求的 Token"""
+    if token is None:
+        token = get_gitlab_token()
+    return gitlab_client.get_client(get_gitlab_url(), token)
+
+def get_project_mrs(project_url, state='opened', target_branch='', gitlab=None):
     """获取项目的 MR 列表
     
     Args:
         project_url: 项目 URL
         state: MR 状态 - opened, merged, closed, all
         target_branch: 目标分支过滤（可选）
+        gitlab: GitLab 客户端，在请求线程之外调用时必须传入
     """
     try:
         # 从 URL 提取项目路径
         # 例如: http://gitlab.it.ikang.com/ios/IKStaff -> ios/IKStaff
-        gitlab_url = get_gitlab_url()
-        project_path = project_url.replace(gitlab_url + '/', '').strip('/')
+        project_path = project_path_from_url(get_gitlab_url(), project_url)
         
         # 调用 GitLab API
-        api_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/merge_requests"
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
-        params = {'per_page': 100, 'order_by': 'updated_at', 'sort': 'desc'}
+        params = {'order_by': 'updated_at', 'sort': 'desc'}
         
         # 设置状态参数
         if state != 'all':
@@ -129,14 +629,23 @@ def get_project_mrs(project_url, state='opened', target_branch=''):
         if target_branch:
             params['target_branch'] = target_branch
         
-        response = requests.get(api_url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        mrs = response.json()
+        gitlab = gitlab or get_gitlab()
+        max_items = get_config_int(load_env_config(), 'MR_LIST_MAX_ITEMS', 500)
+        mrs = list(paginate(
+            gitlab, f"/projects/{encode_project(project_path)}/merge_requests", params,
+            executor=gitlab_executor, max_items=max_items
+        ))
+        if len(mrs) >= max_items:
+            print(f"⚠️ MR 数量超过 {max_items}，只显示最近更新的 {max_items} 个")
+        
+        # 检查每个 MR 是否已审查：先查本地审查记录，剩下的并发查询 GitLab 评论
+        reviewed_urls = get_reviewed_mr_urls([mr['web_url'] for mr in mrs])
+        pending = [mr for mr in mrs if mr['web_url'] not in reviewed_urls]
+        results = gitlab_executor.map(lambda mr: check_if_reviewed(mr['web_url'], gitlab), pending)
+        pending_reviewed = dict(zip((mr['web_url'] for mr in pending), results))
         
-        # 检查每个 MR 是否已审查
         for mr in mrs:
-            mr['reviewed'] = check_if_reviewed(mr['web_url'])
+            mr['reviewed'] = mr['web_url'] in reviewed_urls or pending_reviewed.get(mr['web_url'], False)
             mr['project_url'] = project_url
         
         return mrs
@@ -144,8 +653,41 @@ def get_project_mrs(project_url, state='opened', target_branch=''):
         print(f"获取 MR 列表失败: {e}")
         return []
 
-def check_if_reviewed(mr_url):
-    """检查 MR 是否已被 AI 审查"""
+def get_reviewed_mr_urls(mr_urls):
+    """从本地记录中查询已审查的 MR（Webhook 审查记录 + 手动审查历史）"""
+    reviewed = set()
+    if not mr_urls:
+        return reviewed
+    
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        placeholders = ','.join('?' * len(mr_urls))
+        rows = conn.execute(
+            f'SELECT DISTINCT url FROM review_records WHERE type = ? AND status = ? AND url IN ({placeholders})',
+            ['mr', RECORD_DONE] + list(mr_urls)
+        ).fetchall()
+        conn.close()
+        reviewed.update(row[0] for row in rows)
+    except Exception as e:
+        print(f"查询本地审查记录失败: {e}")
+    
+    try:
+        if os.path.exists(HISTORY_FILE):
+            url_set = set(mr_urls)
+            with open(HISTORY_FILE, 'r') as f:
+                for item in json.load(f):
+                    if item.get('status') == 'success' and item.get('mr_url') in url_set:
+                        reviewed.add(item['mr_url'])
+    except Exception as e:
+        print(f"读取审查历史失败: {e}")
+    
+    return reviewed
+
+def check_if_reviewed(mr_url, gitlab=None):
+    """检查 MR 是否已被 AI 审查
+
+    在线程池中调用时需要传入 gitlab 客户端（线程中无法读取请求头的 Token）
+    """
     try:
         # 从 URL 提取项目和 MR ID
         # 例如: http://gitlab.it.ikang.com/ios/ikangapp/-/merge_requests/8
@@ -164,11 +706,8 @@ def check_if_reviewed(mr_url):
         
         mr_iid = parts[-1]
         
-        gitlab_url = get_gitlab_url()
-        api_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/merge_requests/{mr_iid}/notes"
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
-        
-        response = requests.get(api_url, headers=headers)
+        gitlab = gitlab or get_gitlab()
+        response = gitlab.get(f"/projects/{encode_project(project_path)}/merge_requests/{mr_iid}/notes")
         response.raise_for_status()
         
         notes = response.json()
@@ -187,62 +726,68 @@ def check_if_reviewed(mr_url):
 def review_mr(mr_url, mr_id, gitlab_token=None):
     """审查单个 MR"""
     try:
-        review_status[mr_id] = {
+        review_status.set(mr_id, {
             'status': 'running',
             'progress': 0,
             'message': '正在启动审查...',
             'start_time': get_china_time().isoformat()
-        }
+        })
         
         # 更新进度
-        review_status[mr_id]['progress'] = 20
-        review_status[mr_id]['message'] = '正在连接 GitLab...'
-        
-        # 运行 Docker 命令
-        cmd = [
-            'docker', 'run', '--rm',
-            '--env-file', ENV_FILE,
-        ]
-        
-        # 如果提供了用户的 Token，覆盖环境变量
-        if gitlab_token:
-            cmd.extend(['-e', f'GITLAB__PERSONAL_ACCESS_TOKEN={gitlab_token}'])
-        
-        cmd.extend([
-            'codiumai/pr-agent:latest',
-            '--pr_url', mr_url,
-            'review'
-        ])
+        review_status.update(
+            mr_id,
+            progress=20,
+            message='正在连接 GitLab...'
+        )
         
-        review_status[mr_id]['progress'] = 40
-        review_status[mr_id]['message'] = '正在调用 AI 模型审查代码...'
+        review_status.update(
+            mr_id,
+            progress=40,
+            message='正在调用 AI 模型审查代码...'
+        )
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        result = run_pr_agent(mr_url, gitlab_token)
         
         if result.returncode == 0:
-            review_status[mr_id]['status'] = 'success'
-            review_status[mr_id]['progress'] = 100
-            review_status[mr_id]['message'] = '审查完成！'
-            review_status[mr_id]['output'] = result.stdout
+            review_status.update(
+                mr_id,
+                status='success',
+                progress=100,
+                message='审查完成！',
+                output=result.stdout
+            )
             
             # 保存到历史记录
             save_history(mr_url, 'success', result.stdout)
+            REVIEWS.inc(type='mr', trigger='manual', outcome='success')
         else:
-            review_status[mr_id]['status'] = 'failed'
-            review_status[mr_id]['progress'] = 100
-            review_status[mr_id]['message'] = f'审查失败: {result.stderr}'
-            review_status[mr_id]['error'] = result.stderr
+            review_status.update(
+                mr_id,
+                status='failed',
+                progress=100,
+                message=f'审查失败: {result.stderr}',
+                error=result.stderr
+            )
             
             save_history(mr_url, 'failed', result.stderr)
+            REVIEWS.inc(type='mr', trigger='manual', outcome='failed')
         
-        review_status[mr_id]['end_time'] = get_china_time().isoformat()
+        review_status.update(mr_id, end_time=get_china_time().isoformat())
         
     except subprocess.TimeoutExpired:
-        review_status[mr_id]['status'] = 'failed'
-        review_status[mr_id]['message'] = '审查超时（10分钟）'
+        REVIEWS.inc(type='mr', trigger='manual', outcome='timeout')
+        review_status.update(
+            mr_id,
+            status='failed',
+            message='审查超时（10分钟）'
+        )
     except Exception as e:
-        review_status[mr_id]['status'] = 'failed'
-        review_status[mr_id]['message'] = f'审查失败: {str(e)}'
+        REVIEWS.inc(type='mr', trigger='manual', outcome='error')
+        review_status.update(
+            mr_id,
+            status='failed',
+            message=f'审查失败: {str(e)}'
+        )
 
 def save_history(mr_url, status, output):
     """保存审查历史"""
@@ -276,11 +821,7 @@ def index():
 def get_user_projects():
     """获取用户的活跃项目列表"""
     try:
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
-        
         # 获取用户的项目，按最近活跃排序
-        api_url = f"{gitlab_url}/api/v4/projects"
         params = {
             'membership': 'true',  # 只获取用户是成员的项目
             'order_by': 'last_activity_at',  # 按最后活跃时间排序
@@ -289,7 +830,7 @@ def get_user_projects():
             'archived': 'false'  # 排除已归档的项目
         }
         
-        response = requests.get(api_url, headers=headers, params=params)
+        response = get_gitlab().get('/projects', params=params)
         response.raise_for_status()
         
         projects = response.json()
@@ -315,21 +856,13 @@ def get_user_projects():
 def get_user_groups():
     """获取用户的 GitLab 组列表"""
     try:
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
-        
         # 获取用户的组
-        api_url = f"{gitlab_url}/api/v4/groups"
         params = {
-            'per_page': 100,  # 每页100个
             'order_by': 'name',  # 按名称排序
             'sort': 'asc'  # 升序
         }
         
-        response = requests.get(api_url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        groups = response.json()
+        groups = paginate(get_gitlab(), '/groups', params, executor=gitlab_executor)
         
         # 简化组信息
         simplified_groups = []
@@ -351,22 +884,14 @@ def get_user_groups():
 def get_group_projects(group_id):
     """获取指定组下的项目列表"""
     try:
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
-        
         # 获取组下的项目
-        api_url = f"{gitlab_url}/api/v4/groups/{group_id}/projects"
         params = {
-            'per_page': 100,  # 每页100个
             'order_by': 'name',  # 按名称排序
             'sort': 'asc',  # 升序
             'archived': 'false'  # 排除已归档的项目
         }
         
-        response = requests.get(api_url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        projects = response.json()
+        projects = paginate(get_gitlab(), f"/groups/{group_id}/projects", params, executor=gitlab_executor)
         
         # 简化项目信息
         simplified_projects = []
@@ -395,18 +920,13 @@ def get_branches():
     
     try:
         # 从 URL 提取项目路径
-        gitlab_url = get_gitlab_url()
-        project_path = project_url.replace(gitlab_url + '/', '').strip('/')
+        project_path = project_path_from_url(get_gitlab_url(), project_url)
         
-        # 调用 GitLab API 获取分支
-        api_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/repository/branches"
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
-        params = {'per_page': 100}  # 获取最多100个分支
-        
-        response = requests.get(api_url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        branches_data = response.json()
+        # 调用 GitLab API 获取全部分支
+        branches_data = paginate(
+            get_gitlab(), f"/projects/{encode_project(project_path)}/repository/branches",
+            executor=gitlab_executor
+        )
         
         # 返回详细的分支信息
         branches = []
@@ -429,39 +949,58 @@ def get_branches():
         print(f"获取分支列表失败: {e}")
         return jsonify({'error': str(e)}), 500
 
-def get_branch_commits_without_mr(project_url, branch_name, limit=20):
-    """获取分支上没有 MR 的 commits"""
+def get_mr_commit_shas(gitlab, project_api, mr):
+    """获取 MR 包含的 commit SHA 集合，按 MR 的 head sha 缓存
+
+    Returns:
+        SHA 集合；获取失败时返回 None
+    """
+    cache_key = (gitlab.base_url, project_api, mr['iid'], mr.get('sha'))
+    if mr.get('sha'):
+        shas = mr_commit_shas_cache.get(cache_key)
+        if shas is not None:
+            return shas
+    
+    # 在 gitlab_executor 中执行，逐页获取
     try:
-        gitlab_url = get_gitlab_url()
-        project_path = project_url.replace(gitlab_url + '/', '').strip('/')
+        shas = frozenset(commit['id'] for commit in paginate(gitlab, f"{project_api}/merge_requests/{mr['iid']}/commits"))
+    except Exception as e:
+        print(f"获取 MR !{mr['iid']} 的 commits 失败: {e}")
+        return None
+    if mr.get('sha'):
+        mr_commit_shas_cache.set(cache_key, shas)
+    return shas
+
+def get_branch_commits_without_mr(project_url, branch_name, limit=20, gitlab=None):
+    """获取分支上没有 MR 的 commits
+
+    分支 commits 与分支 MR 列表并发获取；各 MR 的 commit 按 head sha 缓存，
+    只有新增或有新提交的 MR 需要重新请求。
+    """
+    try:
+        project_path = project_path_from_url(get_gitlab_url(), project_url)
+        project_api = f"/projects/{encode_project(project_path)}"
+        gitlab = gitlab or get_gitlab()
         
-        # 获取分支的 commits
-        api_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/repository/commits"
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
+        # 获取分支的 commits（与下面的 MR 列表请求并发）
         params = {'ref_name': branch_name, 'per_page': limit}
-        
-        response = requests.get(api_url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        commits = response.json()
+        commits_future = gitlab_executor.submit(gitlab.get, f"{project_api}/repository/commits", params=params)
         
         # 获取该分支的所有 MR
-        mr_api_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/merge_requests"
-        mr_params = {'source_branch': branch_name, 'per_page': 100}
-        mr_response = requests.get(mr_api_url, headers=headers, params=mr_params)
-        mr_response.raise_for_status()
-        mrs = mr_response.json()
+        mrs = list(paginate(
+            gitlab, f"{project_api}/merge_requests", {'source_branch': branch_name},
+            executor=gitlab_executor
+        ))
         
-        # 获取所有 MR 中包含的 commit SHA
+        # 获取所有 MR 中包含的 commit SHA（未命中缓存的并发请求）
         mr_commit_shas = set()
-        for mr in mrs:
-            # 获取 MR 的 commits
-            mr_commits_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/merge_requests/{mr['iid']}/commits"
-            mr_commits_response = requests.get(mr_commits_url, headers=headers)
-            if mr_commits_response.status_code == 200:
-                mr_commits = mr_commits_response.json()
-                for commit in mr_commits:
-                    mr_commit_shas.add(commit['id'])
+        for shas in gitlab_executor.map(lambda mr: get_mr_commit_shas(gitlab, project_api, mr), mrs):
+            if shas:
+                mr_commit_shas.update(shas)
+        
+        response = commits_future.result()
+        response.raise_for_status()
+        commits = response.json()
         
         # 过滤出没有 MR 的 commits
         commits_without_mr = []
@@ -496,18 +1035,23 @@ def get_mrs():
     if not project_url:
         return jsonify({'error': '请输入项目 URL'}), 400
     
-    mrs = get_project_mrs(project_url, state, target_branch)
-    
     # 如果选择了包含 commits，且选择了特定分支，且状态为 all
-    # 则也包含该分支上没有 MR 的 commits
+    # 则也包含该分支上没有 MR 的 commits，与 MR 列表同时获取
     if include_commits and target_branch and state == 'all':
-        commits_without_mr = get_branch_commits_without_mr(project_url, target_branch, limit=20)
+        gitlab = get_gitlab()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='branch-commits') as executor:
+            commits_future = executor.submit(
+                get_branch_commits_without_mr, project_url, target_branch, 20, gitlab
+            )
+            mrs = get_project_mrs(project_url, state, target_branch, gitlab)
+            commits_without_mr = commits_future.result()
         # 合并 MR 和 commits
         all_items = mrs + commits_without_mr
         # 按时间排序
         all_items.sort(key=lambda x: x.get('created_at', ''), reverse=True)
         return jsonify({'mrs': all_items, 'has_commits': len(commits_without_mr) > 0})
     
+    mrs = get_project_mrs(project_url, state, target_branch)
     return jsonify({'mrs': mrs, 'has_commits': False})
 
 @app.route('/api/review', methods=['POST'])
@@ -523,10 +1067,18 @@ def start_review():
     # 获取用户的 GitLab Token
     gitlab_token = request.headers.get('X-GitLab-Token')
     
-    # 在后台线程中执行审查
-    thread = threading.Thread(target=review_mr, args=(mr_url, mr_id, gitlab_token))
-    thread.daemon = True
-    thread.start()
+    review_status.set(mr_id, {
+        'status': 'queued',
+        'progress': 0,
+        'message': '排队等待审查...'
+    })
+    
+    # 提交到 MR 审查线程池，手动审查优先于 Webhook 任务
+    mr_review_pool.submit(
+        review_mr, mr_url, mr_id, gitlab_token,
+        priority=PRIORITY_INTERACTIVE,
+        project=mr_url.split('/-/merge_requests')[0]
+    )
     
     return jsonify({'message': '审查已启动', 'mr_id': mr_id})
 
@@ -536,6 +1088,84 @@ def get_review_status(mr_id):
     status = review_status.get(mr_id, {'status': 'not_found'})
     return jsonify(status)
 
+# SSE 心跳间隔（秒），防止代理断开空闲连接
+SSE_HEARTBEAT_SECONDS = 15
+
+def sse_event(data, event=None):
+    """格式化一条 SSE 消息"""
+    text = f"event: {event}\n" if event else ''
+    return text + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(generator):
+    return Response(generator, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭 Nginx 缓冲
+    })
+
+@app.route('/api/review/events')
+def stream_all_review_status():
+    """以 SSE 推送所有审查的状态变化
+
+    连接后先发送 snapshot 事件（所有未结束的审查），之后每次变化发送 update 事件。
+    页面上的所有审查进度共用这一个连接，由前端按 review_id 分发。
+    """
+    def generate():
+        last_seq, active = review_status.snapshot()
+        yield sse_event(active, event='snapshot')
+        while True:
+            seq, changes = review_status.wait_any(last_seq, SSE_HEARTBEAT_SECONDS)
+            if seq == last_seq:
+                yield ': heartbeat\n\n'
+                continue
+            last_seq = seq
+            yield sse_event(changes, event='update')
+    
+    return sse_response(generate())
+
+@app.route('/api/review/queue')
+def get_review_queue():
+    """获取审查线程池的排队和执行状态"""
+    pools = [mr_review_pool.stats(), commit_review_pool.stats()]
+    return jsonify({
+        'pools': pools,
+        'queued': sum(p['queued'] for p in pools),
+        'active': sum(p['active'] for p in pools),
+        'jobs': review_jobs.stats(),
+        'spool': webhook_spool.stats(),
+        'review_cache': review_cache.stats(),
+        'containers': pr_agent_pool.stats()
+    })
+
+@app.route('/api/rate-limits')
+def get_rate_limits():
+    """获取 DashScope 和 GitLab 限流器的当前速率、并发上限和限流次数"""
+    return jsonify({
+        'dashscope': dashscope_client.limiters.stats(),
+        'gitlab': gitlab_client.limiters.stats()
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 指标（多进程部署时合并所有进程的数据）"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/gitlab/cache', methods=['GET'])
+def get_gitlab_cache_stats():
+    """获取 GitLab 响应缓存的命中统计"""
+    return jsonify({
+        'responses': gitlab_client.response_cache.stats(),
+        'group_project_counts': group_project_counts.stats(),
+        'mr_commits': mr_commit_shas_cache.stats()
+    })
+
+@app.route('/api/gitlab/cache', methods=['DELETE'])
+def clear_gitlab_cache():
+    """清空 GitLab 响应缓存"""
+    gitlab_client.response_cache.clear()
+    group_project_counts.clear()
+    mr_commit_shas_cache.clear()
+    return jsonify({'success': True})
+
 @app.route('/api/config')
 def get_config():
     """获取配置信息"""
@@ -583,12 +1213,6 @@ def update_config():
     try:
         data = request.json
         
-        # 读取现有配置
-        config_lines = []
-        if os.path.exists(ENV_FILE):
-            with open(ENV_FILE, 'r') as f:
-                config_lines = f.readlines()
-        
         # 更新配置项
         config_map = {
             'gitlab_url': 'GITLAB__URL',
@@ -605,30 +1229,36 @@ def update_config():
             if key in data and data[key]:
                 new_config[env_key] = data[key]
         
-        # 更新或添加配置行
-        updated_lines = []
-        updated_keys = set()
-        
-        for line in config_lines:
-            line = line.strip()
-            if line and not line.startswith('#') and '=' in line:
-                key = line.split('=', 1)[0]
-                if key in new_config:
-                    updated_lines.append(f"{key}={new_config[key]}\n")
-                    updated_keys.add(key)
+        with _env_write_lock:
+            # 读取现有配置
+            config_lines = []
+            if os.path.exists(ENV_FILE):
+                with open(ENV_FILE, 'r') as f:
+                    config_lines = f.readlines()
+            
+            # 更新或添加配置行
+            updated_lines = []
+            updated_keys = set()
+            
+            for line in config_lines:
+                line = line.strip()
+                if line and not line.startswith('#') and '=' in line:
+                    key = line.split('=', 1)[0]
+                    if key in new_config:
+                        updated_lines.append(f"{key}={new_config[key]}\n")
+                        updated_keys.add(key)
+                    else:
+                        updated_lines.append(line + '\n')
                 else:
                     updated_lines.append(line + '\n')
-            else:
-                updated_lines.append(line + '\n')
-        
-        # 添加新的配置项
-        for key, value in new_config.items():
-            if key not in updated_keys:
-                updated_lines.append(f"{key}={value}\n")
-        
-        # 写入文件
-        with open(ENV_FILE, 'w') as f:
-            f.writelines(updated_lines)
+            
+            # 添加新的配置项
+            for key, value in new_config.items():
+                if key not in updated_keys:
+                    updated_lines.append(f"{key}={value}\n")
+            
+            # 写入文件
+            write_env_file(updated_lines)
         
         return jsonify({'message': '配置已更新', 'success': True})
     except Exception as e:
@@ -643,8 +1273,7 @@ def test_config():
         gitlab_token = data.get('gitlab_token', '')
         
         # 测试 GitLab 连接
-        headers = {'PRIVATE-TOKEN': gitlab_token}
-        response = requests.get(f"{gitlab_url}/api/v4/user", headers=headers, timeout=10)
+        response = gitlab_client.get_client(gitlab_url, gitlab_token).get('/user', timeout=10)
         
         if response.status_code == 200:
             user_data = response.json()
@@ -680,8 +1309,7 @@ def get_user_info():
         gitlab_url = config.get('GITLAB__URL', 'https://gitlab.com')
         
         # 调用 GitLab API 获取用户信息
-        headers = {'PRIVATE-TOKEN': gitlab_token}
-        response = requests.get(f"{gitlab_url}/api/v4/user", headers=headers, timeout=10)
+        response = gitlab_client.get_client(gitlab_url, gitlab_token).get('/user', timeout=10)
         
         if response.status_code == 200:
             user_data = response.json()
@@ -798,10 +1426,7 @@ def get_mr_commits():
         mr_iid = parts[mr_index + 1]
         
         # 调用 GitLab API 获取 Commits
-        api_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/merge_requests/{mr_iid}/commits"
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
-        
-        response = requests.get(api_url, headers=headers)
+        response = get_gitlab().get(f"/projects/{encode_project(project_path)}/merge_requests/{mr_iid}/commits")
         response.raise_for_status()
         
         commits = response.json()
@@ -835,25 +1460,35 @@ def review_commit():
         if not commit_url or not commit_id:
             return jsonify({'error': '请提供 Commit URL 和 ID'}), 400
         
-        # 获取用户的 GitLab Token
-        user_gitlab_token = request.headers.get('X-GitLab-Token')
+        # 获取 GitLab Token（优先使用用户的 Token），需在请求上下文中读取
+        gitlab_token = get_gitlab_token()
         
         # 生成唯一的审查 ID
         review_id = f"commit-{commit_id[:8]}-{int(get_china_time().timestamp())}"
         
         # 初始化状态
-        review_status[review_id] = {
-            'status': 'running',
+        review_status.set(review_id, {
+            'status': 'queued',
             'progress': 0,
-            'message': '准备审查 Commit...',
+            'message': '排队等待审查...',
             'commit_id': commit_id
-        }
+        })
+        # 取消请求可能由其他进程接收，CancelFlag 会同时检查共享状态中的 cancel_requested
+        cancel_event = CancelFlag(review_status, review_id)
+        review_cancel_events[review_id] = cancel_event
         
         # 在后台线程中执行审查
         def run_review():
             try:
-                review_status[review_id]['progress'] = 10
-                review_status[review_id]['message'] = '获取 Commit 信息...'
+                if cancel_event.is_set():
+                    raise GenerationCancelled('审查已取消')
+                
+                review_status.update(
+                    review_id,
+                    status='running',
+                    progress=10,
+                    message='获取 Commit 信息...'
+                )
                 
                 # 解析 Commit URL 获取项目和 SHA
                 # 例如: http://gitlab.it.ikang.com/ios/IKStaff/-/commit/abc123
@@ -867,28 +1502,25 @@ def review_commit():
                 project_path = '/'.join(parts[:commit_index-1])
                 commit_sha = parts[commit_index + 1]
                 
-                review_status[review_id]['progress'] = 20
-                review_status[review_id]['message'] = '获取 Commit 变更...'
+                review_status.update(
+                    review_id,
+                    progress=20,
+                    message='获取 Commit 变更...'
+                )
                 
                 # 获取 Commit 的 diff
-                # 优先使用用户提供的 Token
-                token = user_gitlab_token if user_gitlab_token else get_gitlab_token()
-                headers = {'PRIVATE-TOKEN': token}
-                api_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/repository/commits/{commit_sha}/diff"
-                diff_response = requests.get(api_url, headers=headers, timeout=30)
+                gitlab = gitlab_client.get_client(gitlab_url, gitlab_token)
+                commit_api = f"/projects/{encode_project(project_path)}/repository/commits/{commit_sha}"
+                diff_response = gitlab.get(f"{commit_api}/diff")
                 diff_response.raise_for_status()
                 diffs = diff_response.json()
                 
                 # 构建审查内容
-                review_status[review_id]['progress'] = 30
-                review_status[review_id]['message'] = '使用 AI 分析代码...'
-                
-                # 准备 diff 文本
-                diff_text = ""
-                for diff in diffs[:10]:  # 限制最多10个文件，避免内容过多
-                    diff_text += f"\n\n文件: {diff['new_path']}\n"
-                    diff_text += f"变更: +{diff.get('added_lines', 0)} -{diff.get('removed_lines', 0)}\n"
-                    diff_text += diff.get('diff', '')[:2000]  # 每个文件最多2000字符
+                review_status.update(
+                    review_id,
+                    progress=30,
+                    message='使用 AI 分析代码...'
+                )
                 
                 # 调用 AI API 进行审查（使用通义千问）
                 config = load_env_config()
@@ -896,8 +1528,7 @@ def review_commit():
                 ai_model = config.get('CONFIG__MODEL', 'qwen-plus')
                 
                 # 如果 model 包含 openai/ 前缀，去掉它
-                if ai_model.startswith('openai/'):
-                    ai_model = ai_model.replace('openai/', '')
+                ai_model = dashscope_client.normalize_model(ai_model)
                 
                 # 验证 API Key
                 if not ai_api_key:
@@ -906,133 +1537,149 @@ def review_commit():
                 print(f"使用 AI 模型: {ai_model}")
                 print(f"API Key 前缀: {ai_api_key[:10]}...")
                 
-                review_status[review_id]['progress'] = 50
+                # 调用 AI API，流式模式下边生成边写入 partial_output；大 Commit 分片并行审查后合并
+                review_status.update(review_id, progress=60, message='AI 正在生成审查结果...')
+                ai_result = generate_diff_review(
+                    config,
+                    ai_api_key,
+                    ai_model,
+                    diffs,
+                    on_delta=make_partial_output_callback(review_id),
+                    cancel_event=cancel_event,
+                    on_progress=lambda message: review_status.update(review_id, message=message)
+                )
+                review_content = ai_result['content']
+                print(f"⏱️ AI 首字延迟 {ai_result['ttft']:.2f}s，总耗时 {ai_result['elapsed']:.2f}s")
                 
-                # 构建审查 prompt
-                prompt = f"""请对以下 Git Commit 的代码变更进行审查：
-
-代码变更：
-{diff_text}
-
-请提供：
-1. ✅ 代码质量评估
-2. ⚠️ 潜在问题和建议
-3. 💡 优化建议
-4. 📝 其他注意事项
-
-请使用中文回复，并使用 ✅ ⚠️ ❌ 💡 等图标标注不同类型的反馈。"""
-
-                # 调用 AI API（禁用代理）
-                import json as json_module
+                review_status.update(
+                    review_id,
+                    progress=80,
+                    message='发布审查结果到 GitLab...',
+                    partial_output=review_content,
+                    ttft_ms=int(ai_result['ttft'] * 1000)
+                )
                 
-                # 禁用代理，直接连接
-                proxies = {
-                    'http': None,
-                    'https': None
-                }
+                # 发布评论到 GitLab Commit
+                comment_data = {'note': f"🤖 AI 代码审查\n\n{review_content}"}
                 
-                ai_response = requests.post(
-                    'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation',
-                    headers={
-                        'Authorization': f'Bearer {ai_api_key}',
-                        'Content-Type': 'application/json'
-                    },
-                    json={
-                        'model': ai_model,
-                        'input': {'messages': [{'role': 'user', 'content': prompt}]},
-                        'parameters': {'result_format': 'message'}
-                    },
-                    proxies=proxies,
-                    timeout=120
-                )
+                comment_response = gitlab.post(f"{commit_api}/comments", json=comment_data)
                 
-                review_status[review_id]['progress'] = 80
-                review_status[review_id]['message'] = '发布审查结果到 GitLab...'
+                review_status.update(
+                    review_id,
+                    progress=100,
+                    status='success',
+                    message='Commit 审查完成',
+                    output=review_content
+                )
                 
-                if ai_response.status_code == 200:
-                    ai_result = ai_response.json()
-                    review_content = ai_result['output']['choices'][0]['message']['content']
-                    
-                    # 发布评论到 GitLab Commit
-                    comment_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/repository/commits/{commit_sha}/comments"
-                    comment_data = {'note': f"🤖 AI 代码审查\n\n{review_content}"}
-                    
-                    comment_response = requests.post(
-                        comment_url,
-                        headers=headers,
-                        json=comment_data,
-                        timeout=30
-                    )
-                    
-                    review_status[review_id]['progress'] = 100
-                    review_status[review_id]['status'] = 'success'
-                    review_status[review_id]['message'] = 'Commit 审查完成'
-                    review_status[review_id]['output'] = review_content
-                    
-                    # 保存历史记录
-                    save_history(commit_url, 'commit', 'success')
-                else:
-                    raise Exception(f'AI 审查失败: {ai_response.text}')
+                # 保存历史记录
+                save_history(commit_url, 'commit', 'success')
+                REVIEWS.inc(type='commit', trigger='manual', outcome='success')
                     
+            except GenerationCancelled:
+                REVIEWS.inc(type='commit', trigger='manual', outcome='cancelled')
+                review_status.update(
+                    review_id,
+                    status='failed',
+                    cancelled=True,
+                    message='审查已取消'
+                )
             except Exception as e:
-                review_status[review_id]['status'] = 'failed'
-                review_status[review_id]['message'] = f'审查失败: {str(e)}'
-                review_status[review_id]['output'] = str(e)
-        
-        thread = threading.Thread(target=run_review)
-        thread.start()
+                REVIEWS.inc(type='commit', trigger='manual', outcome='timeout' if is_timeout_error(e) else 'failed')
+                review_status.update(
+                    review_id,
+                    status='failed',
+                    message=f'审查失败: {str(e)}',
+                    output=str(e)
+                )
+            finally:
+                review_cancel_events.pop(review_id, None)
+        
+        # 提交到 Commit 审查线程池，手动审查优先于 Webhook 任务
+        commit_review_pool.submit(
+            run_review,
+            priority=PRIORITY_INTERACTIVE,
+            project=commit_url.split('/-/commit')[0]
+        )
         
         return jsonify({'review_id': review_id, 'message': '开始审查 Commit'})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/review/cancel/<review_id>', methods=['POST'])
+def cancel_review(review_id):
+    """取消排队中或正在生成的 Commit 审查"""
+    cancel_event = review_cancel_events.get(review_id)
+    if cancel_event is not None:
+        cancel_event.set()
+        return jsonify({'message': '正在取消审查', 'review_id': review_id})
+    
+    # 审查在其他进程中执行：写入共享状态，由执行审查的进程中止
+    status = review_status.get(review_id)
+    if status is None or status.get('status') in FINAL_STATUSES:
+        return jsonify({'error': '审查不存在或已结束'}), 404
+    
+    review_status.update(review_id, cancel_requested=True)
+    return jsonify({'message': '正在取消审查', 'review_id': review_id})
+
 @app.route('/api/commit/review/status/<review_id>')
 def get_commit_review_status(review_id):
     """获取 Commit 审查状态"""
     status = review_status.get(review_id, {'status': 'not_found'})
     return jsonify(status)
 
+def get_group_project_count(gitlab, group_id):
+    """获取组（含子组）中未归档项目的数量，结果缓存 GROUP_PROJECT_COUNT_TTL 秒
+
+    从 X-Total 响应头读取总数；获取失败时返回 None。缓存按 Token 作用域区分，不保存 Token 原文。
+    """
+    cache_key = (gitlab.scope, group_id)
+    count = group_project_counts.get(cache_key)
+    if count is not None:
+        return count
+    
+    try:
+        response = gitlab.get(f"/groups/{group_id}/projects", params={'per_page': 1, 'archived': False})
+        response.raise_for_status()
+        count = int(response.headers.get('X-Total', 0))
+    except Exception as e:
+        print(f"获取组 {group_id} 的项目数量失败: {e}")
+        return None
+    
+    group_project_counts.set(cache_key, count)
+    return count
+
 @app.route('/api/webhook/groups', methods=['GET'])
 def get_gitlab_groups():
-    """获取用户可访问的 GitLab 组"""
+    """获取用户可访问的 GitLab 组
+
+    组列表并发分页获取全部组；各组的项目数量并发获取并缓存。
+    """
     try:
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
+        gitlab = get_gitlab()
         
-        api_url = f"{gitlab_url}/api/v4/groups"
         params = {
-            'per_page': 100,
             'order_by': 'name',
             'sort': 'asc'
         }
         
-        response = requests.get(api_url, headers=headers, params=params)
-        response.raise_for_status()
+        groups = list(paginate(gitlab, '/groups', params, executor=gitlab_executor))
         
-        groups = response.json()
+        # 并发获取各组的准确项目数量（命中缓存的组不发请求）
+        counts = gitlab_executor.map(lambda group: get_group_project_count(gitlab, group['id']), groups)
         
-        # 简化组信息，并获取准确的项目数量
+        # 简化组信息
         simplified_groups = []
-        for group in groups:
-            # 获取组的准确项目数量
-            group_id = group['id']
-            projects_url = f"{gitlab_url}/api/v4/groups/{group_id}/projects"
-            projects_params = {'per_page': 1, 'archived': False}
-            
-            try:
-                projects_response = requests.get(projects_url, headers=headers, params=projects_params)
-                # 从响应头获取总数
-                total_count = int(projects_response.headers.get('X-Total', 0))
-            except:
-                total_count = 0
-            
+        for group, total_count in zip(groups, counts):
             simplified_groups.append({
                 'id': group['id'],
                 'name': group['name'],
                 'full_path': group['full_path'],
                 'description': group.get('description', ''),
-                'project_count': total_count
+                # 获取失败时数量为 0，并标记 project_count_error
+                'project_count': total_count or 0,
+                'project_count_error': total_count is None
             })
         
         return jsonify({'groups': simplified_groups})
@@ -1040,79 +1687,127 @@ def get_gitlab_groups():
         print(f"获取组列表失败: {e}")
         return jsonify({'error': str(e)}), 500
 
+# 检查单个项目 Webhook 的超时：(连接超时, 读取超时)
+WEBHOOK_CHECK_TIMEOUT = (3, 5)
+
+def find_project_webhook(hooks, webhook_url):
+    """在项目的 Webhook 列表中查找本平台的 Webhook，返回其 URL，未找到返回 None
+
+    优先精确匹配 webhook_url，其次匹配包含 /webhook/gitlab 的地址。
+    """
+    for hook in hooks:
+        if hook['url'] == webhook_url:
+            return hook['url']
+    for hook in hooks:
+        if '/webhook/gitlab' in hook['url']:
+            return hook['url']
+    return None
+
+def fetch_project_hooks(gitlab, project_id):
+    """获取项目的 Webhook 列表
+
+    Returns:
+        (hooks, error)：成功时 error 为 None；失败（超时、无权限）时 hooks 为 None
+    """
+    try:
+        response = gitlab.get(f"/projects/{project_id}/hooks", timeout=WEBHOOK_CHECK_TIMEOUT)
+    except Exception as e:
+        return None, '检查超时' if is_timeout_error(e) else f'检查失败: {e}'
+    
+    if response.status_code != 200:
+        return None, f'无法读取 Webhook（HTTP {response.status_code}）'
+    return response.json(), None
+
+def check_project_webhook(gitlab, project_id, webhook_url):
+    """检查项目是否已配置 Webhook
+
+    Returns:
+        {'id', 'has_webhook', 'webhook_url', 'webhook_error'}；
+        检查失败（超时、无权限）时 has_webhook 为 None，webhook_error 说明原因
+    """
+    result = {'id': project_id, 'has_webhook': None, 'webhook_url': None, 'webhook_error': None}
+    hooks, error = fetch_project_hooks(gitlab, project_id)
+    if error:
+        result['webhook_error'] = error
+        return result
+    
+    actual_webhook_url = find_project_webhook(hooks, webhook_url)
+    result['has_webhook'] = actual_webhook_url is not None
+    result['webhook_url'] = actual_webhook_url
+    return result
+
 @app.route('/api/webhook/group-projects/<group_id>', methods=['GET'])
 def get_webhook_group_projects(group_id):
-    """获取组内的所有项目，并检查 Webhook 配置状态"""
+    """获取组内的所有项目，并检查 Webhook 配置状态
+
+    各项目的 Webhook 由 gitlab_executor 并发检查。传入 stream=1 时以 SSE 返回：
+    先推送项目列表（projects），再逐个推送检查结果（webhook），最后推送汇总（done）。
+    """
     try:
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
+        gitlab = get_gitlab()
         webhook_url = request.args.get('webhook_url', '')
+        stream = request.args.get('stream') == '1'
         
-        api_url = f"{gitlab_url}/api/v4/groups/{group_id}/projects"
         params = {
-            'per_page': 100,
             'include_subgroups': True,
             'archived': False
         }
         
         all_projects = []
-        page = 1
+        for project in paginate(gitlab, f"/groups/{encode_project(group_id)}/projects", params, executor=gitlab_executor):
+            all_projects.append({
+                'id': project['id'],
+                'name': project['name'],
+                'path_with_namespace': project['path_with_namespace'],
+                'web_url': project['web_url'],
+                # 未指定 Webhook URL 时不检查；需要检查时 None 表示检查中
+                'has_webhook': None if webhook_url else False,
+                'webhook_url': None,
+                'webhook_error': None
+            })
         
-        while True:
-            params['page'] = page
-            response = requests.get(api_url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            projects = response.json()
-            if not projects:
-                break
-            
-            for project in projects:
-                project_id = project['id']
-                
-                # 检查该项目是否已配置 Webhook
-                has_webhook = False
-                actual_webhook_url = None
-                if webhook_url:
-                    try:
-                        hooks_url = f"{gitlab_url}/api/v4/projects/{project_id}/hooks"
-                        hooks_response = requests.get(hooks_url, headers=headers, timeout=2)
-                        if hooks_response.status_code == 200:
-                            existing_hooks = hooks_response.json()
-                            for hook in existing_hooks:
-                                if hook['url'] == webhook_url:
-                                    has_webhook = True
-                                    actual_webhook_url = hook['url']
-                                    break
-                            # 如果没有找到匹配的，但有其他 webhook，记录第一个
-                            if not has_webhook and existing_hooks:
-                                # 检查是否有包含 /webhook/gitlab 的 hook
-                                for hook in existing_hooks:
-                                    if '/webhook/gitlab' in hook['url']:
-                                        has_webhook = True
-                                        actual_webhook_url = hook['url']
-                                        break
-                    except:
-                        pass
-                
-                all_projects.append({
-                    'id': project['id'],
-                    'name': project['name'],
-                    'path_with_namespace': project['path_with_namespace'],
-                    'web_url': project['web_url'],
-                    'has_webhook': has_webhook,
-                    'webhook_url': actual_webhook_url
-                })
-            
-            page += 1
-            if page > 10:  # 最多获取 10 页，避免超时
-                break
+        if stream:
+            return sse_response(stream_project_webhook_checks(gitlab, all_projects, webhook_url))
+        
+        if webhook_url:
+            results = gitlab_executor.map(
+                lambda project: check_project_webhook(gitlab, project['id'], webhook_url),
+                all_projects
+            )
+            for project, result in zip(all_projects, results):
+                project.update(result)
         
         return jsonify({'projects': all_projects})
     except Exception as e:
         print(f"获取组项目失败: {e}")
         return jsonify({'error': str(e)}), 500
 
+def stream_project_webhook_checks(gitlab, projects, webhook_url):
+    """SSE 生成器：并发检查项目的 Webhook，按完成顺序推送结果"""
+    yield sse_event({'projects': projects}, event='projects')
+    
+    configured = 0
+    errors = 0
+    if webhook_url:
+        futures = [
+            gitlab_executor.submit(check_project_webhook, gitlab, project['id'], webhook_url)
+            for project in projects
+        ]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if result['webhook_error']:
+                    errors += 1
+                elif result['has_webhook']:
+                    configured += 1
+                yield sse_event(result, event='webhook')
+        finally:
+            # 客户端断开时取消尚未开始的检查
+            for future in futures:
+                future.cancel()
+    
+    yield sse_event({'total': len(projects), 'configured': configured, 'errors': errors}, event='done')
+
 @app.route('/api/webhook/batch-setup', methods=['POST'])
 def batch_setup_webhooks():
     """批量为项目配置 Webhook"""
@@ -1125,22 +1820,20 @@ def batch_setup_webhooks():
         if not project_ids or not webhook_url:
             return jsonify({'error': '缺少必要参数'}), 400
         
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
+        gitlab = get_gitlab()
         
         results = []
         
         for project_id in project_ids:
             try:
                 # 获取项目信息
-                project_url = f"{gitlab_url}/api/v4/projects/{project_id}"
-                project_response = requests.get(project_url, headers=headers)
+                project_response = gitlab.get(f"/projects/{encode_project(project_id)}")
                 project_info = project_response.json()
                 project_name = project_info.get('path_with_namespace', str(project_id))
                 
                 # 检查是否已存在相同的 Webhook
-                hooks_url = f"{gitlab_url}/api/v4/projects/{project_id}/hooks"
-                hooks_response = requests.get(hooks_url, headers=headers)
+                hooks_path = f"/projects/{encode_project(project_id)}/hooks"
+                hooks_response = gitlab.get(hooks_path)
                 
                 if hooks_response.status_code != 200:
                     results.append({
@@ -1180,9 +1873,9 @@ def batch_setup_webhooks():
                 
                 if existing_hook_id:
                     # 更新现有 Webhook
-                    update_url = f"{hooks_url}/{existing_hook_id}"
-                    print(f"[DEBUG] 更新 Webhook: {update_url}")
-                    update_response = requests.put(update_url, headers=headers, json=webhook_data)
+                    update_path = f"{hooks_path}/{existing_hook_id}"
+                    print(f"[DEBUG] 更新 Webhook: {update_path}")
+                    update_response = gitlab.put(update_path, json=webhook_data)
                     print(f"[DEBUG] 更新响应状态: {update_response.status_code}")
                     if update_response.status_code == 200:
                         response_json = update_response.json()
@@ -1207,8 +1900,8 @@ def batch_setup_webhooks():
                         })
                 else:
                     # 添加新 Webhook
-                    print(f"[DEBUG] 添加新 Webhook: {hooks_url}")
-                    add_response = requests.post(hooks_url, headers=headers, json=webhook_data)
+                    print(f"[DEBUG] 添加新 Webhook: {hooks_path}")
+                    add_response = gitlab.post(hooks_path, json=webhook_data)
                     print(f"[DEBUG] 添加响应状态: {add_response.status_code}")
                     if add_response.status_code == 201:
                         response_json = add_response.json()
@@ -1240,6 +1933,9 @@ def batch_setup_webhooks():
                     'message': str(e)
                 })
         
+        # 更新 Webhook 索引，已配置项目页面立即反映本次修改
+        refresh_inventory_projects(gitlab, project_ids)
+        
         # 统计结果
         success_count = sum(1 for r in results if r['status'] == 'success')
         updated_count = sum(1 for r in results if r['status'] == 'updated')
@@ -1272,16 +1968,15 @@ def batch_delete_webhooks():
         if not project_ids or not webhook_url:
             return jsonify({'error': '缺少必要参数'}), 400
         
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
+        gitlab = get_gitlab()
         
         results = []
         
         for project_id in project_ids:
             try:
                 # 获取项目的 Webhooks
-                hooks_url = f"{gitlab_url}/api/v4/projects/{project_id}/hooks"
-                hooks_response = requests.get(hooks_url, headers=headers)
+                hooks_path = f"/projects/{encode_project(project_id)}/hooks"
+                hooks_response = gitlab.get(hooks_path)
                 
                 if hooks_response.status_code != 200:
                     results.append({
@@ -1309,8 +2004,7 @@ def batch_delete_webhooks():
                     continue
                 
                 # 删除 Webhook
-                delete_url = f"{hooks_url}/{hook_to_delete['id']}"
-                delete_response = requests.delete(delete_url, headers=headers)
+                delete_response = gitlab.delete(f"{hooks_path}/{hook_to_delete['id']}")
                 
                 if delete_response.status_code == 204:
                     print(f"✅ 删除 Webhook 成功: 项目 {project_id}")
@@ -1334,6 +2028,9 @@ def batch_delete_webhooks():
                     'message': str(e)
                 })
         
+        # 更新 Webhook 索引，已配置项目页面立即反映本次修改
+        refresh_inventory_projects(gitlab, project_ids)
+        
         # 统计结果
         success_count = sum(1 for r in results if r['status'] == 'success')
         skipped_count = sum(1 for r in results if r['status'] == 'skipped')
@@ -1364,12 +2061,8 @@ def check_webhook_config():
         if not project_id or not webhook_url:
             return jsonify({'error': '缺少必要参数'}), 400
         
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
-        
         # 获取项目的 Webhooks
-        hooks_url = f"{gitlab_url}/api/v4/projects/{project_id}/hooks"
-        hooks_response = requests.get(hooks_url, headers=headers)
+        hooks_response = get_gitlab().get(f"/projects/{encode_project(project_id)}/hooks")
         
         if hooks_response.status_code != 200:
             return jsonify({'error': '无权限访问项目'}), 403
@@ -1436,114 +2129,50 @@ def get_auto_review_config():
             'auto_review_min_changes': config.get('AUTO_REVIEW_MIN_CHANGES', '0'),
             'auto_review_push_enabled': config.get('AUTO_REVIEW_PUSH_ENABLED', 'false'),
             'auto_review_push_branches': config.get('AUTO_REVIEW_PUSH_BRANCHES', 'master,main'),
-            'auto_review_push_new_branch_all_commits': config.get('AUTO_REVIEW_PUSH_NEW_BRANCH_ALL_COMMITS', 'false')
+            'auto_review_push_new_branch_all_commits': config.get('AUTO_REVIEW_PUSH_NEW_BRANCH_ALL_COMMITS', 'false'),
+            'auto_review_push_range': config.get('AUTO_REVIEW_PUSH_RANGE', 'false')
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/webhook/configured-projects', methods=['GET'])
 def get_configured_projects():
-    """获取所有已配置 Webhook 的项目"""
+    """获取所有已配置 Webhook 的项目
+
+    从本地 Webhook 索引查询，索引由后台线程增量刷新；传入 refresh=1 时立即触发一次刷新。
+    """
     try:
-        gitlab_url = get_gitlab_url()
-        headers = {'PRIVATE-TOKEN': get_gitlab_token()}
         webhook_url = request.args.get('webhook_url', '')
         match_mode = request.args.get('match_mode', 'exact')  # exact: 精确匹配, contains: 包含匹配, all: 所有webhook
         
-        # 获取用户所有可访问的项目
-        projects_url = f"{gitlab_url}/api/v4/projects"
-        params = {
-            'membership': 'true',
-            'per_page': 100,
-            'simple': 'true',
-            'order_by': 'last_activity_at'
-        }
-        
-        all_projects = []
-        page = 1
-        while True:
-            params['page'] = page
-            response = requests.get(projects_url, headers=headers, params=params)
-            response.raise_for_status()
-            projects = response.json()
-            
-            if not projects:
-                break
-            
-            all_projects.extend(projects)
-            page += 1
-            
-            # 限制最多获取 500 个项目
-            if len(all_projects) >= 500:
-                break
-        
-        # 检查每个项目的 Webhook 配置
-        configured_projects = []
-        for project in all_projects:
-            project_id = project['id']
-            
-            # 获取项目的 Webhooks
-            hooks_url = f"{gitlab_url}/api/v4/projects/{project_id}/hooks"
-            try:
-                hooks_response = requests.get(hooks_url, headers=headers, timeout=5)
-                if hooks_response.status_code == 200:
-                    hooks = hooks_response.json()
-                    
-                    # 查找匹配的 Webhook
-                    for hook in hooks:
-                        should_add = False
-                        hook_url = hook.get('url', '')
-                        
-                        if match_mode == 'all':
-                            # 显示所有配置了 webhook 的项目
-                            should_add = True
-                        elif match_mode == 'contains' and webhook_url:
-                            # 包含匹配：只要路径部分匹配即可（忽略主机名和端口）
-                            # 提取路径部分，例如从 http://localhost:8080/webhook/gitlab 提取 /webhook/gitlab
-                            try:
-                                # 分割 URL，获取路径部分
-                                if '://' in webhook_url:
-                                    webhook_path = '/' + webhook_url.split('://')[-1].split('/', 1)[1]
-                                else:
-                                    webhook_path = webhook_url
-                                
-                                if '://' in hook_url:
-                                    hook_path = '/' + hook_url.split('://')[-1].split('/', 1)[1]
-                                else:
-                                    hook_path = hook_url
-                                
-                                # 检查路径是否匹配
-                                should_add = webhook_path == hook_path
-                            except:
-                                # 如果解析失败，使用简单的包含匹配
-                                should_add = '/webhook/gitlab' in hook_url
-                        elif match_mode == 'exact' and webhook_url:
-                            # 精确匹配
-                            should_add = hook_url == webhook_url
-                        elif not webhook_url:
-                            # 如果没有指定 webhook_url，返回所有配置了 webhook 的项目
-                            should_add = True
-                        
-                        if should_add:
-                            configured_projects.append({
-                                'id': project['id'],
-                                'name': project['name'],
-                                'path_with_namespace': project['path_with_namespace'],
-                                'web_url': project['web_url'],
-                                'namespace': project.get('namespace', {}).get('full_path', ''),
-                                'hook_id': hook['id'],
-                                'hook_url': hook['url'],
-                                'push_events': hook.get('push_events', False),
-                                'merge_requests_events': hook.get('merge_requests_events', False)
-                            })
-                            break  # 每个项目只添加一次
-            except Exception as e:
-                print(f"检查项目 {project_id} 的 Webhook 失败: {e}")
-                continue
+        # 索引按当前用户的 Token 分别保存，只返回该 Token 可见的项目
+        token = get_gitlab_token()
+        scope = gitlab_client.token_scope(get_gitlab_url(), token)
+        remember_inventory_token(scope, token)
+        state = webhook_inventory.scope_state(scope)
+        
+        # 首次访问、索引过期或要求刷新时，在当前进程中刷新（多进程部署时不依赖后台线程所在的进程）
+        interval = get_config_int(load_env_config(), 'WEBHOOK_INVENTORY_REFRESH_SECONDS', 300)
+        stale = state['last_refresh'] is None or time.time() - state['last_refresh'] > interval
+        if token and (stale or request.args.get('refresh') == '1'):
+            threading.Thread(
+                target=refresh_inventory_scope, args=(token,), name='webhook-inventory-refresh', daemon=True
+            ).start()
+        
+        configured_projects = webhook_inventory.query(scope, match_mode, webhook_url)
+        inventory = webhook_inventory.stats(scope)
+        # 索引尚未建立完成时，前端会稍后重新加载
+        inventory['last_refresh'] = state['last_refresh']
+        inventory['ready'] = inventory['checked'] == inventory['projects'] and (
+            inventory['projects'] > 0 or state['last_refresh'] is not None
+        )
+        inventory['refreshing'] = state['refreshing']
+        inventory['last_error'] = state['last_error']
         
         return jsonify({
             'projects': configured_projects,
-            'total': len(configured_projects)
+            'total': len(configured_projects),
+            'inventory': inventory
         })
         
     except Exception as e:
@@ -1556,12 +2185,6 @@ def update_auto_review_config():
     try:
         data = request.json
         
-        # 读取现有配置
-        config_lines = []
-        if os.path.exists(ENV_FILE):
-            with open(ENV_FILE, 'r') as f:
-                config_lines = f.readlines()
-        
         # 要更新的配置项
         updates = {
             'AUTO_REVIEW_ENABLED': data.get('auto_review_enabled', 'false'),
@@ -1570,34 +2193,40 @@ def update_auto_review_config():
             'AUTO_REVIEW_MIN_CHANGES': data.get('auto_review_min_changes', '0'),
             'AUTO_REVIEW_PUSH_ENABLED': data.get('auto_review_push_enabled', 'false'),
             'AUTO_REVIEW_PUSH_BRANCHES': data.get('auto_review_push_branches', 'master,main'),
-            'AUTO_REVIEW_PUSH_NEW_BRANCH_ALL_COMMITS': data.get('auto_review_push_new_branch_all_commits', 'false')
+            'AUTO_REVIEW_PUSH_NEW_BRANCH_ALL_COMMITS': data.get('auto_review_push_new_branch_all_commits', 'false'),
+            'AUTO_REVIEW_PUSH_RANGE': data.get('auto_review_push_range', 'false')
         }
         
-        # 更新配置
-        new_lines = []
-        updated_keys = set()
-        
-        for line in config_lines:
-            stripped = line.strip()
-            if stripped and not stripped.startswith('#') and '=' in stripped:
-                key = stripped.split('=', 1)[0]
-                if key in updates:
-                    new_lines.append(f"{key}={updates[key]}\n")
-                    updated_keys.add(key)
+        with _env_write_lock:
+            # 读取现有配置
+            config_lines = []
+            if os.path.exists(ENV_FILE):
+                with open(ENV_FILE, 'r') as f:
+                    config_lines = f.readlines()
+            
+            # 更新配置
+            new_lines = []
+            updated_keys = set()
+            
+            for line in config_lines:
+                stripped = line.strip()
+                if stripped and not stripped.startswith('#') and '=' in stripped:
+                    key = stripped.split('=', 1)[0]
+                    if key in updates:
+                        new_lines.append(f"{key}={updates[key]}\n")
+                        updated_keys.add(key)
+                    else:
+                        new_lines.append(line)
                 else:
                     new_lines.append(line)
-            else:
-                new_lines.append(line)
-        
-        # 添加新的配置项
-        for key, value in updates.items():
-            if key not in updated_keys:
-                new_lines.append(f"{key}={value}\n")
-        
-        # 写入文件
-        os.makedirs(os.path.dirname(ENV_FILE), exist_ok=True)
-        with open(ENV_FILE, 'w') as f:
-            f.writelines(new_lines)
+            
+            # 添加新的配置项
+            for key, value in updates.items():
+                if key not in updated_keys:
+                    new_lines.append(f"{key}={value}\n")
+            
+            # 写入文件
+            write_env_file(new_lines)
         
         return jsonify({
             'success': True,
@@ -1619,7 +2248,10 @@ def get_review_report():
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
         
-        query = 'SELECT * FROM review_records WHERE 1=1'
+        query = '''
+            SELECT id, type, project_id, project_name, title, url, author, branch, timestamp, status
+            FROM review_records WHERE 1=1
+        '''
         params = []
         
         if date_from:
@@ -1652,7 +2284,8 @@ def get_review_report():
                     'url': r[5],
                     'author': r[6],
                     'branch': r[7],
-                    'timestamp': r[8]
+                    'timestamp': r[8],
+                    'status': r[9]
                 }
                 for r in records
             ]
@@ -1662,42 +2295,132 @@ def get_review_report():
         print(f"获取审查报表失败: {e}")
         return jsonify({'error': str(e), 'records': []}), 500
 
+# 需要处理的 Webhook 事件 -> 任务类型
+WEBHOOK_JOB_KINDS = {
+    'Merge Request Hook': 'mr_webhook',
+    'Push Hook': 'push_webhook'
+}
+
+def mr_has_new_commits(mr):
+    """MR update 事件是否包含新的 commit（标题、标签等修改时没有 oldrev）"""
+    oldrev = mr.get('oldrev')
+    return bool(oldrev) and oldrev != '0000000000000000000000000000000000000000'
+
+def mr_coalesce_key(data):
+    """需要审查的 MR 事件返回合并键（项目 + MR），同一 MR 短时间内的多次推送只审查最后一次"""
+    mr = data.get('object_attributes') or {}
+    action = mr.get('action')
+    if action not in ('open', 'update', 'reopen'):
+        return None
+    if action == 'update' and not mr_has_new_commits(mr):
+        return None
+    return f"mr:{(data.get('project') or {}).get('id')}:{mr.get('iid')}"
+
+def webhook_job_priority(kind, data):
+    """Webhook 任务的优先级：MR > Push > 新分支首次推送（历史补审）"""
+    if kind == 'mr_webhook':
+        return PRIORITY_MR_WEBHOOK
+    if data.get('before', '0000000000000000000000000000000000000000') == '0000000000000000000000000000000000000000':
+        return PRIORITY_BACKFILL
+    return PRIORITY_PUSH_WEBHOOK
+
 @app.route('/webhook/gitlab', methods=['POST'])
 def gitlab_webhook():
-    """接收 GitLab Webhook 事件"""
+    """接收 GitLab Webhook 事件
+
+    只验证 Token 并把原始请求体追加到 spool 文件后立即返回，
+    解析和入队由 spool 处理线程完成，避免 GitLab 投递超时后重试或停用 Webhook。
+    """
+    event_type = request.headers.get('X-Gitlab-Event', '')
+    # 指标只区分需要审查的事件，其他事件类型归为 other，避免标签数量不受控制
+    event_label = event_type if event_type in WEBHOOK_JOB_KINDS else 'other'
+    
+    # 验证 Secret Token（如果配置了）
+    expected_token = load_env_config().get('GITLAB_WEBHOOK_SECRET', '')
+    if expected_token:
+        received_token = request.headers.get('X-Gitlab-Token', '')
+        if not hmac.compare_digest(received_token.encode(), expected_token.encode()):
+            print(f"Webhook 验证失败: Token 不匹配")
+            WEBHOOKS_RECEIVED.inc(event=event_label, outcome='unauthorized')
+            return jsonify({'error': 'Unauthorized'}), 403
+    
+    if event_type not in WEBHOOK_JOB_KINDS:
+        WEBHOOKS_RECEIVED.inc(event=event_label, outcome='ignored')
+        return jsonify({'status': 'ignored'}), 200
+    
     try:
-        # 验证 Secret Token（如果配置了）
-        config = load_env_config()
-        expected_token = config.get('GITLAB_WEBHOOK_SECRET', '')
-        
-        if expected_token:
-            received_token = request.headers.get('X-Gitlab-Token', '')
-            if received_token != expected_token:
-                print(f"Webhook 验证失败: Token 不匹配")
-                return jsonify({'error': 'Unauthorized'}), 403
-        
-        # 获取事件类型和数据
-        event_type = request.headers.get('X-Gitlab-Event')
-        data = request.json
-        
-        print(f"收到 Webhook: {event_type}")
-        
-        # 处理 Merge Request 事件
-        if event_type == 'Merge Request Hook':
-            threading.Thread(target=handle_mr_webhook, args=(data,)).start()
-        
-        # 处理 Push 事件
-        elif event_type == 'Push Hook':
-            threading.Thread(target=handle_push_webhook, args=(data,)).start()
-        
-        return jsonify({'status': 'received'}), 200
-        
-    except Exception as e:
-        print(f"处理 Webhook 失败: {e}")
+        webhook_spool.append(event_type, request.get_data())
+    except OSError as e:
+        # 返回错误让 GitLab 稍后重试
+        print(f"❌ 写入 Webhook spool 失败: {e}")
+        WEBHOOKS_RECEIVED.inc(event=event_label, outcome='error')
         return jsonify({'error': str(e)}), 500
+    
+    WEBHOOKS_RECEIVED.inc(event=event_label, outcome='accepted')
+    return jsonify({'status': 'accepted'}), 202
+
+def webhook_spool_loop():
+    """把 spool 中新的 Webhook 记录批量写入任务队列
+
+    处理位置在写入任务队列之后才保存，进程崩溃时最多重复导入最后一批，
+    重复的审查由 review_records 的唯一索引去重。
+    """
+    while True:
+        webhook_spool.wakeup.wait(1)
+        webhook_spool.wakeup.clear()
+        while True:
+            try:
+                records, offset = webhook_spool.read_new()
+                if not records:
+                    break
+                
+                jobs = []
+                # 同一 MR 的审查任务延迟执行，期间的新推送会取代旧任务
+                mr_debounce = get_config_int(load_env_config(), 'MR_REVIEW_DEBOUNCE_SECONDS', 30)
+                for record in records:
+                    kind = WEBHOOK_JOB_KINDS.get(record['event']) if record else None
+                    try:
+                        payload = json.loads(record['body']) if kind else None
+                    except ValueError:
+                        payload = None
+                    if payload is None:
+                        print("⚠️ 跳过无法解析的 Webhook 记录")
+                        continue
+                    coalesce_key = mr_coalesce_key(payload) if kind == 'mr_webhook' else None
+                    project_id = (payload.get('project') or {}).get('id')
+                    jobs.append({
+                        'kind': kind,
+                        'payload': payload,
+                        'coalesce_key': coalesce_key,
+                        'delay': mr_debounce if coalesce_key else 0,
+                        'priority': webhook_job_priority(kind, payload),
+                        'project_key': str(project_id) if project_id is not None else None
+                    })
+                
+                review_jobs.enqueue_many(jobs)
+                webhook_spool.commit(offset)
+                if jobs:
+                    print(f"📥 收到 {len(jobs)} 个 Webhook，已加入审查队列")
+                    _job_wakeup.set()
+            except Exception as e:
+                print(f"❌ 处理 Webhook spool 失败: {e}")
+                time.sleep(5)
+                break
+
+def start_webhook_spool():
+    """启动 spool 处理线程，先导入上次未处理的记录"""
+    backlog = webhook_spool.backlog_bytes()
+    if backlog:
+        print(f"🔄 Webhook spool 中有 {backlog} 字节未处理的记录，将继续导入")
+    thread = threading.Thread(target=webhook_spool_loop, name='webhook-spool')
+    thread.daemon = True
+    thread.start()
 
-def handle_mr_webhook(data):
-    """处理 MR Webhook 事件"""
+def handle_mr_webhook(data, cancel_event=None):
+    """处理 MR Webhook 事件
+
+    cancel_event 被设置时（同一 MR 有了更新的推送）中止审查并抛出 CommandCancelled。
+    """
     try:
         mr = data['object_attributes']
         action = mr['action']
@@ -1726,43 +2449,55 @@ def handle_mr_webhook(data):
             print(f"⏭️  跳过已审查的 MR !{mr_iid}")
             return
         
-        # 对于 'update'，检查是否有新的 commit
-        should_record = True
+        # 对于 'update'，只有新的 commit 才审查（标题、标签等修改不审查）
         if action == 'update':
-            # 检查 oldrev，如果存在说明有新 commit
-            oldrev = mr.get('oldrev')
-            if oldrev and oldrev != '0000000000000000000000000000000000000000':
-                print(f"[Webhook] MR !{mr_iid} 有新 commit，触发审查")
-                should_record = True
-            else:
-                print(f"⏭️  MR !{mr_iid} 更新但无新 commit，仅审查不记录")
-                should_record = False
+            if not mr_has_new_commits(mr):
+                print(f"⏭️  MR !{mr_iid} 更新但无新 commit，跳过")
+                return
+            print(f"[Webhook] MR !{mr_iid} 有新 commit，触发审查")
         
         print(f"[Webhook] 自动审查 MR !{mr_iid} - {project['path_with_namespace']}")
         
-        # 只在有意义的情况下记录（创建、重新打开、或有新 commit 的更新）
-        if should_record:
-            record_review(
-                review_type='mr',
-                project_id=project['id'],
-                project_name=project['path_with_namespace'],
-                title=mr['title'],
-                url=mr['url'],
-                author=mr['author']['name'] if 'author' in mr and mr['author'] else 'Unknown',
-                branch=mr.get('target_branch', ''),
-                details=json.dumps({'action': action, 'iid': mr_iid, 'has_new_commits': action != 'update' or oldrev is not None})
-            )
+        head_sha = (mr.get('last_commit') or {}).get('id')
+        inserted = record_review(
+            review_type='mr',
+            project_id=project['id'],
+            project_name=project['path_with_namespace'],
+            title=mr['title'],
+            url=mr['url'],
+            author=mr['author']['name'] if 'author' in mr and mr['author'] else 'Unknown',
+            branch=mr.get('target_branch', ''),
+            details=json.dumps({'action': action, 'iid': mr_iid, 'has_new_commits': True}),
+            commit_sha=head_sha,
+            mr_iid=mr_iid,
+            event=action
+        )
+        # 相同事件、相同 head commit 已被其他 Webhook 记录（重复投递），不再审查
+        if inserted is False:
+            print(f"⏭️  MR !{mr_iid} 的 {action} 事件已在处理，跳过")
+            return
         
-        # 调用审查函数
-        review_mr_from_webhook(project_url, mr_iid)
+        # 调用审查函数；审查失败或被取消时记录标记为 failed，重试或重新投递时可以再次审查
+        status = RECORD_FAILED
+        try:
+            review_mr_from_webhook(project_url, mr_iid, cancel_event=cancel_event)
+            status = RECORD_DONE
+        finally:
+            finish_review_record('mr', project['id'], status, commit_sha=head_sha, mr_iid=mr_iid, event=action)
         
+    except CommandCancelled:
+        raise
     except Exception as e:
         print(f"处理 MR Webhook 失败: {e}")
         import traceback
         traceback.print_exc()
+        raise
 
-def handle_push_webhook(data):
-    """处理 Push Webhook 事件"""
+def handle_push_webhook(data, cancel_event=None):
+    """处理 Push Webhook 事件
+
+    cancel_event 被设置时（任务租约失效）停止审查剩余的 commit 并抛出 GenerationCancelled。
+    """
     try:
         # 获取 push 信息
         ref = data.get('ref', '')  # refs/heads/master
@@ -1784,12 +2519,14 @@ def handle_push_webhook(data):
         
         if is_new_branch and not review_all_commits:
             print(f"🆕 检测到新分支 '{branch}'，配置为不审查历史 commits，跳过所有 commits")
+            PUSH_COMMITS.inc(len(commits), outcome='new_branch_skipped')
             return
         
         if is_new_branch and review_all_commits:
             print(f"🆕 检测到新分支 '{branch}'，配置为审查所有历史 commits")
         
-        # 审查每个 commit
+        # 筛选并记录需要审查的 commit
+        pending_commits = []
         for commit in commits:
             commit_sha = commit['id']
             commit_message = commit['message']
@@ -1799,17 +2536,19 @@ def handle_push_webhook(data):
             # 跳过 Merge commit
             if commit_message.startswith('Merge branch') or commit_message.startswith('Merge pull request'):
                 print(f"⏭️  跳过 Merge commit: {commit_sha[:8]} - {commit_message[:50]}")
+                PUSH_COMMITS.inc(outcome='merge_skipped')
                 continue
             
             # 检查是否已经审查过
             if has_been_reviewed(project, commit_sha):
                 print(f"⏭️  跳过已审查的 Commit: {commit_sha[:8]} - {commit_message[:50]}")
+                PUSH_COMMITS.inc(outcome='duplicate')
                 continue
             
             print(f"[Webhook] 自动审查 Commit {commit_sha[:8]} - {commit_message[:50]}")
             
-            # 记录审查
-            record_review(
+            # 记录审查（原子去重：并发的 Webhook 只有一个能写入成功）
+            inserted = record_review(
                 review_type='commit',
                 project_id=project['id'],
                 project_name=project['path_with_namespace'],
@@ -1817,14 +2556,281 @@ def handle_push_webhook(data):
                 url=commit_url,
                 author=author_name,
                 branch=branch,
-                details=json.dumps({'sha': commit_sha, 'full_message': commit_message})
+                details=json.dumps({'sha': commit_sha, 'full_message': commit_message}),
+                commit_sha=commit_sha,
+                event='push'
             )
+            if inserted is False:
+                print(f"⏭️  Commit {commit_sha[:8]} 已由其他 Webhook 处理，跳过")
+                PUSH_COMMITS.inc(outcome='duplicate')
+                continue
+            
+            PUSH_COMMITS.inc(outcome='queued')
+            pending_commits.append(commit)
+        
+        if not pending_commits:
+            return
+        
+        # 按推送合并审查：多个 commit 只调用一次 AI，评论发布在最新的 commit 上
+        if config.get('AUTO_REVIEW_PUSH_RANGE', 'false').lower() == 'true' and len(pending_commits) > 1:
+            head_sha = data.get('after') or pending_commits[-1]['id']
+            if is_new_branch:
+                # 新分支没有 before，与默认分支比较
+                default_branch = project.get('default_branch')
+                compare_from = default_branch if default_branch and default_branch != branch else None
+            else:
+                compare_from = before_sha
             
-            # 调用 commit 审查函数
-            review_commit_from_webhook(project, commit_sha)
+            diffs = fetch_push_range_diffs(project, compare_from, head_sha) if compare_from else None
+            if diffs is not None:
+                status = RECORD_FAILED
+                try:
+                    review_commit_from_webhook(
+                        project, head_sha, diffs=diffs, commits=pending_commits, cancel_event=cancel_event
+                    )
+                    status = RECORD_DONE
+                finally:
+                    for commit in pending_commits:
+                        finish_review_record('commit', project['id'], status, commit_sha=commit['id'])
+                return
+            print("⚠️ 无法获取推送范围的变更，改为逐个审查 commit")
+        
+        # 逐个审查 commit；失败的 commit 标记为 failed，其余 commit 继续审查，最后统一抛出异常让任务重试
+        errors = []
+        for commit in pending_commits:
+            try:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled('审查已取消')
+                review_commit_from_webhook(project, commit['id'], cancel_event=cancel_event)
+                finish_review_record('commit', project['id'], RECORD_DONE, commit_sha=commit['id'])
+            except GenerationCancelled:
+                finish_review_record('commit', project['id'], RECORD_FAILED, commit_sha=commit['id'])
+                for rest in pending_commits[pending_commits.index(commit) + 1:]:
+                    finish_review_record('commit', project['id'], RECORD_FAILED, commit_sha=rest['id'])
+                raise
+            except Exception as e:
+                finish_review_record('commit', project['id'], RECORD_FAILED, commit_sha=commit['id'])
+                errors.append(f"{commit['id'][:8]}: {e}")
+        if errors:
+            raise Exception(f"{len(errors)} 个 Commit 审查失败: {'; '.join(errors)}")
         
     except Exception as e:
         print(f"处理 Push Webhook 失败: {e}")
+        raise
+
+# 调度线程唤醒信号：有新任务入队或线程池空出位置时触发
+_job_wakeup = threading.Event()
+
+def watch_job(job, cancel_event, done_event, lease_lost, interval=5):
+    """任务执行期间的后台检查
+
+    定期延长租约（长时间的审查不会被其他 worker 当作崩溃的任务重新领取）；
+    租约已失效（任务已被其他 worker 重新领取）时设置 lease_lost 和 cancel_event 中止执行；
+    带合并键的任务被更新的任务取代时设置 cancel_event。
+    """
+    last_renew = time.time()
+    while not done_event.wait(interval):
+        try:
+            if time.time() - last_renew >= review_jobs.lease_seconds / 3:
+                if not review_jobs.renew(job['id'], job['lease_owner']):
+                    print(f"⚠️ 任务 #{job['id']} 的租约已失效，中止执行")
+                    lease_lost.set()
+                    cancel_event.set()
+                    return
+                last_renew = time.time()
+            if not cancel_event.is_set() and review_jobs.has_newer(job):
+                print(f"⏹️ 任务 #{job['id']} 已被更新的任务取代")
+                cancel_event.set()
+        except sqlite3.Error as e:
+            print(f"⚠️ 检查任务 #{job['id']} 状态失败: {e}")
+
+def run_review_job(job, handler):
+    """在线程池中执行队列任务，并更新任务状态
+
+    带合并键的任务（MR 审查）执行期间如果有了更新的任务，中止执行并标记为 superseded；
+    租约失效时中止执行，任务状态由重新领取它的 worker 更新。
+    """
+    done_event = threading.Event()
+    cancel_event = threading.Event()
+    lease_lost = threading.Event()
+    threading.Thread(
+        target=watch_job, args=(job, cancel_event, done_event, lease_lost),
+        name=f"job-{job['id']}-watch", daemon=True
+    ).start()
+    try:
+        handler(job['payload'], cancel_event=cancel_event)
+        if not review_jobs.complete(job['id'], job['lease_owner']):
+            print(f"⚠️ 任务 #{job['id']} 的租约已失效，不更新任务状态")
+    except (CommandCancelled, GenerationCancelled):
+        if not lease_lost.is_set():
+            review_jobs.supersede(job['id'], job['lease_owner'])
+    except Exception as e:
+        gave_up = review_jobs.fail(job['id'], job['lease_owner'], str(e), job['attempts'])
+        if gave_up is None:
+            print(f"⚠️ 任务 #{job['id']} 的租约已失效，不更新任务状态")
+        elif gave_up:
+            print(f"❌ 任务 #{job['id']} 已失败 {job['attempts']} 次，不再重试")
+        else:
+            print(f"🔁 任务 #{job['id']} 失败，稍后重试（第 {job['attempts']} 次）")
+    finally:
+        done_event.set()
+        _job_wakeup.set()
+
+def job_dispatcher_loop(stop_event=None, idle_wait=5):
+    """从任务表中领取任务并分发给线程池
+
+    只在线程池有空闲线程时领取任务，突发的 Webhook 会留在表中按节奏执行，
+    两次分发之间间隔 REVIEW_JOB_DISPATCH_INTERVAL_MS 毫秒。
+    stop_event 被设置后不再领取新任务并返回。
+    """
+    job_routes = {
+        'mr_webhook': (handle_mr_webhook, mr_review_pool),
+        'push_webhook': (handle_push_webhook, commit_review_pool)
+    }
+    interval = get_config_int(load_env_config(), 'REVIEW_JOB_DISPATCH_INTERVAL_MS', 200) / 1000
+    
+    while stop_event is None or not stop_event.is_set():
+        _job_wakeup.clear()
+        dispatched = False
+        for kind, (handler, pool) in job_routes.items():
+            if not pool.has_capacity():
+                continue
+            try:
+                job = review_jobs.claim(kind)
+            except sqlite3.Error as e:
+                print(f"❌ 领取审查任务失败: {e}")
+                continue
+            if job:
+                print(f"📥 开始执行任务 #{job['id']} ({kind}，第 {job['attempts']} 次)")
+                pool.submit(
+                    run_review_job, job, handler,
+                    priority=job['priority'],
+                    project=job['project_key'],
+                    enqueued_at=job['available_at']
+                )
+                dispatched = True
+        
+        if dispatched:
+            time.sleep(interval)
+        else:
+            # 没有可执行的任务时等待唤醒，超时后重新检查延迟重试、租约过期
+            # 以及其他进程写入的任务
+            _job_wakeup.wait(timeout=idle_wait)
+
+def start_job_dispatcher():
+    """启动任务调度线程，继续执行上次未完成的任务"""
+    pending = review_jobs.pending_count()
+    if pending:
+        print(f"🔄 发现 {pending} 个未完成的审查任务，将继续执行")
+    thread = threading.Thread(target=job_dispatcher_loop, name='review-job-dispatcher')
+    thread.daemon = True
+    thread.start()
+
+# 当前进程见过的 Token：scope -> (Token, 最近访问时间)，后台线程定期刷新这些 Token 的索引
+_inventory_tokens = {}
+_inventory_tokens_lock = threading.Lock()
+# 超过该时间未访问的 Token 不再定期刷新
+INVENTORY_TOKEN_IDLE_SECONDS = 86400
+
+def remember_inventory_token(scope, token):
+    if not token:
+        return
+    with _inventory_tokens_lock:
+        _inventory_tokens[scope] = (token, time.time())
+
+# 单次刷新最多同步的项目数
+WEBHOOK_INVENTORY_MAX_PROJECTS = 5000
+
+def refresh_webhook_inventory(gitlab):
+    """增量刷新 Webhook 索引
+
+    先同步可访问的项目列表（按活跃时间倒序），再并发检查其中新增、有新活动或已过期的项目。
+    返回本轮检查的项目数。
+    """
+    params = {
+        'membership': 'true',
+        'simple': 'true',
+        'order_by': 'last_activity_at'
+    }
+    
+    projects = list(paginate(
+        gitlab, '/projects', params, executor=gitlab_executor,
+        max_items=WEBHOOK_INVENTORY_MAX_PROJECTS, keyset_order_by='id'
+    ))
+    complete = len(projects) < WEBHOOK_INVENTORY_MAX_PROJECTS
+    
+    due = webhook_inventory.sync_projects(gitlab.scope, projects, complete)
+    results = gitlab_executor.map(lambda project_id: fetch_project_hooks(gitlab, project_id), due)
+    for project_id, (hooks, error) in zip(due, results):
+        if error:
+            print(f"⚠️ 检查项目 {project_id} 的 Webhook 失败: {error}")
+        webhook_inventory.save_hooks(gitlab.scope, project_id, hooks, error)
+    return len(due)
+
+def refresh_inventory_scope(token):
+    """刷新一个 Token 的 Webhook 索引，直到没有待检查的项目
+
+    通过数据库中的刷新租约保证同一 Token 同时只有一个进程在刷新；已在刷新时直接返回。
+    """
+    gitlab = gitlab_client.get_client(get_gitlab_url(), token)
+    if not webhook_inventory.claim_refresh(gitlab.scope):
+        return
+    try:
+        while True:
+            checked = refresh_webhook_inventory(gitlab)
+            if checked:
+                print(f"🔎 Webhook 索引已更新 {checked} 个项目")
+            if checked < webhook_inventory.batch_size:
+                break
+        webhook_inventory.finish_refresh(gitlab.scope)
+    except Exception as e:
+        print(f"❌ 刷新 Webhook 索引失败: {e}")
+        webhook_inventory.finish_refresh(gitlab.scope, str(e))
+
+def refresh_inventory_projects(gitlab, project_ids):
+    """批量修改 Webhook 后立即更新这些项目的索引"""
+    def refresh(project_id):
+        hooks, error = fetch_project_hooks(gitlab, project_id)
+        if not error:
+            webhook_inventory.save_hooks(gitlab.scope, project_id, hooks)
+    
+    try:
+        list(gitlab_executor.map(refresh, [int(project_id) for project_id in project_ids]))
+    except Exception as e:
+        print(f"⚠️ 更新 Webhook 索引失败: {e}")
+
+def webhook_inventory_loop():
+    """定期刷新 Webhook 索引
+
+    每 WEBHOOK_INVENTORY_REFRESH_SECONDS 秒刷新一次配置文件中 Token 的索引，以及最近一天内
+    在当前进程访问过“已配置项目”页面的 Token 的索引；项目超过 WEBHOOK_INVENTORY_MAX_AGE 秒
+    未检查时重新检查。
+    """
+    while True:
+        config = load_env_config()
+        interval = get_config_int(config, 'WEBHOOK_INVENTORY_REFRESH_SECONDS', 300)
+        webhook_inventory.max_age = get_config_int(config, 'WEBHOOK_INVENTORY_MAX_AGE', 3600)
+        
+        tokens = {}
+        config_token = config.get('GITLAB__PERSONAL_ACCESS_TOKEN', '')
+        if config_token:
+            tokens[gitlab_client.token_scope(get_gitlab_url(), config_token)] = config_token
+        with _inventory_tokens_lock:
+            for scope, (token, seen_at) in list(_inventory_tokens.items()):
+                if time.time() - seen_at > INVENTORY_TOKEN_IDLE_SECONDS:
+                    del _inventory_tokens[scope]
+                else:
+                    tokens[scope] = token
+        
+        for token in tokens.values():
+            refresh_inventory_scope(token)
+        time.sleep(interval)
+
+def start_webhook_inventory():
+    """启动 Webhook 索引刷新线程"""
+    thread = threading.Thread(target=webhook_inventory_loop, name='webhook-inventory')
+    thread.daemon = True
+    thread.start()
 
 def has_been_reviewed(project, commit_sha):
     """检查 commit 是否已经被审查过"""
@@ -1833,8 +2839,8 @@ def has_been_reviewed(project, commit_sha):
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
         cursor.execute(
-            'SELECT COUNT(*) FROM review_records WHERE project_id = ? AND details LIKE ?',
-            (project['id'], f'%{commit_sha}%')
+            'SELECT COUNT(*) FROM review_records WHERE type = ? AND project_id = ? AND commit_sha = ? AND status = ?',
+            ('commit', project['id'], commit_sha, RECORD_DONE)
         )
         count = cursor.fetchone()[0]
         conn.close()
@@ -1851,11 +2857,10 @@ def has_been_reviewed(project, commit_sha):
             return False
         
         project_path = project['path_with_namespace']
-        headers = {'PRIVATE-TOKEN': gitlab_token}
+        gitlab = gitlab_client.get_client(gitlab_url, gitlab_token)
         
         # 获取 commit 的评论
-        comments_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/repository/commits/{commit_sha}/comments"
-        response = requests.get(comments_url, headers=headers, timeout=10)
+        response = gitlab.get(f"/projects/{encode_project(project_path)}/repository/commits/{commit_sha}/comments", timeout=10)
         
         if response.status_code == 200:
             comments = response.json()
@@ -1877,8 +2882,8 @@ def has_mr_been_reviewed(project, mr_iid):
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
         cursor.execute(
-            'SELECT COUNT(*) FROM review_records WHERE project_id = ? AND type = ? AND details LIKE ?',
-            (project['id'], 'mr', f'%"iid": {mr_iid}%')
+            'SELECT COUNT(*) FROM review_records WHERE type = ? AND project_id = ? AND mr_iid = ? AND status = ?',
+            ('mr', project['id'], mr_iid, RECORD_DONE)
         )
         count = cursor.fetchone()[0]
         conn.close()
@@ -1895,11 +2900,10 @@ def has_mr_been_reviewed(project, mr_iid):
             return False
         
         project_path = project['path_with_namespace']
-        headers = {'PRIVATE-TOKEN': gitlab_token}
+        gitlab = gitlab_client.get_client(gitlab_url, gitlab_token)
         
         # 获取 MR 的评论
-        notes_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/merge_requests/{mr_iid}/notes"
-        response = requests.get(notes_url, headers=headers, timeout=10)
+        response = gitlab.get(f"/projects/{encode_project(project_path)}/merge_requests/{mr_iid}/notes", timeout=10)
         
         if response.status_code == 200:
             notes = response.json()
@@ -1982,42 +2986,85 @@ def should_auto_review_push(data, branch):
     
     return True
 
-def review_mr_from_webhook(project_url, mr_iid):
-    """从 Webhook 触发 MR 审查"""
+def review_mr_from_webhook(project_url, mr_iid, cancel_event=None):
+    """从 Webhook 触发 MR 审查
+
+    审查失败、超时时抛出异常，由任务队列稍后重试。
+    """
     try:
         mr_url = f"{project_url}/merge_requests/{mr_iid}"
         print(f"🚀 开始审查 MR: {mr_url}")
         
-        # 运行 Docker 命令调用 PR-Agent
-        cmd = [
-            'docker', 'run', '--rm',
-            '--env-file', ENV_FILE,
-            'codiumai/pr-agent:latest',
-            '--pr_url', mr_url,
-            'review'
-        ]
-        
-        print(f"📝 执行命令: {' '.join(cmd)}")
-        
-        # 执行审查（设置超时10分钟）
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-        
-        if result.returncode == 0:
-            print(f"✅ MR 审查完成！")
-            print(f"输出: {result.stdout[:500]}")  # 打印前500字符
-        else:
-            print(f"❌ MR 审查失败！")
-            print(f"错误: {result.stderr[:500]}")
+        # 调用 PR-Agent 执行审查（设置超时10分钟）
+        result = run_pr_agent(mr_url, cancel_event=cancel_event)
         
     except subprocess.TimeoutExpired:
         print(f"⏱️ MR 审查超时（10分钟）")
+        REVIEWS.inc(type='mr', trigger='webhook', outcome='timeout')
+        raise
+    except CommandCancelled:
+        print(f"⏹️ MR !{mr_iid} 有更新的推送，已中止本次审查")
+        REVIEWS.inc(type='mr', trigger='webhook', outcome='superseded')
+        raise
     except Exception as e:
         print(f"❌ 审查 MR 失败: {e}")
+        REVIEWS.inc(type='mr', trigger='webhook', outcome='error')
         import traceback
         traceback.print_exc()
+        raise
+    
+    if result.returncode != 0:
+        print(f"❌ MR 审查失败！")
+        print(f"错误: {result.stderr[:500]}")
+        REVIEWS.inc(type='mr', trigger='webhook', outcome='failed')
+        raise Exception(f'PR-Agent 审查失败（退出码 {result.returncode}）: {result.stderr[-500:]}')
+    
+    print(f"✅ MR 审查完成！")
+    print(f"输出: {result.stdout[:500]}")  # 打印前500字符
+    REVIEWS.inc(type='mr', trigger='webhook', outcome='success')
+
+def fetch_push_range_diffs(project, compare_from, compare_to):
+    """通过 compare 接口获取一次推送的整体变更
+
+    Returns:
+        diff 列表；获取失败或 GitLab 比较超时时返回 None
+    """
+    config = load_env_config()
+    gitlab_url = config.get('GITLAB__URL', 'https://gitlab.com')
+    gitlab_token = config.get('GITLAB__PERSONAL_ACCESS_TOKEN', '')
+    if not gitlab_token:
+        return None
+    
+    gitlab = gitlab_client.get_client(gitlab_url, gitlab_token)
+    try:
+        response = gitlab.get(
+            f"/projects/{encode_project(project['path_with_namespace'])}/repository/compare",
+            params={'from': compare_from, 'to': compare_to}
+        )
+    except Exception as e:
+        print(f"❌ 获取推送范围变更失败: {e}")
+        return None
+    
+    if response.status_code != 200:
+        print(f"❌ 获取推送范围变更失败: {response.status_code} - {response.text}")
+        return None
+    
+    result = response.json()
+    if result.get('compare_timeout'):
+        print(f"⚠️ GitLab 比较 {compare_from[:8]}..{compare_to[:8]} 超时")
+        return None
+    
+    return result.get('diffs', [])
+
+def review_commit_from_webhook(project, commit_sha, diffs=None, commits=None, cancel_event=None):
+    """从 Webhook 触发 Commit 审查
 
-def review_commit_from_webhook(project, commit_sha):
-    """从 Webhook 触发 Commit 审查"""
+    传入 diffs 和 commits 时审查的是一次推送的整体变更（按推送合并审查），
+    评论发布在 commit_sha（推送的最新 commit）上。评论发布成功前的任何失败都会抛出异常，
+    由任务队列稍后重试。
+    """
+    # 指标中记录的审查结果，在每个返回处设置
+    outcome = 'error'
     try:
         project_url = project['web_url']
         project_path = project['path_with_namespace']
@@ -2035,109 +3082,216 @@ def review_commit_from_webhook(project, commit_sha):
         ai_model = config.get('CONFIG__MODEL', 'qwen-plus')
         
         if not gitlab_token:
-            print("❌ 错误: 未配置 GitLab Token")
-            return
+            outcome = 'skipped'
+            raise Exception('未配置 GitLab Token')
         
         if not ai_api_key:
-            print("❌ 错误: 未配置 AI API Key")
-            return
+            outcome = 'skipped'
+            raise Exception('未配置 AI API Key')
         
         # 去掉 model 的 openai/ 前缀
-        if ai_model.startswith('openai/'):
-            ai_model = ai_model.replace('openai/', '')
-        
-        print(f"📡 获取 Commit 变更...")
+        ai_model = dashscope_client.normalize_model(ai_model)
         
-        # 获取 Commit 的 diff
-        headers = {'PRIVATE-TOKEN': gitlab_token}
-        api_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/repository/commits/{commit_sha}/diff"
+        gitlab = gitlab_client.get_client(gitlab_url, gitlab_token)
+        commit_api = f"/projects/{encode_project(project_path)}/repository/commits/{commit_sha}"
         
-        diff_response = requests.get(api_url, headers=headers, timeout=30)
-        
-        if diff_response.status_code != 200:
-            print(f"❌ 获取 Commit diff 失败: {diff_response.status_code} - {diff_response.text}")
-            return
-        
-        diffs = diff_response.json()
+        if diffs is None:
+            print(f"📡 获取 Commit 变更...")
+            
+            # 获取 Commit 的 diff
+            diff_response = gitlab.get(f"{commit_api}/diff")
+            
+            if diff_response.status_code != 200:
+                outcome = 'failed'
+                raise Exception(f"获取 Commit diff 失败: {diff_response.status_code} - {diff_response.text}")
+            
+            diffs = diff_response.json()
         print(f"✅ 获取到 {len(diffs)} 个文件的变更")
         
-        # 构建 diff 文本
-        diff_text = ""
-        for diff in diffs[:10]:  # 限制最多10个文件
-            diff_text += f"\n\n文件: {diff['new_path']}\n"
-            diff_text += f"变更: +{diff.get('added_lines', 0)} -{diff.get('removed_lines', 0)}\n"
-            diff_text += diff.get('diff', '')[:2000]  # 每个文件最多2000字符
-        
         print(f"🤖 调用 AI 进行代码审查...")
         
         # 构建审查 prompt
-        prompt = f"""请对以下 Git Commit 的代码变更进行审查：
-
-代码变更：
-{diff_text}
-
-请提供：
-1. ✅ 代码质量评估
-2. ⚠️ 潜在问题和建议
-3. 💡 优化建议
-4. 📝 其他注意事项
-
-请使用中文回复，并使用 ✅ ⚠️ ❌ 💡 等图标标注不同类型的反馈。"""
-
-        # 禁用代理
-        proxies = {'http': None, 'https': None}
-        
-        # 调用 AI API
-        ai_response = requests.post(
-            'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation',
-            headers={
-                'Authorization': f'Bearer {ai_api_key}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': ai_model,
-                'input': {'messages': [{'role': 'user', 'content': prompt}]},
-                'parameters': {'result_format': 'message'}
-            },
-            proxies=proxies,
-            timeout=120
-        )
-        
-        if ai_response.status_code != 200:
-            print(f"❌ AI 审查失败: {ai_response.status_code} - {ai_response.text}")
-            return
-        
-        ai_result = ai_response.json()
-        review_content = ai_result['output']['choices'][0]['message']['content']
+        if commits:
+            subject = f"以下一次推送（共 {len(commits)} 个 Commit）的整体代码变更"
+            commit_list = "包含的 Commit：\n"
+            for c in commits:
+                title = c['message'].split('\n')[0][:100]
+                commit_list += f"- {c['id'][:8]} {title}\n"
+            commit_list += "\n"
+        else:
+            subject = "以下 Git Commit 的代码变更"
+            commit_list = ""
+        
+        # 相同的补丁（cherry-pick、rebase、推送到多个分支）复用之前的审查结果
+        cache_key = None
+        cached = None
+        if config.get('AI_REVIEW_CACHE', 'true').lower() == 'true':
+            review_cache.max_entries = get_config_int(config, 'AI_REVIEW_CACHE_MAX_ENTRIES', 5000)
+            review_cache.max_age = get_config_int(config, 'AI_REVIEW_CACHE_MAX_AGE_DAYS', 30) * 86400
+            cache_key = review_cache_key(
+                diffs, ai_model, REVIEW_PROMPT_VERSION, mode='push' if commits else 'commit', subject=subject
+            )
+            cached = review_cache.get(cache_key)
         
-        print(f"✅ AI 审查完成")
+        if cached:
+            review_content = cached['content']
+            print(f"♻️ 相同的变更已在 {cached['source']} 审查过，复用审查结果")
+        else:
+            # 调用 AI API（大 Commit 分片并行审查后合并）
+            try:
+                ai_result = generate_diff_review(
+                    config, ai_api_key, ai_model, diffs, subject, commit_list, cancel_event=cancel_event
+                )
+            except dashscope_client.DashScopeError:
+                outcome = 'failed'
+                raise
+            
+            review_content = ai_result['content']
+            if cache_key:
+                review_cache.put(
+                    cache_key, ai_model, REVIEW_PROMPT_VERSION, review_content,
+                    source=f"{project_path}@{commit_sha[:8]}"
+                )
+            
+            print(f"✅ AI 审查完成（首字延迟 {ai_result['ttft']:.2f}s，总耗时 {ai_result['elapsed']:.2f}s）")
         print(f"📝 发布评论到 GitLab...")
         
         # 发布评论到 GitLab Commit
-        comment_url = f"{gitlab_url}/api/v4/projects/{project_path.replace('/', '%2F')}/repository/commits/{commit_sha}/comments"
-        comment_data = {'note': f"🤖 AI 代码审查\n\n{review_content}"}
-        
-        comment_response = requests.post(
-            comment_url,
-            headers=headers,
-            json=comment_data,
-            timeout=30
-        )
+        heading = "🤖 AI 代码审查"
+        if commits:
+            heading += f"（本次推送 {len(commits)} 个 Commit）"
+        if cached and config.get('AI_REVIEW_CACHE_MARKER', 'true').lower() == 'true':
+            heading += f"\n\n> ♻️ 相同的变更已在 {cached['source']} 审查过，以下为复用的审查结果"
+        comment_data = {'note': f"{heading}\n\n{review_content}"}
+        
+        comment_response = gitlab.post(f"{commit_api}/comments", json=comment_data)
         
         if comment_response.status_code in [200, 201]:
             print(f"✅ 评论发布成功！")
             print(f"🔗 查看: {project_url}/-/commit/{commit_sha}")
+            outcome = 'cached' if cached else 'success'
         else:
-            print(f"❌ 发布评论失败: {comment_response.status_code} - {comment_response.text}")
+            outcome = 'failed'
+            raise Exception(f"发布评论失败: {comment_response.status_code} - {comment_response.text}")
         
         print(f"=" * 80)
         
+    except GenerationCancelled:
+        print(f"⏹️ Commit {commit_sha[:8]} 的审查已中止")
+        outcome = 'cancelled'
+        raise
     except Exception as e:
         print(f"❌ 审查 Commit 失败: {e}")
         import traceback
         traceback.print_exc()
+        if is_timeout_error(e):
+            outcome = 'timeout'
+        raise
+    finally:
+        REVIEWS.inc(type='push' if commits else 'commit', trigger='webhook', outcome=outcome)
+
+def use_shared_review_status():
+    """改用 SQLite 保存审查状态，多个 Web 进程都可以查询和推送任意审查的进度"""
+    global review_status
+    review_status = SQLiteReviewStatusStore(DB_FILE)
+    review_status.init_schema()
+
+def start_background_services():
+    """启动后台线程：任务调度（未使用独立 worker 时）、Webhook spool 导入、Webhook 索引刷新和容器预热"""
+    # 使用独立的 worker 进程（python app.py worker）执行审查任务时，Web 进程只负责接收 Webhook
+    if load_env_config().get('REVIEW_EXTERNAL_WORKERS', 'false').lower() != 'true':
+        start_job_dispatcher()
+    start_webhook_spool()
+    start_webhook_inventory()
+    if pr_agent_pool.enabled:
+        threading.Thread(target=pr_agent_pool.warm_up, name='pr-agent-warm-up', daemon=True).start()
+
+# 持有后台任务文件锁的文件对象，进程存活期间保持打开
+_background_lock = None
+
+def start_background_services_leader(retry_seconds=10):
+    """多进程部署时只在一个进程中启动后台线程
+
+    取得 reviews.db 同目录下文件锁的进程负责运行后台线程，其他进程定期重试，
+    持有锁的进程退出后由其他进程接替。
+    """
+    import fcntl
+    
+    def acquire():
+        global _background_lock
+        lock_file = open(os.path.join(os.path.dirname(DB_FILE), 'background.lock'), 'w')
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(retry_seconds)
+        _background_lock = lock_file
+        print(f"👑 进程 {os.getpid()} 负责运行后台任务")
+        start_background_services()
+    
+    threading.Thread(target=acquire, name='background-leader', daemon=True).start()
+
+def run_worker(argv):
+    """worker 模式：只从任务表领取并执行 Webhook 审查任务，不提供 HTTP 服务
+
+    可以启动多个 worker 进程（同一台机器或共享 reviews.db 所在卷的多台机器），
+    任务通过租约分配，不会重复执行。
+    """
+    global mr_review_pool, commit_review_pool
+    
+    parser = argparse.ArgumentParser(prog='app.py worker', description='执行 Webhook 审查任务的 worker 进程')
+    parser.add_argument('--concurrency', type=int, default=commit_review_pool.max_workers,
+                        help='同时执行的 Commit 审查数（默认 REVIEW_COMMIT_WORKERS）')
+    parser.add_argument('--mr-concurrency', type=int, default=mr_review_pool.max_workers,
+                        help='同时执行的 MR 审查数（默认 REVIEW_MR_WORKERS）')
+    parser.add_argument('--poll', type=float, default=1,
+                        help='没有任务时检查任务表的间隔（秒）')
+    args = parser.parse_args(argv)
+    
+    mr_review_pool = ReviewPool('mr', args.mr_concurrency)
+    commit_review_pool = ReviewPool('commit', args.concurrency)
+    if pr_agent_pool.enabled:
+        pr_agent_pool.size = mr_review_pool.max_workers
+    
+    print("=" * 60)
+    print(f"🛠️ PR-Agent 审查 worker ({review_jobs.owner})")
+    print("=" * 60)
+    print(f"💾 审查数据库: {DB_FILE}")
+    print(f"⚙️ 并发: Commit {commit_review_pool.max_workers}，MR {mr_review_pool.max_workers}")
+    print("=" * 60)
+    
+    init_database()
+    enable_shared_metrics()
+    pending = review_jobs.pending_count()
+    if pending:
+        print(f"🔄 任务表中有 {pending} 个未完成的审查任务")
+    if pr_agent_pool.enabled:
+        threading.Thread(target=pr_agent_pool.warm_up, name='pr-agent-warm-up', daemon=True).start()
+    
+    stop_event = threading.Event()
+    
+    def request_stop(signum, frame):
+        if stop_event.is_set():
+            # 第二次收到信号时立即退出，执行中的任务租约过期后由其他 worker 重新执行
+            sys.exit(1)
+        print("⏹️ 停止领取新任务，等待执行中的任务完成（再次按 Ctrl+C 立即退出）...")
+        stop_event.set()
+        _job_wakeup.set()
+    
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    
+    job_dispatcher_loop(stop_event=stop_event, idle_wait=args.poll)
+    mr_review_pool.shutdown(wait=True)
+    commit_review_pool.shutdown(wait=True)
+    print("👋 worker 已退出")
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['worker']:
+        run_worker(sys.argv[2:])
+        sys.exit(0)
+    
     print("=" * 60)
     print("🚀 PR-Agent 可视化管理平台")
     print("=" * 60)
@@ -2150,6 +3304,14 @@ if __name__ == '__main__':
     # 初始化数据库
     init_database()
     
+    # debug 模式下 Werkzeug 会启动重载子进程，只在实际提供服务的子进程中启动调度线程
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # 使用独立 worker 时，/metrics 需要合并 worker 进程的指标
+        if load_env_config().get('REVIEW_EXTERNAL_WORKERS', 'false').lower() == 'true':
+            registry.reset_multiprocess(METRICS_DIR)
+            enable_shared_metrics()
+        start_background_services()
+    
     print("按 Ctrl+C 停止服务")
     print()
     
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+PR-Agent 常驻容器池
+预先启动若干个 PR-Agent 容器，审查时通过 docker exec 执行，
+省去每次 docker run 创建容器、解析镜像的开销
+"""
+
+import os
+import queue
+import subprocess
+import threading
+import time
+
+# PR-Agent 镜像的默认入口（见镜像 Dockerfile 的 ENTRYPOINT）
+PR_AGENT_ENTRY = ['python', 'pr_agent/cli.py']
+
+
+class CommandCancelled(Exception):
+    """命令在执行过程中被取消"""
+
+
+def run_command(cmd, timeout, cancel_event=None, poll_interval=1):
+    """执行命令，返回 subprocess.CompletedProcess
+
+    cancel_event 被设置时结束进程并抛出 CommandCancelled；超时抛出 subprocess.TimeoutExpired。
+    """
+    if cancel_event is None:
+        return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+
+    deadline = time.time() + timeout
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as process:
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=poll_interval)
+                return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                if cancel_event.is_set():
+                    process.kill()
+                    process.communicate()
+                    raise CommandCancelled('命令已取消')
+                if time.time() >= deadline:
+                    process.kill()
+                    stdout, stderr = process.communicate()
+                    raise subprocess.TimeoutExpired(cmd, timeout, stdout, stderr)
+
+
+class WarmContainer:
+    """一个常驻的 PR-Agent 容器"""
+
+    def __init__(self, name, env_mtime):
+        self.name = name
+        self.env_mtime = env_mtime
+        self.jobs = 0
+        self.started_at = time.time()
+
+
+class ContainerPool:
+    """常驻容器池，容器执行 max_jobs 次审查后回收重建"""
+
+    def __init__(self, image, env_file, size, max_jobs=20, name_prefix='pr-agent-warm',
+                 health_interval=60, acquire_timeout=30):
+        self.image = image
+        self.env_file = env_file
+        self.size = max(0, int(size))
+        self.max_jobs = max(1, int(max_jobs))
+        self.name_prefix = name_prefix
+        self.health_interval = health_interval
+        # 池已满时等待空闲容器的最长秒数，超时后由调用方改用 docker run
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._containers = {}
+        # 正在启动的容器数，与已启动的容器一起计入池大小
+        self._starting = 0
+        self._next_index = 0
+        self._busy = 0
+        self._recycled = 0
+        self._health_thread = None
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def _env_mtime(self):
+        try:
+            return os.path.getmtime(self.env_file)
+        except OSError:
+            return 0
+
+    def _docker(self, args, timeout=60):
+        return subprocess.run(['docker'] + args, capture_output=True, text=True, timeout=timeout)
+
+    def _start_container(self):
+        """启动一个常驻容器，用 sleep 代替默认入口保持运行
+
+        在锁内占用池中的位置后再启动，池已满时返回 None，并发调用不会超出池大小。
+        """
+        with self._lock:
+            if len(self._containers) + self._starting >= self.size:
+                return None
+            self._starting += 1
+            self._next_index += 1
+            name = f"{self.name_prefix}-{os.getpid()}-{self._next_index}"
+        try:
+            env_mtime = self._env_mtime()
+            result = self._docker([
+                'run', '-d', '--rm',
+                '--name', name,
+                '--env-file', self.env_file,
+                '--entrypoint', 'sleep',
+                self.image, 'infinity'
+            ], timeout=300)
+            if result.returncode != 0:
+                raise RuntimeError(f'启动 PR-Agent 容器失败: {result.stderr.strip()}')
+            container = WarmContainer(name, env_mtime)
+            with self._lock:
+                self._containers[name] = container
+        except subprocess.TimeoutExpired:
+            raise RuntimeError('启动 PR-Agent 容器超时')
+        finally:
+            with self._lock:
+                self._starting -= 1
+        print(f"🐳 已启动常驻容器: {name}")
+        return container
+
+    def _remove_container(self, container):
+        with self._lock:
+            self._containers.pop(container.name, None)
+            self._recycled += 1
+        try:
+            self._docker(['rm', '-f', container.name], timeout=60)
+        except Exception as e:
+            print(f"⚠️ 删除容器 {container.name} 失败: {e}")
+
+    def _is_healthy(self, container):
+        try:
+            result = self._docker(['inspect', '-f', '{{.State.Running}}', container.name], timeout=10)
+            return result.returncode == 0 and result.stdout.strip() == 'true'
+        except Exception:
+            return False
+
+    def _needs_recycle(self, container):
+        # 执行次数达到上限，或 .env 已修改（容器内环境变量已过期）
+        return container.jobs >= self.max_jobs or container.env_mtime != self._env_mtime()
+
+    def acquire(self, timeout=None):
+        """取出一个空闲容器，池未满时按需启动新容器
+
+        池已满且 timeout 秒内（默认 acquire_timeout）没有空闲容器时抛出 RuntimeError。
+        """
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = time.time() + timeout
+        while True:
+            try:
+                container = self._idle.get_nowait()
+            except queue.Empty:
+                container = self._start_container()
+                if container is None:
+                    try:
+                        container = self._idle.get(timeout=max(0, deadline - time.time()))
+                    except queue.Empty:
+                        raise RuntimeError(f'{timeout} 秒内没有空闲的 PR-Agent 容器')
+
+            if self._needs_recycle(container) or not self._is_healthy(container):
+                self._remove_container(container)
+                continue
+
+            with self._lock:
+                self._busy += 1
+            return container
+
+    def release(self, container, healthy=True):
+        """归还容器，不健康或需要回收的容器直接删除"""
+        with self._lock:
+            self._busy -= 1
+        container.jobs += 1
+        if not healthy or self._needs_recycle(container):
+            self._remove_container(container)
+        else:
+            self._idle.put(container)
+
+    def run(self, args, extra_env=None, timeout=600, cancel_event=None):
+        """在常驻容器中执行 PR-Agent 命令，返回 subprocess.CompletedProcess
+
+        cancel_event 被设置时中止执行并抛出 CommandCancelled。
+        """
+        container = self.acquire()
+        healthy = True
+        try:
+            cmd = ['docker', 'exec']
+            for key, value in (extra_env or {}).items():
+                cmd.extend(['-e', f'{key}={value}'])
+            cmd.append(container.name)
+            cmd.extend(PR_AGENT_ENTRY)
+            cmd.extend(args)
+            return run_command(cmd, timeout, cancel_event)
+        except (subprocess.TimeoutExpired, CommandCancelled):
+            # 超时或取消后容器内进程仍在运行，回收整个容器
+            healthy = False
+            raise
+        finally:
+            self.release(container, healthy)
+
+    def warm_up(self):
+        """预先启动全部容器并开始健康检查"""
+        for _ in range(self.size):
+            try:
+                container = self._start_container()
+            except Exception as e:
+                print(f"⚠️ 预热 PR-Agent 容器失败: {e}")
+                break
+            if container is None:
+                break
+            self._idle.put(container)
+        if self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._health_loop, name='pr-agent-health')
+            self._health_thread.daemon = True
+            self._health_thread.start()
+
+    def _health_loop(self):
+        """定期检查空闲容器，移除已退出或需要回收的容器并补齐"""
+        while True:
+            time.sleep(self.health_interval)
+            checked = []
+            while True:
+                try:
+                    checked.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            for container in checked:
+                if self._needs_recycle(container) or not self._is_healthy(container):
+                    print(f"♻️ 回收容器: {container.name}")
+                    self._remove_container(container)
+                else:
+                    self._idle.put(container)
+            while True:
+                try:
+                    container = self._start_container()
+                except Exception as e:
+                    print(f"⚠️ 补充 PR-Agent 容器失败: {e}")
+                    break
+                if container is None:
+                    break
+                self._idle.put(container)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'containers': len(self._containers),
+                'busy': self._busy,
+                'idle': self._idle.qsize(),
+                'recycled': self._recycled,
+                'max_jobs': self.max_jobs
+            }
+
+    def shutdown(self):
+        """删除池中所有容器"""
+        with self._lock:
+            containers = list(self._containers.values())
+        for container in containers:
+            self._remove_container(container)
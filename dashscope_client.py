@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+通义千问（DashScope）文本生成客户端
+支持流式输出：逐段回调生成的内容，记录首字延迟，并可在生成过程中取消；
+每个 API Key 使用独立的限流器，收到 429 时按 Retry-After 等待后重试
+"""
+
+import hashlib
+import json
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from metrics import registry
+from rate_limiter import THROTTLE_STATUS, LimiterRegistry
+
+DASHSCOPE_URL = 'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation'
+
+# (连接超时, 读取超时)；流式模式下读取超时是两段输出之间的最长等待时间
+DEFAULT_TIMEOUT = (10, 120)
+
+# 收到 429 后最多重试的次数
+RATE_LIMIT_RETRIES = 3
+
+# 每个 (主机, API Key) 的限流器；latency_target 为首字延迟的目标秒数
+limiters = LimiterRegistry(rate=2, burst=5, concurrency=4, max_concurrency=16, latency_target=20)
+
+REQUEST_DURATION = registry.histogram(
+    'dashscope_request_duration_seconds', 'DashScope 生成耗时（秒，包含限流等待和重试）', ('model', 'outcome')
+)
+TTFT = registry.histogram('dashscope_ttft_seconds', 'DashScope 首字延迟（秒）', ('model',))
+
+# 直接连接 DashScope，不使用系统代理
+_session = requests.Session()
+_session.trust_env = False
+
+
+class GenerationCancelled(Exception):
+    """生成过程被取消"""
+
+
+class DashScopeError(Exception):
+    """DashScope 返回了错误响应"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f'AI 审查失败: {status_code} - {message}')
+        self.status_code = status_code
+
+
+def normalize_model(model):
+    """去掉 model 的 openai/ 前缀（PR-Agent 配置格式）"""
+    if model.startswith('openai/'):
+        return model.replace('openai/', '')
+    return model
+
+
+def limiter_for(api_key):
+    """返回 API Key 对应的限流器（名称中只包含 Key 的摘要）"""
+    digest = hashlib.sha256(api_key.encode()).hexdigest()[:8]
+    return limiters.get(f"{urlparse(DASHSCOPE_URL).netloc}#{digest}")
+
+
+def generate(api_key, model, prompt, stream=True, on_delta=None, cancel_event=None, timeout=DEFAULT_TIMEOUT):
+    """调用 DashScope 生成审查内容
+
+    Args:
+        api_key: DashScope API Key
+        model: 模型名称
+        prompt: 用户消息
+        stream: 是否使用流式输出
+        on_delta: 流式模式下每收到一段内容时调用 on_delta(已生成的全部内容)
+        cancel_event: threading.Event，被设置时中止生成并抛出 GenerationCancelled
+
+    Returns:
+        {'content': 完整内容, 'ttft': 首字延迟（秒）, 'elapsed': 总耗时（秒）}
+    """
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    parameters = {'result_format': 'message'}
+    if stream:
+        headers['X-DashScope-SSE'] = 'enable'
+        parameters['incremental_output'] = True
+
+    body = {
+        'model': model,
+        'input': {'messages': [{'role': 'user', 'content': prompt}]},
+        'parameters': parameters
+    }
+    limiter = limiter_for(api_key)
+    start = time.time()
+    outcome = 'error'
+
+    try:
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled('审查已取消')
+            # 流式输出期间一直占用并发槽位
+            with limiter.slot():
+                request_start = time.time()
+                response = _session.post(DASHSCOPE_URL, headers=headers, json=body, stream=stream, timeout=timeout)
+                # 非流式响应的耗时包含整个生成过程，不作为延迟信号
+                latency = time.time() - request_start if stream else 0
+                wait = limiter.record(response.status_code, latency, response.headers.get('Retry-After'))
+                if wait is not None and attempt < RATE_LIMIT_RETRIES:
+                    response.close()
+                    print(f"⏳ DashScope 限流（{response.status_code}），{wait:.0f}s 后重试（第 {attempt + 1} 次）")
+                    continue
+                result = _read_response(response, stream, start, on_delta, cancel_event)
+                outcome = 'success'
+                if stream:
+                    TTFT.observe(result['ttft'], model=model)
+                return result
+    except GenerationCancelled:
+        outcome = 'cancelled'
+        raise
+    except DashScopeError as e:
+        outcome = 'throttled' if e.status_code in THROTTLE_STATUS else 'error'
+        raise
+    except requests.Timeout:
+        outcome = 'timeout'
+        raise
+    finally:
+        REQUEST_DURATION.observe(time.time() - start, model=model, outcome=outcome)
+
+
+def _read_response(response, stream, start, on_delta=None, cancel_event=None):
+    """读取生成结果（流式或非流式），最后关闭响应"""
+    try:
+        if response.status_code != 200:
+            raise DashScopeError(response.status_code, response.text)
+
+        if not stream:
+            content = response.json()['output']['choices'][0]['message']['content']
+            elapsed = time.time() - start
+            return {'content': content, 'ttft': elapsed, 'elapsed': elapsed}
+
+        content = ''
+        ttft = None
+        # chunk_size=None：数据到达即处理，不等待凑满缓冲区
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled('审查已取消')
+            if not line or not line.startswith('data:'):
+                continue
+
+            chunk = json.loads(line[5:])
+            if 'output' not in chunk:
+                # 流中途的错误消息，例如 {"code": "...", "message": "..."}
+                raise DashScopeError(chunk.get('code', 'error'), chunk.get('message', line))
+
+            delta = chunk['output']['choices'][0]['message'].get('content', '')
+            if not delta:
+                continue
+            if ttft is None:
+                ttft = time.time() - start
+            content += delta
+            if on_delta:
+                on_delta(content)
+
+        elapsed = time.time() - start
+        return {'content': content, 'ttft': ttft if ttft is not None else elapsed, 'elapsed': elapsed}
+    finally:
+        response.close()
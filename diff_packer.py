@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Diff 打包
+按 Token 预算把 Commit 的文件变更打包成一个或多个审查片段：
+源码优先、改动大的文件优先，超出预算的文件按 hunk（@@ 块）拆分
+"""
+
+import re
+
+# 生成文件、依赖锁文件等，只列出文件名和变更行数，不送审内容
+GENERATED_PATTERNS = [
+    re.compile(p) for p in (
+        r'(^|/)(package-lock\.json|yarn\.lock|pnpm-lock\.yaml|Podfile\.lock|Gemfile\.lock|'
+        r'Cargo\.lock|poetry\.lock|composer\.lock|go\.sum)$',
+        r'\.min\.(js|css)$',
+        r'\.(map|svg|pbxproj|xcworkspacedata|storyboard|xib)$',
+        r'(_pb2\.py|\.pb\.go|\.g\.dart|\.generated\.\w+)$',
+        r'(^|/)(dist|build|vendor|node_modules|Pods|Carthage)/',
+    )
+]
+
+
+def estimate_tokens(text):
+    """粗略估算 Token 数：ASCII 约 4 个字符一个 Token，中文等约 1 个字符一个 Token"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def is_generated(path):
+    return any(pattern.search(path) for pattern in GENERATED_PATTERNS)
+
+
+def count_changed_lines(diff):
+    """统计 diff 中新增和删除的行数"""
+    added = removed = 0
+    for line in diff.splitlines():
+        if line.startswith('+') and not line.startswith('+++'):
+            added += 1
+        elif line.startswith('-') and not line.startswith('---'):
+            removed += 1
+    return added, removed
+
+
+def split_hunks(diff):
+    """按 @@ 行把文件 diff 拆分为 hunk 列表"""
+    hunks = []
+    current = []
+    for line in diff.splitlines(keepends=True):
+        if line.startswith('@@') and current:
+            hunks.append(''.join(current))
+            current = []
+        current.append(line)
+    if current:
+        hunks.append(''.join(current))
+    return hunks
+
+
+def _split_oversized(text, budget):
+    """单个 hunk 超出预算时按行切分"""
+    parts = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        if current and estimate_tokens(current + line) > budget:
+            parts.append(current)
+            current = ''
+        current += line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _file_sections(diff, budget):
+    """把一个文件的变更拆成不超过预算的若干段，返回 [(标题, 内容)]"""
+    path = diff.get('new_path') or diff.get('old_path', '')
+    text = diff.get('diff', '')
+    added, removed = count_changed_lines(text)
+    header = f"\n\n文件: {path}\n变更: +{added} -{removed}\n"
+    if estimate_tokens(header + text) <= budget:
+        return [(header, text)]
+
+    pieces = []
+    for hunk in split_hunks(text):
+        if estimate_tokens(header + hunk) > budget:
+            pieces.extend(_split_oversized(hunk, budget - estimate_tokens(header)))
+        else:
+            pieces.append(hunk)
+
+    # 相邻的 hunk 合并到预算上限
+    sections = []
+    current = ''
+    for piece in pieces:
+        if current and estimate_tokens(header + current + piece) > budget:
+            sections.append(current)
+            current = ''
+        current += piece
+    if current:
+        sections.append(current)
+
+    total = len(sections)
+    return [
+        (f"\n\n文件: {path}（第 {i}/{total} 部分）\n变更: +{added} -{removed}\n", section)
+        for i, section in enumerate(sections, 1)
+    ]
+
+
+def order_diffs(diffs):
+    """按审查价值排序：源码在前、生成文件在后，改动行数多的在前，删除的文件靠后"""
+    def sort_key(diff):
+        path = diff.get('new_path') or diff.get('old_path', '')
+        added, removed = count_changed_lines(diff.get('diff', ''))
+        return (is_generated(path), bool(diff.get('deleted_file')), -(added + removed), path)
+    return sorted(diffs, key=sort_key)
+
+
+def pack_diffs(diffs, budget_tokens, max_chunks):
+    """把文件变更打包为审查片段
+
+    Returns:
+        {
+            'chunks': [片段文本],
+            'skipped': [生成文件或二进制文件说明],
+            'omitted': [超出片段数量上限、未审查或未完整审查的文件]
+        }
+    """
+    chunks = []
+    skipped = []
+    omitted = []
+    current = ''
+
+    for diff in order_diffs(diffs):
+        path = diff.get('new_path') or diff.get('old_path', '')
+        text = diff.get('diff', '')
+        if is_generated(path) or not text.strip():
+            added, removed = count_changed_lines(text)
+            reason = '生成文件' if text.strip() else '二进制文件或无内容变更'
+            skipped.append(f"{path}（{reason}，+{added} -{removed}）")
+            continue
+
+        for header, body in _file_sections(diff, budget_tokens):
+            section = header + body
+            if current and estimate_tokens(current + section) > budget_tokens:
+                chunks.append(current)
+                current = ''
+            if len(chunks) >= max_chunks:
+                omitted.append(path)
+                break
+            current += section
+
+    if current and len(chunks) < max_chunks:
+        chunks.append(current)
+
+    return {
+        'chunks': chunks,
+        'skipped': skipped,
+        # 同一文件的多个部分只列一次
+        'omitted': list(dict.fromkeys(omitted))
+    }
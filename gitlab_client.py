@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+GitLab API 客户端
+每个 (GitLab 地址, Token) 共用一个带连接池的 requests.Session，
+统一处理超时、5xx/429 重试、按主机限流、项目路径编码和列表接口的条件请求缓存
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qsl, quote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+from metrics import registry
+from rate_limiter import THROTTLE_STATUS, LimiterRegistry
+
+# 默认超时：(连接超时, 读取超时)
+DEFAULT_TIMEOUT = (5, 30)
+
+# 连接池大小，需不小于并发访问 GitLab 的线程数
+POOL_MAXSIZE = 32
+
+# 列表接口每页条数（GitLab 上限为 100）
+PER_PAGE = 100
+
+# 可缓存的 GET 接口：(名称, 路径, 缓存时间秒)
+# 缓存时间内直接使用内存中的响应；过期后带 If-None-Match 重新验证，GitLab 返回 304 时继续使用
+CACHE_RULES = [
+    ('projects', re.compile(r'^/projects$'), 60),
+    ('groups', re.compile(r'^/groups$'), 300),
+    ('group_projects', re.compile(r'^/groups/[^/]+/projects$'), 120),
+    ('branches', re.compile(r'^/projects/[^/]+/repository/branches$'), 30),
+    ('merge_requests', re.compile(r'^/projects/[^/]+/merge_requests$'), 0),
+]
+
+
+# 路径中这些集合后面的一段是 ID、路径或名称，统计指标时替换为 :id
+ENDPOINT_COLLECTIONS = {
+    'projects', 'groups', 'users', 'merge_requests', 'commits', 'hooks',
+    'branches', 'tags', 'notes', 'discussions', 'pipelines', 'jobs', 'issues'
+}
+
+REQUEST_DURATION = registry.histogram(
+    'gitlab_request_duration_seconds', 'GitLab API 请求耗时（秒）', ('method', 'endpoint', 'status')
+)
+REQUEST_ERRORS = registry.counter(
+    'gitlab_request_errors_total', 'GitLab API 请求异常次数', ('method', 'endpoint', 'error')
+)
+
+# 每个 GitLab 主机的限流器；latency_target 为单次请求的目标耗时（秒）
+limiters = LimiterRegistry(rate=20, burst=40, concurrency=16, max_concurrency=32, latency_target=10)
+
+
+def encode_project(project):
+    """将项目 ID 或路径编码为 API 路径参数，例如 ios/IKStaff -> ios%2FIKStaff"""
+    return quote(str(project), safe='')
+
+
+def project_path_from_url(gitlab_url, project_url):
+    """从项目 URL 提取项目路径
+
+    例如: http://gitlab.it.ikang.com/ios/IKStaff -> ios/IKStaff
+    """
+    return project_url.replace(gitlab_url.rstrip('/') + '/', '').strip('/')
+
+
+def token_scope(base_url, token):
+    """GitLab 地址 + Token 的摘要，用于按 Token 隔离缓存和索引（不保存 Token 本身）"""
+    return hashlib.sha256(f"{base_url.rstrip('/')}|{token or ''}".encode()).hexdigest()[:16]
+
+
+def is_timeout_error(error):
+    """判断请求异常是否由超时引起
+
+    GET 请求超时会先被自动重试，重试耗尽后 requests 抛出的是 ConnectionError，
+    需要检查其中包装的 urllib3 异常。
+    """
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (ConnectTimeoutError, ReadTimeoutError))
+
+
+def endpoint_template(path):
+    """把请求路径转换为接口模板，例如 /projects/ios%2FIKStaff/merge_requests/5/commits
+    -> /projects/:id/merge_requests/:id/commits，避免指标的标签数量无限增长"""
+    segments = path.split('?', 1)[0].strip('/').split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ENDPOINT_COLLECTIONS and segments[i] not in ENDPOINT_COLLECTIONS:
+            segments[i] = ':id'
+    return '/' + '/'.join(segments)
+
+
+def match_cache_rule(path):
+    """返回 path 对应的缓存规则 (名称, 缓存时间)，不可缓存时返回 None"""
+    for name, pattern, ttl in CACHE_RULES:
+        if pattern.match(path):
+            return name, ttl
+    return None
+
+
+class ResponseCache:
+    """GitLab GET 响应的 LRU 缓存，按接口统计命中情况
+
+    缓存键包含 Token 的摘要，不同 Token 的响应互不可见。
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+            return entry
+
+    def store(self, key, entry):
+        with self._lock:
+            self._items[key] = entry
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def record(self, rule_name, outcome):
+        """记录一次查询结果：hit（未过期直接使用）、revalidated（304）、miss"""
+        with self._lock:
+            counters = self._counters.setdefault(rule_name, {'hit': 0, 'revalidated': 0, 'miss': 0})
+            counters[outcome] += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'maxsize': self.maxsize,
+                'endpoints': {name: dict(counters) for name, counters in self._counters.items()}
+            }
+
+
+# 所有客户端共用的响应缓存
+response_cache = ResponseCache()
+
+
+def _cached_response(entry):
+    """用缓存内容构造 requests.Response"""
+    response = requests.Response()
+    response.status_code = entry['status_code']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.url = entry['url']
+    response.encoding = entry['encoding']
+    response._content = entry['content']
+    return response
+
+
+class GitLabClient:
+    """GitLab REST API v4 客户端"""
+
+    def __init__(self, base_url, token, timeout=DEFAULT_TIMEOUT, retries=3, cache=response_cache):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+        self.limiter = limiters.get(urlparse(self.base_url).netloc)
+        # 缓存键和 Webhook 索引使用 Token 的摘要，不保存 Token 本身
+        self.scope = token_scope(self.base_url, token)
+
+        # 限流响应（429/503）不由 urllib3 重试，而是在 request() 中经过限流器等待后重试，
+        # 这样 AIMD 并发控制能看到每一次限流，延迟样本也不包含重试的等待时间
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 504),
+            # POST 不是幂等操作（发布评论、添加 Webhook），不自动重试
+            allowed_methods=frozenset(['GET', 'HEAD', 'PUT', 'DELETE']),
+            # 带 Retry-After 的 429/503 也会被 urllib3 重试，需要关闭
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if token:
+            self.session.headers['PRIVATE-TOKEN'] = token
+
+    def api_url(self, path):
+        """拼接 API 地址，path 形如 /projects/123/hooks"""
+        return f"{self.base_url}/api/v4{path}"
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.api_url(path)
+        endpoint = endpoint_template(path)
+        for attempt in range(self.retries + 1):
+            with self.limiter.slot():
+                start = time.time()
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.RequestException as e:
+                    error = 'timeout' if is_timeout_error(e) else 'connection'
+                    REQUEST_ERRORS.inc(method=method, endpoint=endpoint, error=error)
+                    raise
+            elapsed = time.time() - start
+            REQUEST_DURATION.observe(elapsed, method=method, endpoint=endpoint, status=response.status_code)
+            wait = self.limiter.record(response.status_code, elapsed, response.headers.get('Retry-After'))
+            # 限流时令牌桶已按 Retry-After 暂停，下一次 slot() 会等到暂停结束。
+            # 429 表示请求未被处理，所有方法都可以重试；POST 不是幂等操作，503 时不重试
+            retryable = response.status_code == 429 or (response.status_code in THROTTLE_STATUS and method != 'POST')
+            if wait is None or not retryable or attempt >= self.retries:
+                return response
+            response.close()
+        return response
+
+    def get(self, path, cache=True, **kwargs):
+        """GET 请求；CACHE_RULES 中的列表接口会使用响应缓存，cache=False 时跳过"""
+        rule = match_cache_rule(path) if cache and self.cache is not None else None
+        if rule is None:
+            return self.request('GET', path, **kwargs)
+        return self._cached_get(rule, path, kwargs)
+
+    def _cached_get(self, rule, path, kwargs):
+        rule_name, ttl = rule
+        params = kwargs.get('params') or {}
+        key = (self.scope, path, tuple(sorted((k, str(v)) for k, v in params.items())))
+        entry = self.cache.lookup(key)
+        now = time.time()
+
+        if entry is not None and now - entry['stored_at'] < ttl:
+            self.cache.record(rule_name, 'hit')
+            return _cached_response(entry)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        response = self.request('GET', path, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.store(key, dict(entry, stored_at=now))
+            self.cache.record(rule_name, 'revalidated')
+            return _cached_response(entry)
+
+        self.cache.record(rule_name, 'miss')
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and (etag or ttl > 0):
+            self.cache.store(key, {
+                'status_code': response.status_code,
+                'headers': dict(response.headers),
+                'url': response.url,
+                'encoding': response.encoding,
+                'content': response.content,
+                'etag': etag,
+                'stored_at': now
+            })
+        return response
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+
+def paginate(client, path, params=None, executor=None, max_items=None, keyset_order_by=None, window=4):
+    """逐条返回 GitLab 列表接口的全部结果（生成器）
+
+    先请求第一页：响应带 X-Total-Pages 时，其余页面通过 executor 并发获取
+    （最多提前获取 window 页），仍按页码顺序返回。结果超过 10000 条时 GitLab
+    不返回总页数，此时支持 keyset 分页的接口（传入 keyset_order_by）改用 keyset
+    分页，其他接口按 X-Next-Page 逐页获取。
+
+    Args:
+        client: GitLabClient
+        path: 接口路径，例如 /groups/123/projects
+        params: 查询参数，page / per_page 由本函数设置
+        executor: 并发获取页面的线程池；不传时逐页获取。
+                  不要在该线程池的任务内传入同一个线程池，否则可能互相等待
+        max_items: 最多返回的条数
+        keyset_order_by: 接口支持 keyset 分页时的排序字段（如 /projects 的 id）
+        window: 同时获取的最大页数
+    """
+    params = dict(params or {})
+    params['per_page'] = PER_PAGE
+    count = 0
+
+    for items in _iter_pages(client, path, params, executor, max_items, keyset_order_by, window):
+        for item in items:
+            yield item
+            count += 1
+            if max_items is not None and count >= max_items:
+                return
+
+
+def _fetch_page(client, path, params, page):
+    response = client.get(path, params=dict(params, page=page))
+    response.raise_for_status()
+    return response
+
+
+def _iter_pages(client, path, params, executor, max_items, keyset_order_by, window):
+    """按顺序返回每一页的结果列表"""
+    first = _fetch_page(client, path, params, 1)
+    first_items = first.json()
+    yield first_items
+    if len(first_items) < PER_PAGE:
+        return
+
+    total_pages = first.headers.get('X-Total-Pages')
+    if total_pages:
+        last_page = int(total_pages)
+        if max_items is not None:
+            last_page = min(last_page, -(-max_items // PER_PAGE))
+        pages = range(2, last_page + 1)
+        if executor is None:
+            for page in pages:
+                yield _fetch_page(client, path, params, page).json()
+        else:
+            yield from _fetch_pages_concurrently(client, path, params, pages, executor, window)
+    elif keyset_order_by:
+        # 第一页已返回的条目在 keyset 结果中会再次出现，按 id 跳过
+        seen = {item['id'] for item in first_items}
+        for items in _iter_keyset_pages(client, path, params, keyset_order_by):
+            yield [item for item in items if item['id'] not in seen]
+    else:
+        page = first.headers.get('X-Next-Page') or 2
+        while page:
+            response = _fetch_page(client, path, params, int(page))
+            items = response.json()
+            yield items
+            if len(items) < PER_PAGE:
+                return
+            page = response.headers.get('X-Next-Page') or int(page) + 1
+
+
+def _fetch_pages_concurrently(client, path, params, pages, executor, window):
+    pending = deque()
+    page_iter = iter(pages)
+
+    def refill():
+        while len(pending) < window:
+            page = next(page_iter, None)
+            if page is None:
+                return
+            pending.append(executor.submit(_fetch_page, client, path, params, page))
+
+    try:
+        refill()
+        while pending:
+            response = pending.popleft().result()
+            refill()
+            yield response.json()
+    finally:
+        # 调用方提前停止迭代时取消尚未开始的请求
+        for future in pending:
+            future.cancel()
+
+
+def _iter_keyset_pages(client, path, params, order_by):
+    """keyset 分页：按响应头 Link 中的 next 地址逐页获取"""
+    keyset_params = {k: v for k, v in params.items() if k not in ('order_by', 'sort', 'page')}
+    keyset_params.update({'pagination': 'keyset', 'order_by': order_by, 'sort': 'asc'})
+    response = client.get(path, params=keyset_params)
+    while True:
+        response.raise_for_status()
+        yield response.json()
+        next_link = response.links.get('next', {}).get('url')
+        if not next_link:
+            return
+        # next 地址拆成 API 路径和游标参数，仍经 client.get 发出，走限流、指标和 429 重试
+        parsed = urlparse(next_link)
+        next_path = parsed.path.split('/api/v4', 1)[-1]
+        response = client.get(next_path, cache=False, params=dict(parse_qsl(parsed.query)))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, token):
+    """获取 (GitLab 地址, Token) 对应的共享客户端"""
+    key = (base_url.rstrip('/'), token)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = GitLabClient(base_url, token)
+            _clients[key] = client
+        return client
@@ -0,0 +1,31 @@
+"""
+gunicorn 配置
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('PR_AGENT_BIND', '0.0.0.0:8080')
+
+# 进程数默认等于 CPU 核数
+workers = int(os.environ.get('PR_AGENT_WEB_WORKERS', multiprocessing.cpu_count()))
+
+# SSE 长连接会一直占用线程，使用多线程 worker
+worker_class = 'gthread'
+threads = int(os.environ.get('PR_AGENT_WEB_THREADS', 16))
+
+# 在主进程中导入应用后再 fork，各进程共享只读内存，启动更快
+preload_app = True
+
+timeout = 120
+graceful_timeout = 30
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    """worker 启动后开始写入进程指标，并参与后台任务的选主，只有一个进程运行后台线程"""
+    import wsgi
+    wsgi.dashboard.enable_shared_metrics()
+    wsgi.dashboard.start_background_services_leader()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+持久化审查任务队列
+审查任务保存在 reviews.db 的 review_jobs 表中，服务重启后未完成的任务会继续执行。
+领取任务时先按优先级，再优先选择最近开始执行任务最少的项目（按项目公平分配）
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+# 被同一对象（如同一个 MR）更新的任务取代，不再执行
+JOB_SUPERSEDED = 'superseded'
+
+
+class JobQueue:
+    """基于 SQLite 的审查任务队列（租约 + 重试）"""
+
+    def __init__(self, db_file, lease_seconds=900, max_attempts=3, retry_delay=30, fair_window=600,
+                 journal_mode='WAL'):
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # 按项目公平分配时统计最近 fair_window 秒内各项目开始执行的任务数
+        self.fair_window = fair_window
+        # 多台机器通过网络文件系统共享数据库时 WAL 不可用，需要改为 DELETE
+        self.journal_mode = journal_mode
+
+    @property
+    def owner(self):
+        """当前进程标识：主机名 + 进程号（gunicorn 预加载后 fork 的 worker 各不相同）"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        """创建任务表"""
+        conn = self._connect()
+        # WAL 模式允许读写并发，Webhook 入队不会被任务领取阻塞
+        conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS review_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                available_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                coalesce_key TEXT,
+                priority INTEGER NOT NULL DEFAULT 2,
+                project_key TEXT,
+                started_at REAL
+            )
+        ''')
+        # 旧版本的任务表缺少合并键、优先级和项目字段
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(review_jobs)')}
+        for column, definition in (
+            ('coalesce_key', 'TEXT'),
+            ('priority', 'INTEGER NOT NULL DEFAULT 2'),
+            ('project_key', 'TEXT'),
+            ('started_at', 'REAL')
+        ):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE review_jobs ADD COLUMN {column} {definition}')
+        # 旧任务从 payload 中补上项目字段，否则不参与按项目公平分配
+        conn.execute('''
+            UPDATE review_jobs
+            SET project_key = CAST(json_extract(payload, '$.project.id') AS TEXT)
+            WHERE (project_key IS NULL OR project_key = '')
+              AND json_valid(payload) AND json_extract(payload, '$.project.id') IS NOT NULL
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_review_jobs_status
+            ON review_jobs (status, kind, available_at)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_review_jobs_coalesce
+            ON review_jobs (coalesce_key, status)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_review_jobs_project
+            ON review_jobs (project_key, started_at)
+        ''')
+        conn.commit()
+        conn.close()
+
+    def enqueue(self, kind, payload):
+        """写入一个新任务，payload 为原始 Webhook 数据"""
+        now = time.time()
+        conn = self._connect()
+        cursor = conn.execute('''
+            INSERT INTO review_jobs (kind, status, payload, available_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (kind, JOB_QUEUED, json.dumps(payload, ensure_ascii=False), now, now, now))
+        job_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return job_id
+
+    def enqueue_many(self, jobs):
+        """在一个事务中写入多个任务
+
+        jobs 为字典列表，包含 kind、payload，以及可选的：
+            coalesce_key: 不为空时，同一合并键下仍在排队的旧任务标记为 superseded，
+                          配合 delay 使短时间内的多次事件只执行最后一次
+            delay: 延迟执行的秒数
+            priority: 优先级，数字越小越先执行
+            project_key: 所属项目，用于按项目公平分配
+        """
+        if not jobs:
+            return
+        now = time.time()
+        conn = self._connect()
+        for job in jobs:
+            coalesce_key = job.get('coalesce_key')
+            if coalesce_key:
+                conn.execute('''
+                    UPDATE review_jobs SET status = ?, updated_at = ?
+                    WHERE coalesce_key = ? AND status = ?
+                ''', (JOB_SUPERSEDED, now, coalesce_key, JOB_QUEUED))
+            conn.execute('''
+                INSERT INTO review_jobs
+                    (kind, status, payload, available_at, created_at, updated_at, coalesce_key, priority, project_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                job['kind'], JOB_QUEUED, json.dumps(job['payload'], ensure_ascii=False),
+                now + job.get('delay', 0), now, now, coalesce_key, job.get('priority', 2), job.get('project_key')
+            ))
+        conn.commit()
+        conn.close()
+
+    def has_newer(self, job):
+        """同一合并键下是否有更新的未完成任务（当前任务已被取代）"""
+        if not job.get('coalesce_key'):
+            return False
+        conn = self._connect()
+        row = conn.execute('''
+            SELECT 1 FROM review_jobs
+            WHERE coalesce_key = ? AND id > ? AND status IN (?, ?)
+            LIMIT 1
+        ''', (job['coalesce_key'], job['id'], JOB_QUEUED, JOB_RUNNING)).fetchone()
+        conn.close()
+        return row is not None
+
+    def claim(self, kind):
+        """领取一个可执行的任务
+
+        可执行的任务包括：到达执行时间的排队任务，以及租约已过期的运行中任务
+        （持有它的进程已崩溃或重启）。先按优先级，再选择最近 fair_window 秒内
+        开始执行任务最少的项目，最后按写入顺序。没有任务时返回 None。
+
+        每次领取生成新的租约令牌，保存在 lease_owner 中并随任务返回；
+        renew / complete / fail / supersede 需要传入该令牌，
+        同一进程重新领取自己过期的任务时，旧的执行也无法再修改任务状态。
+        """
+        now = time.time()
+        lease = f"{self.owner}:{uuid.uuid4().hex}"
+        conn = self._connect()
+        try:
+            # IMMEDIATE 事务保证多个进程不会领取到同一个任务
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('''
+                SELECT * FROM review_jobs j
+                WHERE kind = ?
+                  AND ((status = ? AND available_at <= ?)
+                       OR (status = ? AND lease_expires < ?))
+                ORDER BY priority,
+                         CASE WHEN j.project_key IS NULL OR j.project_key = '' THEN 0
+                              ELSE (SELECT COUNT(*) FROM review_jobs r
+                                    WHERE r.project_key = j.project_key AND r.started_at >= ?)
+                         END,
+                         id
+                LIMIT 1
+            ''', (kind, JOB_QUEUED, now, JOB_RUNNING, now, now - self.fair_window)).fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            conn.execute('''
+                UPDATE review_jobs
+                SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?,
+                    started_at = ?, updated_at = ?
+                WHERE id = ?
+            ''', (JOB_RUNNING, lease, now + self.lease_seconds, now, now, row['id']))
+            conn.commit()
+            job = dict(row)
+            job['attempts'] += 1
+            job['lease_owner'] = lease
+            job['payload'] = json.loads(job['payload'])
+            return job
+        finally:
+            conn.close()
+
+    def renew(self, job_id, lease):
+        """延长执行中任务的租约，返回 False 表示租约已失效（任务已被重新领取）"""
+        now = time.time()
+        conn = self._connect()
+        cursor = conn.execute('''
+            UPDATE review_jobs SET lease_expires = ?, updated_at = ?
+            WHERE id = ? AND status = ? AND lease_owner = ?
+        ''', (now + self.lease_seconds, now, job_id, JOB_RUNNING, lease))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount > 0
+
+    def complete(self, job_id, lease):
+        """标记任务完成；返回 False 表示租约已失效，状态未修改"""
+        return self._update(job_id, lease, JOB_DONE)
+
+    def supersede(self, job_id, lease):
+        """标记执行中的任务已被更新的任务取代"""
+        return self._update(job_id, lease, JOB_SUPERSEDED)
+
+    def fail(self, job_id, lease, error, attempts):
+        """任务失败：未超过重试次数则延迟后重新排队，否则标记为失败
+
+        Returns:
+            True 表示不再重试；租约已失效时不修改状态，返回 None
+        """
+        if attempts < self.max_attempts:
+            delay = self.retry_delay * attempts
+            if not self._update(job_id, lease, JOB_QUEUED, error, available_at=time.time() + delay):
+                return None
+            return False
+        if not self._update(job_id, lease, JOB_FAILED, error):
+            return None
+        return True
+
+    def _update(self, job_id, lease, status, error=None, available_at=None):
+        """更新持有租约 lease 的运行中任务；租约过期后被重新领取的任务不会被覆盖"""
+        now = time.time()
+        conn = self._connect()
+        cursor = conn.execute('''
+            UPDATE review_jobs
+            SET status = ?, last_error = COALESCE(?, last_error), lease_owner = NULL, lease_expires = NULL,
+                available_at = COALESCE(?, available_at), updated_at = ?
+            WHERE id = ? AND status = ? AND lease_owner = ?
+        ''', (status, error, available_at, now, job_id, JOB_RUNNING, lease))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount > 0
+
+    def pending_count(self):
+        """未完成（排队或运行中）的任务数量"""
+        conn = self._connect()
+        count = conn.execute(
+            'SELECT COUNT(*) FROM review_jobs WHERE status IN (?, ?)',
+            (JOB_QUEUED, JOB_RUNNING)
+        ).fetchone()[0]
+        conn.close()
+        return count
+
+    def stats(self):
+        """按状态统计任务数量"""
+        conn = self._connect()
+        rows = conn.execute('SELECT status, COUNT(*) FROM review_jobs GROUP BY status').fetchall()
+        conn.close()
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0, JOB_SUPERSEDED: 0}
+        for status, count in rows:
+            counts[status] = count
+        return counts
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Prometheus 指标
+轻量的计数器、直方图和按需计算的采集函数，/metrics 以 Prometheus 文本格式输出。
+多进程部署时每个进程定期把自己的指标写入共享目录，输出时合并所有进程的数据
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+# 默认的耗时分桶（秒），覆盖 GitLab 接口（毫秒级）到 PR-Agent 审查（分钟级）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _labels_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """只增的计数器"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+
+class Histogram:
+    """分桶直方图，每个标签组合保存各桶计数、总和与次数"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _labels_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # 各桶的计数（最后一个为 +Inf）、总和、次数
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        """上下文管理器：记录代码块的耗时"""
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): list(series) for key, series in self._values.items()}
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Collector:
+    """输出时才计算数值的指标（队列长度、缓存统计等）
+
+    collect 返回 [(标签字典, 数值)]。merge 指定多进程合并方式：
+    sum 表示各进程的值相加（如进程内的线程池、缓存命中次数），
+    max 表示各进程看到的是同一个全局值（如任务表中的任务数），取最大值。
+    """
+
+    def __init__(self, name, help_text, kind, labelnames, collect, merge='sum'):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.merge = merge
+
+    def snapshot(self):
+        try:
+            samples = self.collect()
+        except Exception as e:
+            print(f"⚠️ 采集指标 {self.name} 失败: {e}")
+            return {}
+        return {json.dumps(_labels_key(self.labelnames, labels)): value for labels, value in samples}
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        # 多进程模式下保存各进程指标的目录
+        self.shared_dir = None
+        self.write_interval = 5
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def collector(self, name, help_text, kind='gauge', labelnames=(), collect=None, merge='sum'):
+        return self._register(Collector(name, help_text, kind, labelnames, collect, merge))
+
+    def snapshot(self):
+        """当前进程所有指标的数值"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            'pid': os.getpid(),
+            'written_at': time.time(),
+            'metrics': {metric.name: metric.snapshot() for metric in metrics}
+        }
+
+    def enable_multiprocess(self, shared_dir, interval=5):
+        """多进程模式：定期把当前进程的指标写入 shared_dir/metrics-<pid>.json"""
+        self.shared_dir = shared_dir
+        self.write_interval = interval
+        os.makedirs(shared_dir, exist_ok=True)
+
+        def loop():
+            while True:
+                try:
+                    self._write_snapshot()
+                except Exception as e:
+                    print(f"⚠️ 写入指标文件失败: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name='metrics-writer', daemon=True).start()
+
+    @staticmethod
+    def reset_multiprocess(shared_dir):
+        """删除 shared_dir 中上次运行留下的进程指标文件（服务重启时调用，计数器从 0 开始）"""
+        if not os.path.isdir(shared_dir):
+            return
+        for filename in os.listdir(shared_dir):
+            if filename.startswith('metrics-'):
+                try:
+                    os.remove(os.path.join(shared_dir, filename))
+                except OSError:
+                    pass
+
+    def _write_snapshot(self):
+        snapshot = self.snapshot()
+        path = os.path.join(self.shared_dir, f"metrics-{snapshot['pid']}.json")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+        return snapshot
+
+    def _snapshots(self):
+        if not self.shared_dir:
+            return [self.snapshot()]
+        own = self._write_snapshot()
+        snapshots = [own]
+        for filename in os.listdir(self.shared_dir):
+            if not filename.startswith('metrics-') or not filename.endswith('.json'):
+                continue
+            if filename == f"metrics-{own['pid']}.json":
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """以 Prometheus 文本格式输出所有指标
+
+        计数器和直方图累加所有进程（包括已退出的进程）的数据；
+        采集函数中 counter 类型的同样合并所有进程，避免进程重启后数值回落，
+        gauge 类型只使用最近仍在更新的进程。
+        """
+        snapshots = self._snapshots()
+        stale_before = time.time() - self.write_interval * 3
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            merged = {}
+            for snapshot in snapshots:
+                values = snapshot['metrics'].get(metric.name, {})
+                if isinstance(metric, Collector):
+                    if metric.kind == 'gauge' and snapshot['written_at'] < stale_before:
+                        continue
+                    for key, value in values.items():
+                        if metric.merge == 'max':
+                            merged[key] = max(merged.get(key, value), value)
+                        else:
+                            merged[key] = merged.get(key, 0) + value
+                elif isinstance(metric, Histogram):
+                    for key, series in values.items():
+                        current = merged.get(key)
+                        merged[key] = series if current is None else [a + b for a, b in zip(current, series)]
+                else:
+                    for key, value in values.items():
+                        merged[key] = merged.get(key, 0) + value
+
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for key_json, value in sorted(merged.items()):
+                key = tuple(json.loads(key_json))
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float('inf'),), value[:-2]):
+                        cumulative += count
+                        le = _format_labels(metric.labelnames, key, [('le', _format_value(bound))])
+                        lines.append(f'{metric.name}_bucket{le} {cumulative}')
+                    labels = _format_labels(metric.labelnames, key)
+                    lines.append(f'{metric.name}_sum{labels} {_format_value(value[-2])}')
+                    lines.append(f'{metric.name}_count{labels} {value[-1]}')
+                else:
+                    lines.append(f'{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# 全局注册表
+registry = Registry()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+外部接口限流
+每个限流器由令牌桶（限制请求速率，遵守 Retry-After）和 AIMD 并发控制
+（429 或延迟过高时并发减半，正常时逐步增加）组成，按 API Key / 主机分别创建
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+# 触发限流的状态码
+THROTTLE_STATUS = (429, 503)
+
+
+def parse_retry_after(value, default=None):
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，最多突发 burst 个；rate <= 0 时不限速"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """取得一个令牌，没有令牌或处于 Retry-After 等待期时阻塞"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self.rate <= 0:
+                        return
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """暂停发放令牌 seconds 秒（收到 Retry-After 时调用）"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': round(self._tokens, 2),
+                'paused_seconds': round(max(0.0, self._blocked_until - now), 2)
+            }
+
+
+class AIMDController:
+    """AIMD 并发控制：请求正常时每轮并发上限加 1，限流或延迟超过目标时减半
+
+    一次减半后 cooldown 秒内的其他限流响应不再重复减半（它们通常属于同一波请求）。
+    """
+
+    def __init__(self, initial, minimum=1, maximum=16, latency_target=None, cooldown=1.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.active = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency):
+        with self._cond:
+            if self.latency_target and latency > self.latency_target:
+                self._decrease()
+            else:
+                # 每个并发槽位完成一次请求后上限约增加 1
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def on_throttled(self):
+        with self._cond:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit / 2)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'active': self.active,
+                'minimum': self.minimum,
+                'maximum': self.maximum,
+                'latency_target': self.latency_target
+            }
+
+
+class RateLimiter:
+    """令牌桶 + AIMD 并发控制"""
+
+    def __init__(self, name, rate=10, burst=20, concurrency=4, max_concurrency=16,
+                 latency_target=None, default_backoff=5):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AIMDController(concurrency, maximum=max_concurrency, latency_target=latency_target)
+        # 限流响应没有 Retry-After 时的等待秒数
+        self.default_backoff = default_backoff
+        self._counters = {'requests': 0, 'throttled': 0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """取得令牌和并发槽位，离开时释放槽位"""
+        self.bucket.acquire()
+        self.concurrency.acquire()
+        try:
+            yield
+        finally:
+            self.concurrency.release()
+
+    def record(self, status_code, latency, retry_after=None):
+        """记录一次请求的结果，调整速率和并发上限
+
+        Returns:
+            限流时需要等待的秒数，未限流时返回 None
+        """
+        with self._lock:
+            self._counters['requests'] += 1
+            if status_code in THROTTLE_STATUS:
+                self._counters['throttled'] += 1
+        if status_code not in THROTTLE_STATUS:
+            self.concurrency.on_success(latency)
+            return None
+        wait = parse_retry_after(retry_after, self.default_backoff)
+        self.bucket.pause(wait)
+        self.concurrency.on_throttled()
+        return wait
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            'name': self.name,
+            'bucket': self.bucket.stats(),
+            'concurrency': self.concurrency.stats(),
+            **counters
+        }
+
+
+class LimiterRegistry:
+    """按名称创建和查找限流器，新建时使用 defaults 中的参数"""
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                limiter = self._limiters[name] = RateLimiter(name, **self.defaults)
+            return limiter
+
+    def reset(self):
+        """清空限流器，下次请求时按当前 defaults 重新创建"""
+        with self._lock:
+            self._limiters.clear()
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return [limiter.stats() for limiter in limiters]
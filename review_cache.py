@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+AI 审查结果缓存
+以规范化后的 diff 内容、模型、prompt 版本和审查方式计算缓存键，结果保存在 reviews.db 中。
+cherry-pick、rebase 后的 commit 以及推送到多个分支的同一补丁可以直接复用之前的审查结果
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+# hunk 头中的行号会随文件位置变化，规范化时去掉
+HUNK_HEADER = re.compile(r'^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@')
+
+
+def normalize_diff(diffs):
+    """规范化文件变更：按文件路径排序，去掉 hunk 行号和行尾空白"""
+    files = []
+    for diff in sorted(diffs, key=lambda d: (d.get('new_path') or '', d.get('old_path') or '')):
+        lines = [
+            HUNK_HEADER.sub('@@', line).rstrip()
+            for line in diff.get('diff', '').splitlines()
+        ]
+        files.append('\n'.join([
+            f"{diff.get('old_path', '')} -> {diff.get('new_path', '')}",
+            *lines
+        ]))
+    return '\n\0\n'.join(files)
+
+
+def review_cache_key(diffs, model, prompt_version, mode='commit', subject=''):
+    """计算缓存键：sha256(规范化 diff + 模型 + prompt 版本 + 审查方式 + 审查对象描述)
+
+    mode 区分单个 commit 审查（commit）和推送范围审查（push），两者的 prompt 不同，结果不能互相复用。
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{model}\n{prompt_version}\n{mode}\n{subject}\n".encode('utf-8'))
+    digest.update(normalize_diff(diffs).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ReviewCache:
+    """基于 SQLite 的审查结果缓存，按条数和保存时间淘汰"""
+
+    def __init__(self, db_file, max_entries=5000, max_age=30 * 86400):
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._hits = 0
+        self._misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        """创建缓存表"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ai_review_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                content TEXT NOT NULL,
+                source TEXT,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_ai_review_cache_used ON ai_review_cache (last_used_at)')
+        conn.commit()
+        conn.close()
+
+    def get(self, cache_key):
+        """返回未过期的缓存结果 {'content', 'source', 'created_at', 'hits'}，未命中时返回 None"""
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT content, source, created_at, hits FROM ai_review_cache WHERE cache_key = ? AND created_at >= ?',
+            (cache_key, now - self.max_age)
+        ).fetchone()
+        if row is None:
+            conn.close()
+            with self._stats_lock:
+                self._misses += 1
+            return None
+        conn.execute(
+            'UPDATE ai_review_cache SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?',
+            (now, cache_key)
+        )
+        conn.commit()
+        conn.close()
+        with self._stats_lock:
+            self._hits += 1
+        return dict(row)
+
+    def put(self, cache_key, model, prompt_version, content, source=''):
+        """保存审查结果，并淘汰过期和超出条数上限的记录"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('''
+            INSERT OR REPLACE INTO ai_review_cache
+                (cache_key, model, prompt_version, content, source, created_at, last_used_at, hits)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+        ''', (cache_key, model, str(prompt_version), content, source, now, now))
+        conn.execute('DELETE FROM ai_review_cache WHERE created_at < ?', (now - self.max_age,))
+        # 超出条数上限时删除最久未使用的记录
+        conn.execute('''
+            DELETE FROM ai_review_cache WHERE cache_key IN (
+                SELECT cache_key FROM ai_review_cache
+                ORDER BY last_used_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+        conn.commit()
+        conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT COUNT(*) AS entries, COALESCE(SUM(hits), 0) AS stored_hits FROM ai_review_cache'
+        ).fetchone()
+        conn.close()
+        return {
+            'entries': row['entries'],
+            'max_entries': self.max_entries,
+            'max_age': self.max_age,
+            'stored_hits': row['stored_hits'],
+            'hits': self._hits,
+            'misses': self._misses
+        }
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+审查任务线程池
+使用固定数量的工作线程执行审查任务，替代每个请求 / Webhook 单独创建线程。
+排队的任务按优先级执行（手动审查 > MR Webhook > Push Webhook > 历史补审），
+同一优先级内按项目轮流执行，避免一个项目的大量任务占满线程池
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+# 优先级（数字越小越先执行）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_MR_WEBHOOK = 1
+PRIORITY_PUSH_WEBHOOK = 2
+PRIORITY_BACKFILL = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_MR_WEBHOOK: 'mr_webhook',
+    PRIORITY_PUSH_WEBHOOK: 'push_webhook',
+    PRIORITY_BACKFILL: 'backfill'
+}
+
+
+class WaitStats:
+    """记录任务从提交到开始执行的等待时间"""
+
+    def __init__(self, samples=500):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=samples)
+
+    def add(self, wait):
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+        self._recent.append(wait)
+
+    def summary(self):
+        recent = sorted(self._recent)
+
+        def percentile(p):
+            if not recent:
+                return 0.0
+            return round(recent[min(len(recent) - 1, int(len(recent) * p))], 3)
+
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'max': round(self.max, 3)
+        }
+
+
+class ReviewPool:
+    """有界审查线程池，按优先级和项目公平调度，记录排队和执行中的任务数量"""
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        # 优先级 -> {项目: 任务队列}，项目按轮流顺序排列
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._waits = {priority: WaitStats() for priority in PRIORITY_NAMES}
+        self._workers = []
+        self._shutdown = False
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+
+    def submit(self, fn, *args, priority=PRIORITY_INTERACTIVE, project=None, enqueued_at=None, **kwargs):
+        """提交任务，超出工作线程数的任务在队列中等待
+
+        Args:
+            priority: 优先级（PRIORITY_*）
+            project: 所属项目，同一优先级内不同项目的任务轮流执行
+            enqueued_at: 任务最初进入队列的时间（如 Webhook 任务写入任务表的时间），用于统计等待时间
+        """
+        future = Future()
+        task = (future, fn, args, kwargs, priority, enqueued_at or time.time())
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError(f'审查线程池 {self.name} 已关闭')
+            self._queues[priority].setdefault(project, deque()).append(task)
+            self._queued += 1
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self._worker,
+                    name=f'review-{self.name}-{len(self._workers)}',
+                    daemon=True
+                )
+                self._workers.append(worker)
+                worker.start()
+            self._not_empty.notify()
+        return future
+
+    def _next_task(self):
+        """取出优先级最高的任务；同一优先级内取排在最前的项目，再把该项目移到末尾"""
+        for priority in sorted(self._queues):
+            projects = self._queues[priority]
+            if not projects:
+                continue
+            project, tasks = next(iter(projects.items()))
+            task = tasks.popleft()
+            if tasks:
+                projects.move_to_end(project)
+            else:
+                del projects[project]
+            return task
+        return None
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                task = self._next_task()
+                while task is None:
+                    if self._shutdown:
+                        return
+                    self._not_empty.wait()
+                    task = self._next_task()
+                future, fn, args, kwargs, priority, enqueued_at = task
+                self._queued -= 1
+                self._active += 1
+                self._waits[priority].add(time.time() - enqueued_at)
+            self._run(future, fn, args, kwargs)
+
+    def _run(self, future, fn, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            with self._lock:
+                self._active -= 1
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            with self._lock:
+                self._failed += 1
+            print(f"❌ [{self.name}] 审查任务异常: {e}")
+            import traceback
+            traceback.print_exc()
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+
+    def has_capacity(self):
+        """是否还有空闲的工作线程"""
+        with self._lock:
+            return self._queued + self._active < self.max_workers
+
+    def stats(self):
+        """返回线程池当前状态和各优先级的等待时间（秒）"""
+        with self._lock:
+            return {
+                'name': self.name,
+                'max_workers': self.max_workers,
+                'queued': self._queued,
+                'active': self._active,
+                'completed': self._completed,
+                'failed': self._failed,
+                'wait_seconds': {
+                    PRIORITY_NAMES[priority]: stats.summary()
+                    for priority, stats in self._waits.items()
+                }
+            }
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            self._shutdown = True
+            self._not_empty.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
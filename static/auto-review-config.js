@@ -41,6 +41,7 @@ window.loadAutoReviewConfig = async function() {
         const pushEnabled = data.auto_review_push_enabled === 'true';
         document.getElementById('autoReviewPushEnabled').checked = pushEnabled;
         document.getElementById('autoReviewPushNewBranchAllCommits').checked = data.auto_review_push_new_branch_all_commits === 'true';
+        document.getElementById('autoReviewPushRange').checked = data.auto_review_push_range === 'true';
         
         // 显示/隐藏选项
         document.getElementById('mrReviewOptions').classList.toggle('hidden', !mrEnabled);
@@ -82,7 +83,8 @@ window.saveAutoReviewConfig = async function() {
         auto_review_min_changes: document.getElementById('autoReviewMinChanges').value.trim() || '0',
         auto_review_push_enabled: document.getElementById('autoReviewPushEnabled').checked ? 'true' : 'false',
         auto_review_push_branches: '*',  // 所有分支
-        auto_review_push_new_branch_all_commits: document.getElementById('autoReviewPushNewBranchAllCommits').checked ? 'true' : 'false'
+        auto_review_push_new_branch_all_commits: document.getElementById('autoReviewPushNewBranchAllCommits').checked ? 'true' : 'false',
+        auto_review_push_range: document.getElementById('autoReviewPushRange').checked ? 'true' : 'false'
     };
     
     const messageDiv = document.getElementById('autoReviewConfigMessage');
@@ -105,7 +105,16 @@ function renderCommits(mrId, commits) {
                 <div class="w-full bg-gray-200 rounded-full h-1.5">
                     <div class="bg-green-600 h-1.5 rounded-full" style="width: 0%" id="commitProgressBar-${shortId}"></div>
                 </div>
-                <p class="mt-1 text-xs text-gray-600" id="commitProgressText-${shortId}">准备中...</p>
+                <div class="mt-1 flex justify-between items-center">
+                    <p class="text-xs text-gray-600" id="commitProgressText-${shortId}">准备中...</p>
+                    <button 
+                        onclick="window.cancelCommitReview('${shortId}')"
+                        class="text-xs text-red-600 hover:text-red-800 hidden"
+                        id="commitCancelBtn-${shortId}"
+                    >
+                        取消
+                    </button>
+                </div>
             </div>
             
             <!-- Commit 审查结果 -->
@@ -165,17 +174,29 @@ window.reviewCommit = async function(commitUrl, commitId, shortId) {
         
         const data = await response.json();
         const reviewId = data.review_id;
+        const cancelBtn = document.getElementById('commitCancelBtn-' + shortId);
+        cancelBtn.dataset.reviewId = reviewId;
+        cancelBtn.classList.remove('hidden');
         
-        // 轮询状态
-        const checkStatus = setInterval(async () => {
-            const statusResponse = await fetch('/api/commit/review/status/' + reviewId);
-            const status = await statusResponse.json();
+        // 订阅审查进度
+        watchReviewStatus(reviewId, (status) => {
             
             progressBar.style.width = (status.progress || 0) + '%';
             progressText.textContent = status.message || '处理中...';
             
+            // AI 生成过程中实时显示已生成的内容
+            if (status.status === 'running' && status.partial_output) {
+                const resultDiv = document.getElementById('commitResult-' + shortId);
+                const resultContent = document.getElementById('commitResultContent-' + shortId);
+                resultDiv.classList.remove('hidden');
+                resultContent.innerHTML = formatReviewResult(status.partial_output);
+            }
+            
+            if (status.status === 'success' || status.status === 'failed') {
+                cancelBtn.classList.add('hidden');
+            }
+            
             if (status.status === 'success') {
-                clearInterval(checkStatus);
                 btn.textContent = '审查完成 ✓';
                 btn.classList.remove('bg-green-600', 'hover:bg-green-700');
                 btn.classList.add('bg-green-500');
@@ -190,7 +211,6 @@ window.reviewCommit = async function(commitUrl, commitId, shortId) {
                     resultContent.innerHTML = formatReviewResult(status.output);
                 }
             } else if (status.status === 'failed') {
-                clearInterval(checkStatus);
                 btn.textContent = '审查失败';
                 btn.classList.remove('bg-green-600', 'hover:bg-green-700');
                 btn.classList.add('bg-red-600');
@@ -199,7 +219,7 @@ window.reviewCommit = async function(commitUrl, commitId, shortId) {
                 btn.disabled = false;
                 btn.classList.remove('opacity-50', 'cursor-not-allowed');
             }
-        }, 2000);
+        });
         
     } catch (error) {
         console.error('审查 Commit 失败:', error);
@@ -211,6 +231,21 @@ window.reviewCommit = async function(commitUrl, commitId, shortId) {
     }
 }
 
+// 取消正在进行的 Commit 审查
+window.cancelCommitReview = async function(shortId) {
+    const cancelBtn = document.getElementById('commitCancelBtn-' + shortId);
+    const reviewId = cancelBtn.dataset.reviewId;
+    if (!reviewId) return;
+    
+    cancelBtn.disabled = true;
+    try {
+        await fetch('/api/review/cancel/' + reviewId, {method: 'POST'});
+    } catch (error) {
+        console.error('取消审查失败:', error);
+        cancelBtn.disabled = false;
+    }
+}
+
 // 切换 Commit 结果显示
 window.toggleCommitResult = function(shortId) {
     const content = document.getElementById('commitResultContent-' + shortId);
@@ -507,16 +507,13 @@ window.reviewItem = async function(mrUrl, mrId) {
 
         const data = await response.json();
 
-        // 轮询状态
-        const checkStatus = setInterval(async () => {
-            const statusResponse = await fetch(`/api/review/status/${mrId}`);
-            const status = await statusResponse.json();
+        // 订阅审查进度
+        watchReviewStatus(mrId.toString(), (status) => {
 
             progressBar.style.width = `${status.progress || 0}%`;
             progressText.textContent = status.message || '处理中...';
 
             if (status.status === 'success') {
-                clearInterval(checkStatus);
                 btn.textContent = `${actionText}完成 ✓`;
                 btn.classList.remove('bg-blue-600', 'hover:bg-blue-700', 'bg-purple-600', 'hover:bg-purple-700');
                 btn.classList.add('bg-green-600');
@@ -534,7 +531,6 @@ window.reviewItem = async function(mrUrl, mrId) {
                 // 3秒后刷新列表
                 setTimeout(() => loadMRs(), 3000);
             } else if (status.status === 'failed') {
-                clearInterval(checkStatus);
                 btn.textContent = `${actionText}失败`;
                 btn.classList.remove('bg-blue-600', 'hover:bg-blue-700', 'bg-purple-600', 'hover:bg-purple-700');
                 btn.classList.add('bg-red-600');
@@ -543,7 +539,7 @@ window.reviewItem = async function(mrUrl, mrId) {
                 btn.disabled = false;
                 btn.classList.remove('opacity-50', 'cursor-not-allowed');
             }
-        }, 2000);
+        });
 
     } catch (error) {
         console.error(`${actionText}失败:`, error);
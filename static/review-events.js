@@ -0,0 +1,98 @@
+// 审查进度订阅（Server-Sent Events），替代定时轮询状态接口
+// 页面上所有审查共用一个 /api/review/events 连接，按 review_id 分发给订阅者，
+// 同时进行的审查较多时也不会占满浏览器对同一主机的连接数
+
+const reviewWatchers = {};
+let reviewEventSource = null;
+
+function isFinalReviewStatus(status) {
+    return status.status === 'success' || status.status === 'failed';
+}
+
+function dispatchReviewStatus(reviewId, status) {
+    const watcher = reviewWatchers[reviewId];
+    if (!watcher) return;
+    if (status.status === 'not_found') {
+        status = {status: 'failed', message: '审查任务不存在'};
+    }
+    watcher.received = true;
+    watcher.onStatus(status);
+    if (isFinalReviewStatus(status)) {
+        delete reviewWatchers[reviewId];
+        if (Object.keys(reviewWatchers).length === 0) {
+            closeReviewEvents();
+        }
+    }
+}
+
+// 查询一次审查的当前状态（订阅时、或审查已不在未结束列表中时）
+async function fetchReviewStatus(reviewId) {
+    try {
+        const response = await fetch('/api/review/status/' + encodeURIComponent(reviewId));
+        const status = await response.json();
+        const watcher = reviewWatchers[reviewId];
+        // 已经收到推送的状态比查询结果新，只在订阅后尚未收到推送时使用
+        if (watcher && (!watcher.received || isFinalReviewStatus(status) || status.status === 'not_found')) {
+            dispatchReviewStatus(reviewId, status);
+        }
+    } catch (error) {
+        console.error('查询审查状态失败:', error);
+    }
+}
+
+function openReviewEvents() {
+    if (reviewEventSource) return;
+    const source = new EventSource('/api/review/events');
+    reviewEventSource = source;
+
+    // 连接（或自动重连）后先收到所有未结束的审查
+    source.addEventListener('snapshot', (event) => {
+        const active = JSON.parse(event.data);
+        Object.keys(reviewWatchers).forEach(reviewId => {
+            if (active[reviewId]) {
+                dispatchReviewStatus(reviewId, active[reviewId]);
+            } else {
+                // 不在未结束列表中：已经结束（可能发生在断线期间）或不存在
+                fetchReviewStatus(reviewId);
+            }
+        });
+    });
+
+    source.addEventListener('update', (event) => {
+        const changes = JSON.parse(event.data);
+        Object.keys(changes).forEach(reviewId => dispatchReviewStatus(reviewId, changes[reviewId]));
+    });
+
+    source.onerror = () => {
+        // 网络中断时 EventSource 会自动重连，只有彻底关闭时才提示失败
+        if (source.readyState === EventSource.CLOSED) {
+            reviewEventSource = null;
+            Object.keys(reviewWatchers).forEach(reviewId => {
+                dispatchReviewStatus(reviewId, {status: 'failed', message: '进度连接已断开'});
+            });
+        }
+    };
+}
+
+function closeReviewEvents() {
+    if (reviewEventSource) {
+        reviewEventSource.close();
+        reviewEventSource = null;
+    }
+}
+
+/**
+ * 订阅单个审查的进度，审查结束（success / failed）后自动取消订阅
+ * onStatus(status) 在每次状态变化时调用
+ */
+function watchReviewStatus(reviewId, onStatus) {
+    const connected = reviewEventSource !== null;
+    reviewWatchers[reviewId] = {onStatus, received: false};
+    openReviewEvents();
+    // 连接已建立时不会再收到 snapshot，先查询一次当前状态
+    if (connected) {
+        fetchReviewStatus(reviewId);
+    }
+}
+
+console.log('✅ review-events.js 已加载');
@@ -69,7 +69,8 @@ window.loadWebhookGroups = async function() {
         data.groups.forEach(group => {
             const option = document.createElement('option');
             option.value = group.id;
-            option.textContent = `${group.full_path} (${group.project_count || '?'} 个项目)`;
+            const projectCount = group.project_count_error ? '?' : group.project_count;
+            option.textContent = `${group.full_path} (${projectCount} 个项目)`;
             option.dataset.fullPath = group.full_path;
             groupSelect.appendChild(option);
         });
@@ -94,16 +95,17 @@ window.loadGroupProjects = async function() {
     const groupName = groupSelect.options[groupSelect.selectedIndex].dataset.fullPath;
     const webhookUrl = document.getElementById('webhookUrl').value.trim();
     
-    try {
-        const url = `/api/webhook/group-projects/${groupId}${webhookUrl ? '?webhook_url=' + encodeURIComponent(webhookUrl) : ''}`;
-        const response = await fetch(url);
-        const data = await response.json();
-        
-        if (data.error) {
-            alert('加载项目失败: ' + data.error);
-            return;
-        }
-        
+    currentGroupProjects = [];
+    const params = new URLSearchParams({stream: '1'});
+    if (webhookUrl) {
+        params.set('webhook_url', webhookUrl);
+    }
+    
+    // 逐个接收各项目的 Webhook 检查结果。
+    // 用 fetch 读取 SSE：EventSource 无法携带 X-GitLab-Token，会让服务端退回使用配置文件中的 Token
+    const handlers = {};
+    
+    handlers.projects = (data) => {
         currentGroupProjects = data.projects;
         
         // 显示步骤 2
@@ -118,58 +120,142 @@ window.loadGroupProjects = async function() {
             return;
         }
         
-        // 统计已配置数量
-        let configuredCount = 0;
-        
         currentGroupProjects.forEach(project => {
             const div = document.createElement('div');
-            const isConfigured = project.has_webhook;
-            
-            if (isConfigured) {
-                configuredCount++;
-                div.className = 'flex items-center gap-2 p-2 bg-green-50 rounded border border-green-200';
-            } else {
-                div.className = 'flex items-center gap-2 p-2 hover:bg-gray-100 rounded';
-            }
-            
-            div.innerHTML = `
-                <input type="checkbox" 
-                    id="project-${project.id}" 
-                    value="${project.id}"
-                    class="project-checkbox rounded border-gray-300"
-                    ${isConfigured ? 'disabled' : ''}
-                    onchange="updateSelectedCount()">
-                <label for="project-${project.id}" class="flex-1 text-sm ${isConfigured ? 'text-gray-500' : 'cursor-pointer'}">
-                    ${project.path_with_namespace}
-                    ${isConfigured ? '<span class="ml-2 text-xs text-green-600">✓ 已配置</span>' : ''}
-                </label>
-            `;
+            div.id = 'project-row-' + project.id;
             projectList.appendChild(div);
+            renderGroupProject(project);
         });
         
         window.updateSelectedCount();
-        
-        // 显示信息
-        const unconfiguredCount = currentGroupProjects.length - configuredCount;
-        document.getElementById('groupInfo').innerHTML = `
-            已加载 ${groupName} 的 ${currentGroupProjects.length} 个项目
-            <span class="ml-2 text-green-600">(${configuredCount} 个已配置)</span>
-            <span class="ml-2 text-gray-600">(${unconfiguredCount} 个未配置)</span>
-        `;
-        document.getElementById('groupInfo').classList.remove('hidden');
+        updateGroupInfo(groupName, false);
         
         // 显示步骤 4 并加载配置
         document.getElementById('step4').classList.remove('hidden');
         if (typeof loadAutoReviewConfig === 'function') {
             loadAutoReviewConfig();
         }
-        
+    };
+    
+    handlers.webhook = (result) => {
+        const project = currentGroupProjects.find(p => p.id === result.id);
+        if (!project) return;
+        Object.assign(project, result);
+        renderGroupProject(project);
+        window.updateSelectedCount();
+        updateGroupInfo(groupName, false);
+    };
+    
+    handlers.done = () => {
+        updateGroupInfo(groupName, true);
+    };
+    
+    try {
+        const response = await fetch(`/api/webhook/group-projects/${groupId}?${params}`);
+        // 出错时服务端返回 JSON 错误而不是 SSE
+        if (!response.ok) {
+            const data = await response.json().catch(() => ({}));
+            throw new Error(data.error || `HTTP ${response.status}`);
+        }
+        await readEventStream(response, (event, data) => {
+            if (handlers[event]) handlers[event](data);
+        });
     } catch (error) {
         console.error('加载项目失败:', error);
-        alert('加载项目失败: ' + error.message);
+        if (currentGroupProjects.length > 0) {
+            updateGroupInfo(groupName, true);
+        } else {
+            alert('加载项目失败: ' + error.message);
+        }
     }
 }
 
+// 逐条解析 fetch 返回的 SSE 响应体，onEvent(事件名, JSON 数据)
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let index;
+        while ((index = buffer.indexOf('\n\n')) >= 0) {
+            const block = buffer.slice(0, index);
+            buffer = buffer.slice(index + 2);
+            let event = 'message';
+            const lines = [];
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    lines.push(line.slice(5).trim());
+                }
+            });
+            if (lines.length > 0) {
+                onEvent(event, JSON.parse(lines.join('\n')));
+            }
+        }
+    }
+}
+
+// 渲染单个项目的行（Webhook 状态：检查中 / 已配置 / 未配置 / 检查失败）
+function renderGroupProject(project) {
+    const div = document.getElementById('project-row-' + project.id);
+    if (!div) return;
+    
+    const isConfigured = project.has_webhook === true;
+    const previous = document.getElementById('project-' + project.id);
+    const wasChecked = previous ? previous.checked : false;
+    
+    let badge = '';
+    if (project.webhook_error) {
+        badge = `<span class="ml-2 text-xs text-yellow-600">⚠️ ${project.webhook_error}</span>`;
+    } else if (project.has_webhook === null) {
+        badge = '<span class="ml-2 text-xs text-gray-400">检查中...</span>';
+    } else if (isConfigured) {
+        badge = '<span class="ml-2 text-xs text-green-600">✓ 已配置</span>';
+    }
+    
+    if (isConfigured) {
+        div.className = 'flex items-center gap-2 p-2 bg-green-50 rounded border border-green-200';
+    } else {
+        div.className = 'flex items-center gap-2 p-2 hover:bg-gray-100 rounded';
+    }
+    
+    div.innerHTML = `
+        <input type="checkbox" 
+            id="project-${project.id}" 
+            value="${project.id}"
+            class="project-checkbox rounded border-gray-300"
+            ${isConfigured ? 'disabled' : ''}
+            ${wasChecked && !isConfigured ? 'checked' : ''}
+            onchange="updateSelectedCount()">
+        <label for="project-${project.id}" class="flex-1 text-sm ${isConfigured ? 'text-gray-500' : 'cursor-pointer'}">
+            ${project.path_with_namespace}
+            ${badge}
+        </label>
+    `;
+}
+
+// 显示组项目统计
+function updateGroupInfo(groupName, finished) {
+    const total = currentGroupProjects.length;
+    const configuredCount = currentGroupProjects.filter(p => p.has_webhook === true).length;
+    const errorCount = currentGroupProjects.filter(p => p.webhook_error).length;
+    const pendingCount = currentGroupProjects.filter(p => p.has_webhook === null && !p.webhook_error).length;
+    const unconfiguredCount = total - configuredCount - errorCount - pendingCount;
+    
+    document.getElementById('groupInfo').innerHTML = `
+        已加载 ${groupName} 的 ${total} 个项目
+        <span class="ml-2 text-green-600">(${configuredCount} 个已配置)</span>
+        <span class="ml-2 text-gray-600">(${unconfiguredCount} 个未配置)</span>
+        ${errorCount ? `<span class="ml-2 text-yellow-600">(${errorCount} 个检查失败)</span>` : ''}
+        ${!finished && pendingCount ? `<span class="ml-2 text-gray-400">(${pendingCount} 个检查中...)</span>` : ''}
+    `;
+    document.getElementById('groupInfo').classList.remove('hidden');
+}
+
 // 全选项目（只选择未配置的）
 window.selectAllProjects = function() {
     document.querySelectorAll('.project-checkbox:not(:disabled)').forEach(cb => {
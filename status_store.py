@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+审查状态存储
+保存每个审查任务的进度，并在状态变化时通知等待者（用于 SSE 推送）。
+单进程运行时使用内存存储；多进程部署时使用 SQLite 存储，任何进程都可以查询状态
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+# 审查已结束的状态，SSE 推送到这些状态后关闭连接
+FINAL_STATUSES = ('success', 'failed')
+
+
+class ReviewStatusStore:
+    """线程安全的审查状态字典，每次修改递增全局序号"""
+
+    def __init__(self):
+        self._items = {}
+        self._item_seq = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def _changed(self, review_id):
+        self._seq += 1
+        self._item_seq[review_id] = self._seq
+        self._cond.notify_all()
+
+    def set(self, review_id, status):
+        """替换整个状态"""
+        with self._cond:
+            self._items[review_id] = dict(status)
+            self._changed(review_id)
+
+    def update(self, review_id, **fields):
+        """更新部分字段"""
+        with self._cond:
+            self._items.setdefault(review_id, {}).update(fields)
+            self._changed(review_id)
+
+    def get(self, review_id, default=None):
+        """返回状态的副本"""
+        with self._cond:
+            status = self._items.get(review_id)
+            return dict(status) if status is not None else default
+
+    def active(self):
+        """所有未结束的审查"""
+        with self._cond:
+            return {
+                review_id: dict(status)
+                for review_id, status in self._items.items()
+                if status.get('status') not in FINAL_STATUSES
+            }
+
+    def snapshot(self):
+        """返回 (当前序号, 所有未结束的审查)"""
+        with self._cond:
+            return self._seq, self.active()
+
+    def wait_any(self, last_seq, timeout):
+        """等待任意审查的状态变化
+
+        返回 (序号, {review_id: 状态})，只包含 last_seq 之后变化过的审查。
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq, timeout=timeout)
+            changes = {
+                review_id: dict(self._items[review_id])
+                for review_id, seq in self._item_seq.items()
+                if seq > last_seq
+            }
+            return self._seq, changes
+
+
+class SQLiteReviewStatusStore:
+    """基于 SQLite 的审查状态存储，接口与 ReviewStatusStore 相同
+
+    全局序号保存在每条状态的 seq 列中，等待变化时定期查询数据库；
+    同一进程内的修改会立即唤醒等待者。
+    """
+
+    def __init__(self, db_file, poll_interval=0.3, retention=86400):
+        self.db_file = db_file
+        self.poll_interval = poll_interval
+        # 已结束的审查保留的秒数
+        self.retention = retention
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS review_status (
+                review_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                final INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_review_status_seq ON review_status (seq)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_review_status_final ON review_status (final, updated_at)')
+        conn.commit()
+        conn.close()
+
+    def _write(self, review_id, change, prune=False):
+        """在写事务中读取旧状态、计算新状态并分配新的序号"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM review_status WHERE review_id = ?', (review_id,)).fetchone()
+            status = change(json.loads(row['data']) if row else {})
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM review_status').fetchone()[0]
+            conn.execute('''
+                INSERT OR REPLACE INTO review_status (review_id, data, seq, final, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                review_id, json.dumps(status, ensure_ascii=False), seq,
+                1 if status.get('status') in FINAL_STATUSES else 0, now
+            ))
+            if prune:
+                conn.execute(
+                    'DELETE FROM review_status WHERE final = 1 AND updated_at < ?',
+                    (now - self.retention,)
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        with self._cond:
+            self._cond.notify_all()
+
+    def set(self, review_id, status):
+        """替换整个状态（新审查开始时调用，顺便清理过期的已结束审查）"""
+        self._write(review_id, lambda old: dict(status), prune=True)
+
+    def update(self, review_id, **fields):
+        """更新部分字段"""
+        self._write(review_id, lambda old: dict(old, **fields))
+
+    def get(self, review_id, default=None):
+        conn = self._connect()
+        row = conn.execute('SELECT data FROM review_status WHERE review_id = ?', (review_id,)).fetchone()
+        conn.close()
+        return json.loads(row['data']) if row else default
+
+    def active(self):
+        return self.snapshot()[1]
+
+    def snapshot(self):
+        conn = self._connect()
+        seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM review_status').fetchone()[0]
+        rows = conn.execute('SELECT review_id, data FROM review_status WHERE final = 0').fetchall()
+        conn.close()
+        return seq, {row['review_id']: json.loads(row['data']) for row in rows}
+
+    def _sleep(self, deadline):
+        with self._cond:
+            self._cond.wait(max(0, min(self.poll_interval, deadline - time.time())))
+
+    def wait_any(self, last_seq, timeout):
+        deadline = time.time() + timeout
+        while True:
+            conn = self._connect()
+            rows = conn.execute(
+                'SELECT review_id, data, seq FROM review_status WHERE seq > ? ORDER BY seq',
+                (last_seq,)
+            ).fetchall()
+            conn.close()
+            if rows:
+                return rows[-1]['seq'], {row['review_id']: json.loads(row['data']) for row in rows}
+            if time.time() >= deadline:
+                return last_seq, {}
+            self._sleep(deadline)
+
+
+class CancelFlag(threading.Event):
+    """审查的取消标记
+
+    除了本进程调用 set()，还会定期检查状态中的 cancel_requested 字段，
+    取消请求被其他进程接收时也能中止本进程中的审查。
+    """
+
+    def __init__(self, store, review_id, interval=1):
+        super().__init__()
+        self._store = store
+        self._review_id = review_id
+        self._interval = interval
+        self._checked = 0.0
+
+    def is_set(self):
+        if super().is_set():
+            return True
+        now = time.monotonic()
+        if now - self._checked >= self._interval:
+            self._checked = now
+            if (self._store.get(self._review_id) or {}).get('cancel_requested'):
+                self.set()
+        return super().is_set()
+
+
+class ChildCancelFlag(threading.Event):
+    """从属于上级取消标记的取消标记
+
+    上级标记被设置时本标记也视为已设置；单独调用 set() 只影响本标记，
+    用于在一次审查内部中止并行的分片生成，而不取消整个审查。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__()
+        self._parent = parent
+
+    def is_set(self):
+        if self._parent is not None and self._parent.is_set():
+            return True
+        return super().is_set()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+带过期时间的内存缓存
+用于缓存变化不频繁的 GitLab 查询结果（如组的项目数量、MR 包含的 commit）
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """线程安全的过期缓存，条目数超过 maxsize 时淘汰最久未使用的条目"""
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, default=None):
+        """返回未过期的缓存值，不存在或已过期时返回 default"""
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[1] <= now:
+                if item is not None:
+                    del self._items[key]
+                self._misses += 1
+                return default
+            self._items.move_to_end(key)
+            self._hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses
+            }
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Webhook 配置索引
+把各项目的 Webhook 保存在 reviews.db 中，由后台线程增量刷新，
+“已配置项目”页面直接查询本地索引，不再逐个项目请求 GitLab。
+不同 Token 可见的项目和 Webhook 不同，索引按 scope（GitLab 地址 + Token 的摘要）分别保存
+"""
+
+import sqlite3
+import time
+
+
+def hook_url_path(url):
+    """提取 Webhook 地址的路径部分
+
+    例如: http://localhost:8080/webhook/gitlab -> /webhook/gitlab
+    """
+    if '://' not in url:
+        return url
+    rest = url.split('://', 1)[1]
+    if '/' not in rest:
+        return '/'
+    return '/' + rest.split('/', 1)[1]
+
+
+class WebhookInventory:
+    """基于 SQLite 的项目 Webhook 索引"""
+
+    def __init__(self, db_file, max_age=3600, batch_size=100):
+        self.db_file = db_file
+        # 超过 max_age 秒未检查的项目会重新检查（Webhook 变更不会更新项目的活跃时间）
+        self.max_age = max_age
+        # 每轮最多检查的项目数
+        self.batch_size = batch_size
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        """创建索引表"""
+        conn = self._connect()
+        # 旧版本的索引不区分 Token，删除后按 scope 重新建立
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(webhook_projects)')}
+        if columns and 'scope' not in columns:
+            conn.execute('DROP TABLE webhook_projects')
+            conn.execute('DROP TABLE IF EXISTS webhook_hooks')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS webhook_projects (
+                scope TEXT NOT NULL,
+                project_id INTEGER NOT NULL,
+                name TEXT,
+                path_with_namespace TEXT,
+                web_url TEXT,
+                namespace TEXT,
+                last_activity_at TEXT,
+                checked_activity_at TEXT,
+                checked_at REAL,
+                check_error TEXT,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (scope, project_id)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS webhook_hooks (
+                scope TEXT NOT NULL,
+                hook_id INTEGER NOT NULL,
+                project_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                url_path TEXT NOT NULL,
+                push_events INTEGER NOT NULL DEFAULT 0,
+                merge_requests_events INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (scope, hook_id)
+            )
+        ''')
+        # 各 scope 的刷新状态，多个进程共享；refreshing_until 为刷新租约，防止多个进程同时刷新
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS webhook_inventory_scopes (
+                scope TEXT PRIMARY KEY,
+                refreshing_until REAL,
+                last_refresh REAL,
+                last_error TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_webhook_projects_activity
+            ON webhook_projects (scope, last_activity_at)
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_webhook_hooks_url ON webhook_hooks (scope, url)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_webhook_hooks_path ON webhook_hooks (scope, url_path)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_webhook_hooks_project ON webhook_hooks (scope, project_id)')
+        conn.commit()
+        conn.close()
+
+    def claim_refresh(self, scope, lease=900):
+        """取得 scope 的刷新租约；其他进程正在刷新时返回 False"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('INSERT OR IGNORE INTO webhook_inventory_scopes (scope) VALUES (?)', (scope,))
+        cursor = conn.execute('''
+            UPDATE webhook_inventory_scopes SET refreshing_until = ?
+            WHERE scope = ? AND (refreshing_until IS NULL OR refreshing_until < ?)
+        ''', (now + lease, scope, now))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount > 0
+
+    def finish_refresh(self, scope, error=None):
+        """释放刷新租约，记录本次刷新的结果"""
+        conn = self._connect()
+        if error:
+            conn.execute(
+                'UPDATE webhook_inventory_scopes SET refreshing_until = NULL, last_error = ? WHERE scope = ?',
+                (error, scope)
+            )
+        else:
+            conn.execute('''
+                UPDATE webhook_inventory_scopes SET refreshing_until = NULL, last_error = NULL, last_refresh = ?
+                WHERE scope = ?
+            ''', (time.time(), scope))
+        conn.commit()
+        conn.close()
+
+    def scope_state(self, scope):
+        """返回 scope 的刷新状态 {'refreshing', 'last_refresh', 'last_error'}"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT refreshing_until, last_refresh, last_error FROM webhook_inventory_scopes WHERE scope = ?',
+            (scope,)
+        ).fetchone()
+        conn.close()
+        if row is None:
+            return {'refreshing': False, 'last_refresh': None, 'last_error': None}
+        return {
+            'refreshing': bool(row['refreshing_until'] and row['refreshing_until'] > time.time()),
+            'last_refresh': row['last_refresh'],
+            'last_error': row['last_error']
+        }
+
+    def sync_projects(self, scope, projects, complete=True):
+        """同步 scope 可见的项目列表，返回需要检查 Webhook 的项目 ID（按活跃时间倒序）
+
+        需要检查的项目：从未检查过、检查后有新的活动、或超过 max_age 未检查。
+        complete 为 True 时表示 projects 是完整列表，会删除该 scope 下已不可见的项目。
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.executemany('''
+            INSERT INTO webhook_projects
+                (scope, project_id, name, path_with_namespace, web_url, namespace, last_activity_at, seen_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (scope, project_id) DO UPDATE SET
+                name = excluded.name,
+                path_with_namespace = excluded.path_with_namespace,
+                web_url = excluded.web_url,
+                namespace = excluded.namespace,
+                last_activity_at = excluded.last_activity_at,
+                seen_at = excluded.seen_at
+        ''', [
+            (
+                scope,
+                project['id'],
+                project['name'],
+                project['path_with_namespace'],
+                project['web_url'],
+                (project.get('namespace') or {}).get('full_path', ''),
+                project.get('last_activity_at'),
+                now
+            )
+            for project in projects
+        ])
+
+        if complete:
+            conn.execute('''
+                DELETE FROM webhook_hooks WHERE scope = ? AND project_id IN
+                    (SELECT project_id FROM webhook_projects WHERE scope = ? AND seen_at < ?)
+            ''', (scope, scope, now))
+            conn.execute('DELETE FROM webhook_projects WHERE scope = ? AND seen_at < ?', (scope, now))
+
+        rows = conn.execute('''
+            SELECT project_id FROM webhook_projects
+            WHERE scope = ?
+              AND (checked_at IS NULL
+                   OR checked_activity_at IS NOT last_activity_at
+                   OR checked_at < ?)
+            ORDER BY last_activity_at DESC
+            LIMIT ?
+        ''', (scope, now - self.max_age, self.batch_size)).fetchall()
+        conn.commit()
+        conn.close()
+        return [row['project_id'] for row in rows]
+
+    def save_hooks(self, scope, project_id, hooks=None, error=None):
+        """保存项目的检查结果；检查失败时保留上次的 Webhook，只记录错误"""
+        now = time.time()
+        conn = self._connect()
+        if error:
+            conn.execute(
+                'UPDATE webhook_projects SET checked_at = ?, check_error = ? WHERE scope = ? AND project_id = ?',
+                (now, error, scope, project_id)
+            )
+        else:
+            conn.execute('DELETE FROM webhook_hooks WHERE scope = ? AND project_id = ?', (scope, project_id))
+            conn.executemany('''
+                INSERT OR REPLACE INTO webhook_hooks
+                    (scope, hook_id, project_id, url, url_path, push_events, merge_requests_events)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (
+                    scope,
+                    hook['id'],
+                    project_id,
+                    hook.get('url', ''),
+                    hook_url_path(hook.get('url', '')),
+                    1 if hook.get('push_events') else 0,
+                    1 if hook.get('merge_requests_events') else 0
+                )
+                for hook in hooks or []
+            ])
+            conn.execute('''
+                UPDATE webhook_projects
+                SET checked_at = ?, checked_activity_at = last_activity_at, check_error = NULL
+                WHERE scope = ? AND project_id = ?
+            ''', (now, scope, project_id))
+        conn.commit()
+        conn.close()
+
+    def query(self, scope, match_mode='exact', webhook_url=''):
+        """查询 scope 下已配置 Webhook 的项目，每个项目返回第一个匹配的 Webhook
+
+        match_mode:
+            exact: Webhook 地址与 webhook_url 完全相同
+            contains: 路径部分相同（忽略主机名和端口）
+            all: 所有配置了 Webhook 的项目
+        未指定 webhook_url 时等同于 all。
+        """
+        if match_mode == 'all' or not webhook_url:
+            condition, params = '1 = 1', ()
+        elif match_mode == 'contains':
+            condition, params = 'h.url_path = ?', (hook_url_path(webhook_url),)
+        elif match_mode == 'exact':
+            condition, params = 'h.url = ?', (webhook_url,)
+        else:
+            return []
+
+        conn = self._connect()
+        # SQLite 中与 MIN() 一起查询的其他列取自 hook_id 最小的那一行
+        rows = conn.execute(f'''
+            SELECT p.project_id, p.name, p.path_with_namespace, p.web_url, p.namespace,
+                   MIN(h.hook_id) AS hook_id, h.url, h.push_events, h.merge_requests_events
+            FROM webhook_hooks h
+            JOIN webhook_projects p ON p.scope = h.scope AND p.project_id = h.project_id
+            WHERE h.scope = ? AND {condition}
+            GROUP BY h.project_id
+            ORDER BY p.last_activity_at DESC
+        ''', (scope, *params)).fetchall()
+        conn.close()
+        return [
+            {
+                'id': row['project_id'],
+                'name': row['name'],
+                'path_with_namespace': row['path_with_namespace'],
+                'web_url': row['web_url'],
+                'namespace': row['namespace'],
+                'hook_id': row['hook_id'],
+                'hook_url': row['url'],
+                'push_events': bool(row['push_events']),
+                'merge_requests_events': bool(row['merge_requests_events'])
+            }
+            for row in rows
+        ]
+
+    def stats(self, scope):
+        """返回 scope 的索引状态"""
+        conn = self._connect()
+        row = conn.execute('''
+            SELECT COUNT(*) AS projects,
+                   COUNT(checked_at) AS checked,
+                   SUM(CASE WHEN check_error IS NOT NULL THEN 1 ELSE 0 END) AS errors,
+                   MIN(checked_at) AS oldest_check,
+                   MAX(checked_at) AS latest_check
+            FROM webhook_projects WHERE scope = ?
+        ''', (scope,)).fetchone()
+        hooks = conn.execute('SELECT COUNT(*) FROM webhook_hooks WHERE scope = ?', (scope,)).fetchone()[0]
+        conn.close()
+        return {
+            'projects': row['projects'],
+            'checked': row['checked'],
+            'errors': row['errors'] or 0,
+            'hooks': hooks,
+            'oldest_check': row['oldest_check'],
+            'latest_check': row['latest_check']
+        }
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Webhook 落盘文件（spool）
+Webhook 请求只把原始请求体追加到文件末尾后立即返回，
+由后台线程按记录的读取位置批量解析并写入任务队列。
+多进程部署时各进程追加记录时持有文件的共享锁，清空文件时持有排他锁
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 只支持单进程部署（waitress），进程内的锁已足够
+    fcntl = None
+
+
+@contextmanager
+def _flock(fd, operation):
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(fd, operation)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class WebhookSpool:
+    """只追加的 Webhook 记录文件，每行一条 JSON 记录"""
+
+    def __init__(self, spool_file, fsync=False, compact_bytes=64 * 1024 * 1024, read_bytes=4 * 1024 * 1024):
+        self.spool_file = spool_file
+        self.offset_file = spool_file + '.offset'
+        # 每次追加后是否 fsync（关闭时只保证进程崩溃不丢数据）
+        self.fsync = fsync
+        # 文件已全部处理且超过该大小时清空
+        self.compact_bytes = compact_bytes
+        # 每次最多读取的字节数
+        self.read_bytes = read_bytes
+        self.wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._fd = None
+        self._appended = 0
+
+    def _open(self):
+        if self._fd is None:
+            os.makedirs(os.path.dirname(self.spool_file), exist_ok=True)
+            self._fd = os.open(self.spool_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        return self._fd
+
+    def append(self, event_type, body):
+        """追加一条 Webhook 记录（body 为原始请求体 bytes）"""
+        record = json.dumps({
+            'event': event_type,
+            'received_at': time.time(),
+            'body': body.decode('utf-8', errors='replace')
+        }, ensure_ascii=False).encode('utf-8') + b'\n'
+        with self._lock:
+            fd = self._open()
+            # O_APPEND 的单次 write 不会与其他写入交错；共享锁阻止其他进程在写入时清空文件
+            with _flock(fd, fcntl.LOCK_SH if fcntl else None):
+                os.write(fd, record)
+                if self.fsync:
+                    os.fsync(fd)
+            self._appended += 1
+        self.wakeup.set()
+
+    def read_offset(self):
+        try:
+            with open(self.offset_file) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        tmp_file = self.offset_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.offset_file)
+
+    def read_new(self):
+        """读取上次处理位置之后的完整记录
+
+        Returns:
+            (记录列表, 新的读取位置)；无法解析的行以 None 表示
+        """
+        offset = self.read_offset()
+        try:
+            with open(self.spool_file, 'rb') as f:
+                f.seek(offset)
+                data = f.read(self.read_bytes)
+        except FileNotFoundError:
+            return [], offset
+
+        # 只处理以换行结尾的完整记录，写了一半的记录留到下次
+        end = data.rfind(b'\n')
+        if end < 0:
+            if len(data) >= self.read_bytes:
+                # 单条记录超过读取上限，跳过这一段避免卡住
+                return [None], offset + len(data)
+            return [], offset
+
+        records = []
+        for line in data[:end].split(b'\n'):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+        return records, offset + end + 1
+
+    def commit(self, offset):
+        """记录已处理到的位置；文件全部处理完且过大时清空
+
+        清空前取得排他锁，其他进程此时无法追加记录，检查大小和清空之间不会丢失新记录。
+        """
+        self._write_offset(offset)
+        if offset < self.compact_bytes:
+            return
+        with self._lock:
+            try:
+                fd = os.open(self.spool_file, os.O_WRONLY)
+            except OSError:
+                return
+            try:
+                with _flock(fd, fcntl.LOCK_EX if fcntl else None):
+                    if os.fstat(fd).st_size == offset:
+                        os.ftruncate(fd, 0)
+                        self._write_offset(0)
+            finally:
+                os.close(fd)
+
+    def backlog_bytes(self):
+        """尚未处理的字节数"""
+        try:
+            return max(0, os.path.getsize(self.spool_file) - self.read_offset())
+        except OSError:
+            return 0
+
+    def stats(self):
+        return {
+            'file': self.spool_file,
+            'appended': self._appended,
+            'backlog_bytes': self.backlog_bytes()
+        }
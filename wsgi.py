@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+生产环境 WSGI 入口
+
+    gunicorn -c gunicorn.conf.py wsgi:app    # 多进程（Linux / macOS）
+    python3 wsgi.py                          # 单进程多线程（waitress，适用于 Windows）
+
+审查状态保存在 reviews.db 中，任何进程都可以查询和推送审查进度；
+后台线程（任务调度、Webhook spool 导入、Webhook 索引刷新）只在一个进程中运行
+"""
+
+import os
+
+import app as dashboard
+
+dashboard.init_database()
+dashboard.use_shared_review_status()
+# 清除上次运行留下的进程指标文件；gunicorn 各 worker 在 post_worker_init 中开始写入指标
+dashboard.registry.reset_multiprocess(dashboard.METRICS_DIR)
+
+app = dashboard.app
+
+if __name__ == '__main__':
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit('未安装 waitress，请执行 pip install waitress，或使用 gunicorn -c gunicorn.conf.py wsgi:app')
+    
+    # 合并独立 worker 进程（python3 app.py worker）的指标
+    dashboard.enable_shared_metrics()
+    dashboard.start_background_services()
+    print("🚀 PR-Agent 可视化管理平台（waitress）: http://localhost:8080")
+    serve(app, host='0.0.0.0', port=8080, threads=int(os.environ.get('PR_AGENT_WEB_THREADS', 16)))